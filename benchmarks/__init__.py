@@ -0,0 +1,8 @@
+"""
+Benchmarks for the conversion, payload building, merge and statistics stages.
+
+    python -m benchmarks --sizes 10k,100k
+    python -m benchmarks --sizes 10k,100k --save-baseline
+
+Inputs are generated by `benchmarks.synthetic` and cached under `bench_data/`.
+"""
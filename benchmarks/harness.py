@@ -0,0 +1,257 @@
+"""
+Time and memory-profile each stage on synthetic data and compare with a baseline.
+
+Every stage runs in a fresh process, so its peak RSS is its own. Results are
+written as JSON; when a baseline is given and a stage is slower or bigger than
+the baseline by more than the allowed margin, every regression is printed and
+the exit status is 1.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from benchmarks.synthetic import DOI_PREFIX, generate, parse_size
+
+STAGES = ["convert", "convert_parallel", "payloads", "mint", "merge", "stats_cold", "stats_warm"]
+DEFAULT_STAGES = ["convert", "payloads", "merge", "stats_cold", "stats_warm"]
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+# Differences this small are noise, whatever the percentage
+TIME_SLACK_SECONDS = 0.05
+MEMORY_SLACK_MB = 5.0
+
+
+#####################################################
+
+# Stages: each returns the function to time, after any untimed setup
+
+def _converted(paths, scratch):
+    """The Datacite import CSV for this data set, converting it (untimed) if needed."""
+    from super_duper.convert import DEFAULT_TYPE_MAPPING, TypeMatcher, process_csv
+
+    import_csv = os.path.join(scratch, "datacite_import.csv")
+    if not os.path.exists(import_csv):
+        process_csv(paths["dspace_export"], import_csv, TypeMatcher(DEFAULT_TYPE_MAPPING))
+    return import_csv
+
+
+def stage_convert(paths, scratch, workers=1):
+    from super_duper.convert import DEFAULT_TYPE_MAPPING, TypeMatcher, process_csv
+
+    type_mapping = TypeMatcher(DEFAULT_TYPE_MAPPING)
+    output = os.path.join(scratch, f"convert_{workers}.csv")
+
+    def run():
+        return process_csv(paths["dspace_export"], output, type_mapping, workers=workers)[0]
+    return run
+
+
+def stage_convert_parallel(paths, scratch, workers=1):
+    return stage_convert(paths, scratch, workers=max(workers, 2))
+
+
+def stage_payloads(paths, scratch, workers=1):
+    from super_duper.mint import build_payload_batch
+
+    import_csv = _converted(paths, scratch)
+    batch = os.path.join(scratch, "payloads.jsonl")
+
+    def run():
+        return build_payload_batch(import_csv, batch, DOI_PREFIX)
+    return run
+
+
+def stage_mint(paths, scratch, workers=1):
+    """Minting against the local mock API, so this measures the client side only."""
+    from super_duper.mint import run_mint
+    from super_duper.mockapi import MockDataCite
+
+    import_csv = os.path.abspath(_converted(paths, scratch))
+    # Journals go to ./log; this process is the stage's own, so moving is harmless
+    os.chdir(scratch)
+    mock = MockDataCite(port=0, seed=0).start()
+    credentials = {"url": mock.url, "doiPrefix": DOI_PREFIX, "username": "bench", "password": "bench"}
+
+    def run():
+        try:
+            summary = run_mint(import_csv, "datacite_export.csv", credentials, concurrency=8, rate_limit=0,
+                               log_copy=False)
+        finally:
+            mock.stop()
+        return summary["submitted"]
+    return run
+
+
+def stage_merge(paths, scratch, workers=1):
+    from super_duper.merge import merge_dois
+
+    output = os.path.join(scratch, "updated_dspace_export.csv")
+
+    def run():
+        summary = merge_dois(paths["datacite_export"], paths["dspace_export"], output)
+        return summary["dois_added"] + summary["rows_skipped"] + summary["rows_unmatched"]
+    return run
+
+
+def stage_stats_cold(paths, scratch, workers=1):
+    from super_duper.stats import STATS_INDEX_FILE, collect_doi_stats
+
+    index = os.path.join(paths["log_dir"], STATS_INDEX_FILE)
+    if os.path.exists(index):
+        os.unlink(index)
+
+    def run():
+        return sum(collect_doi_stats(paths["log_dir"])["by_status"].values())
+    return run
+
+
+def stage_stats_warm(paths, scratch, workers=1):
+    from super_duper.stats import collect_doi_stats
+
+    collect_doi_stats(paths["log_dir"])
+
+    def run():
+        return sum(collect_doi_stats(paths["log_dir"])["by_status"].values())
+    return run
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def run_stage(stage, paths, scratch, workers):
+    """Run one stage in this (fresh) process: returns rows, seconds and peak RSS."""
+    run = globals()[f"stage_{stage}"](paths, scratch, workers)
+    start = time.perf_counter()
+    rows = run()
+    seconds = time.perf_counter() - start
+    return {"rows": rows, "seconds": seconds, "peak_rss_mb": peak_rss_mb()}
+
+
+def measure(stage, paths, scratch, workers, repeat):
+    """Best time and worst memory over `repeat` runs, each in its own process."""
+    # Spawned rather than forked, so no run inherits the memory of the harness
+    context = multiprocessing.get_context("spawn")
+    runs = []
+    for _ in range(repeat):
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            runs.append(pool.submit(run_stage, stage, paths, scratch, workers).result())
+    best = min(runs, key=lambda run: run["seconds"])
+    memory = [run["peak_rss_mb"] for run in runs if run["peak_rss_mb"] is not None]
+    return {
+        "rows": best["rows"],
+        "seconds": round(best["seconds"], 4),
+        "rows_per_second": round(best["rows"] / best["seconds"]) if best["seconds"] else None,
+        "peak_rss_mb": round(max(memory), 1) if memory else None,
+    }
+
+
+#####################################################
+
+# Baseline comparison
+
+def compare(results, baseline, max_slowdown, max_memory_growth):
+    """Lines describing every result that regressed past the allowed margins."""
+    regressions = []
+    for key, result in results.items():
+        before = baseline.get(key)
+        if not before:
+            continue
+        if result["seconds"] > before["seconds"] * (1 + max_slowdown) + TIME_SLACK_SECONDS:
+            regressions.append(
+                f"{key}: {result['seconds']:.3f}s vs baseline {before['seconds']:.3f}s "
+                f"({result['seconds'] / before['seconds'] - 1:+.0%}, limit {max_slowdown:+.0%})"
+            )
+        if result.get("peak_rss_mb") and before.get("peak_rss_mb") and \
+                result["peak_rss_mb"] > before["peak_rss_mb"] * (1 + max_memory_growth) + MEMORY_SLACK_MB:
+            regressions.append(
+                f"{key}: peak {result['peak_rss_mb']:.1f} MB vs baseline {before['peak_rss_mb']:.1f} MB "
+                f"({result['peak_rss_mb'] / before['peak_rss_mb'] - 1:+.0%}, limit {max_memory_growth:+.0%})"
+            )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="10k,100k", help="Comma-separated row counts, e.g. 10k,100k,1m (default: %(default)s)")
+    parser.add_argument("--stages", default=",".join(DEFAULT_STAGES),
+                        help=f"Comma-separated stages out of {', '.join(STAGES)} (default: %(default)s)")
+    parser.add_argument("--data-dir", default="bench_data", help="Where generated inputs are cached (default: %(default)s)")
+    parser.add_argument("--output", default="bench_results.json", help="Results JSON (default: %(default)s)")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="Baseline results JSON (default: %(default)s)")
+    parser.add_argument("--save-baseline", action="store_true", help="Also store these results as the new baseline")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per stage; the fastest counts (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Processes for convert_parallel (default: %(default)s)")
+    parser.add_argument("--max-slowdown", type=float, default=0.25, help="Allowed slowdown as a fraction (default: %(default)s)")
+    parser.add_argument("--max-memory-growth", type=float, default=0.25, help="Allowed peak memory growth as a fraction (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        parser.error(f"unknown stage(s): {', '.join(unknown)}")
+
+    results = {}
+    for size in [size.strip() for size in args.sizes.split(",") if size.strip()]:
+        rows = parse_size(size)
+        directory = os.path.join(args.data_dir, str(rows))
+        print(f"Preparing {rows} rows in {directory}...", flush=True)
+        paths = generate(directory, rows)
+        scratch = os.path.join(directory, "scratch")
+        shutil.rmtree(scratch, ignore_errors=True)
+        os.makedirs(scratch)
+
+        for stage in stages:
+            key = f"{size}/{stage}"
+            results[key] = result = measure(stage, paths, scratch, args.workers, args.repeat)
+            print(f"{key:<24} {result['seconds']:>9.3f}s {result['rows_per_second'] or 0:>10} rows/s "
+                  f"{result['peak_rss_mb'] or 0:>8.1f} MB", flush=True)
+
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+    print(f"Results saved to {args.output}")
+
+    status = 0
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline["results"], args.max_slowdown, args.max_memory_growth)
+        if regressions:
+            print(f"\nPERFORMANCE REGRESSION against {args.baseline}:", file=sys.stderr)
+            for line in regressions:
+                print(f"  {line}", file=sys.stderr)
+            status = 1
+        else:
+            print(f"No regressions against {args.baseline}.")
+    elif not args.save_baseline:
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one.")
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    return status
@@ -0,0 +1,176 @@
+"""
+Synthetic inputs shaped like the real files, at any size.
+
+The DSpace export uses the header of `dspace_export.csv.sample`, with `||`
+multi-valued contributors and URIs and multi-line provenance. The DataCite export
+matches its rows the way a mint run would (mostly 201s, some errors, some rows
+never sent), and the log directory holds that export split into per-run
+`datacite_export_*.csv` files spread over several months.
+Everything is seeded, so the same size always gives the same files.
+"""
+import csv
+import os
+import random
+from datetime import datetime, timedelta
+
+from super_duper.logs import EXPORT_LOG_PREFIX
+from super_duper.records import DATACITE_EXPORT_FIELDS
+
+DSPACE_EXPORT_FIELDS = [
+    "id", "collection", "dc.contributor.other[en]", "dc.date.accessioned[]", "dc.date.available[]",
+    "dc.date.issued[]", "dc.description.abstract[en]", "dc.description.fulltext[en]",
+    "dc.description.provenance[en]", "dc.digitization.details[en]", "dc.format.extent[en]",
+    "dc.format.medium[en]", "dc.format.mimetype[en]", "dc.identifier.uri[en]", "dc.identifier.uri[]",
+    "dc.language.iso[en]", "dc.publisher[en]", "dc.subject.lcsh[en]", "dc.title[en]", "dc.type[en]",
+]
+
+FAMILY_NAMES = ["Hattori", "Uyene", "Nagao", "Kitamura", "Sekihama", "Combe", "Smith", "MacDonald",
+                "Nguyen", "Tremblay", "Wilson", "Singh", "Brown", "Lee", "Martin", "O'Neill"]
+GIVEN_NAMES = ["Yoshio", "Tekutaro", "Renichi", "K.", "Shigekuni", "Harvey", "Jane", "Ann Marie",
+               "Pierre", "Li", "Harpreet", "Sarah", "J. R.", "Margaret", "Thomas"]
+DSPACE_TYPES = ["Archival Material", "Article", "Book", "Book chapter", "Thesis", "Oral History",
+                "Research Report", "Map", "Poster", "Video", "Conference paper", "Dataset", "Image",
+                "Learning Object", "Other", "Presentation", "Working Paper", "Sound recording", ""]
+SUBJECTS = ["Immigration", "Naturalization", "Forestry", "Fisheries", "Coal mining", "Education",
+            "First Nations", "Nanaimo (B.C.)", "Vancouver Island (B.C.)"]
+DATE_FORMATS = ["%Y-%m-%d", "%Y", "%Y-%m", "%d-%b-%Y"]
+
+# Rows per log file in the synthetic log directory
+ROWS_PER_LOG_FILE = 5000
+
+# DOI prefix used for synthetic DOIs
+DOI_PREFIX = "10.83129"
+
+
+def parse_size(text):
+    """'10k' -> 10000, '1m' -> 1000000, '2500' -> 2500."""
+    text = text.strip().lower()
+    multiplier = {"k": 1_000, "m": 1_000_000}.get(text[-1:], 1)
+    return int(text.rstrip("km")) * multiplier
+
+
+def _name(rng):
+    return f"{rng.choice(FAMILY_NAMES)}, {rng.choice(GIVEN_NAMES)}" + rng.choice(["", "", "", "."])
+
+
+def handle_uri(i):
+    return f"http://hdl.handle.net/10613/{100000 + i}"
+
+
+def dspace_export_row(rng, i):
+    accessioned = datetime(2014, 1, 1) + timedelta(seconds=rng.randrange(10 * 365 * 86400))
+    stamp = accessioned.strftime("%Y-%m-%dT%H:%M:%SZ")
+    issued = datetime(1880, 1, 1) + timedelta(days=rng.randrange(140 * 365))
+    contributors = "||".join(_name(rng) for _ in range(rng.choice([0, 1, 1, 2, 2, 2, 3, 5])))
+    title = f"{rng.choice(['Naturalization documents', 'Field notes', 'Annual report', 'Interview'])}: {_name(rng)} #{i}"
+    pdf = f"item{i}.pdf"
+    size = rng.randrange(100_000, 50_000_000)
+    checksum = "%032x" % rng.getrandbits(128)
+    provenance = (
+        f"Submitted by Sarah  Ogden  (sarah.ogden@viu.ca) on {stamp}\nNo. of bitstreams: 1\n"
+        f"{pdf}: {size} bytes, checksum: {checksum} (MD5)||"
+        f"Made available in DSpace on {stamp} (GMT). No. of bitstreams: 1\n"
+        f"{pdf}: {size} bytes, checksum: {checksum} (MD5)\n  Previous issue date: {issued:%Y-%m-%d}"
+    )
+
+    # The handle sits in either URI column, sometimes alongside another URI or an existing DOI
+    uri = handle_uri(i)
+    roll = rng.random()
+    if roll < 0.05:
+        uri += f"||http://dx.doi.org/10.25316/IR-{i}"
+    elif roll < 0.15:
+        uri = f"https://viurrspace.ca/handle/10613/{100000 + i}||{uri}"
+    uri_en, uri_plain = (uri, "") if rng.random() < 0.5 else ("", uri)
+
+    return [
+        f"{rng.getrandbits(32):08x}-{rng.getrandbits(16):04x}-4{rng.getrandbits(12):03x}-a{rng.getrandbits(12):03x}-{rng.getrandbits(48):012x}",
+        f"10613/{rng.randrange(1000, 3000)}",
+        contributors,
+        stamp,
+        stamp,
+        issued.strftime(rng.choice(DATE_FORMATS)),
+        f"Certificate, application, and oath for item {i}, with notes on its provenance. " * rng.randint(1, 4),
+        f"https://viuspace.viu.ca/bitstream/handle/10613/{100000 + i}/{pdf}?sequence=3",
+        provenance,
+        "300 dpi; 24 bit colour; pdf",
+        f"{size / 1_000_000:.1f} mb",
+        "Colour pdf",
+        "application/pdf",
+        uri_en,
+        uri_plain,
+        "en",
+        "Electronic version published by Vancouver Island University",
+        "||".join(rng.sample(SUBJECTS, rng.randint(1, 3))),
+        title,
+        rng.choice(DSPACE_TYPES),
+    ]
+
+
+def write_dspace_export(path, rows, seed=0):
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(DSPACE_EXPORT_FIELDS)
+        for i in range(rows):
+            writer.writerow(dspace_export_row(rng, i))
+
+
+def datacite_export_rows(rows, seed=0):
+    """Export rows for the handles of a synthetic DSpace export: ~90% minted, ~5% rejected."""
+    rng = random.Random(seed + 1)
+    for i in range(rows):
+        roll = rng.random()
+        title = f"Item {i}"
+        if roll < 0.90:
+            suffix = "%04x-%04x" % (rng.getrandbits(16), rng.getrandbits(16))
+            yield [title, handle_uri(i), f"https://doi.org/{DOI_PREFIX}/{suffix}", "201", "", ""]
+        elif roll < 0.95:
+            yield [title, handle_uri(i), "", "422", "This DOI has already been taken", "permanent"]
+
+
+def write_datacite_export(path, log_directory, rows, seed=0):
+    """Write the DataCite export and the same rows split into per-run log files."""
+    os.makedirs(log_directory, exist_ok=True)
+    run_time = datetime(2023, 1, 2, 9, 30)
+    log_file = None
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(DATACITE_EXPORT_FIELDS)
+        try:
+            for n, row in enumerate(datacite_export_rows(rows, seed)):
+                if n % ROWS_PER_LOG_FILE == 0:
+                    if log_file:
+                        log_file.close()
+                    log_name = f"{EXPORT_LOG_PREFIX}{run_time:%Y%m%d_%H%M%S}.csv"
+                    log_file = open(os.path.join(log_directory, log_name), "w", encoding="utf-8", newline="")
+                    log_writer = csv.writer(log_file)
+                    log_writer.writerow(DATACITE_EXPORT_FIELDS)
+                    run_time += timedelta(days=3, minutes=17)
+                writer.writerow(row)
+                log_writer.writerow(row)
+        finally:
+            if log_file:
+                log_file.close()
+
+
+def generate(directory, rows, seed=0):
+    """
+    Write a data set of `rows` DSpace rows under `directory`, unless it is already there.
+
+    Returns the paths: dspace_export, datacite_export and log_dir.
+    """
+    paths = {
+        "dspace_export": os.path.join(directory, "dspace_export.csv"),
+        "datacite_export": os.path.join(directory, "datacite_export.csv"),
+        "log_dir": os.path.join(directory, "log"),
+    }
+    done_marker = os.path.join(directory, ".complete")
+    if os.path.exists(done_marker):
+        return paths
+
+    os.makedirs(directory, exist_ok=True)
+    write_dspace_export(paths["dspace_export"], rows, seed)
+    write_datacite_export(paths["datacite_export"], paths["log_dir"], rows, seed)
+    with open(done_marker, "w", encoding="utf-8") as file:
+        file.write(f"{rows} {seed}\n")
+    return paths
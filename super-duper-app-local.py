@@ -1,12 +1,167 @@
-import csv
-import re
 import flet as ft
 from flet import FilePickerResultEvent
-import requests
 import json
 import os 
 import tempfile
+import threading
+import time
+from collections import deque
 from datetime import datetime
+
+from super_duper.compression import compression_suffix
+from super_duper.convert import (
+    DEFAULT_TYPE_MAPPING, TYPE_MAPPING_FILE, TypeMatcher, dspace_inputs, load_type_mapping, process_csv, process_csv_batch,
+)
+from super_duper.downloads import download_server, download_url, unreachable_warning
+from super_duper.jobs import Cancelled, get_job, start_job
+from super_duper.logs import log_dir
+from super_duper.merge import merge_dois
+from super_duper.mint import run_mint, run_update
+from super_duper.registry import DoiRegistry
+from super_duper.stats import collect_doi_stats
+#####################################################
+
+# Shared UI helpers
+
+class LogPanel:
+    """
+    Bounded, batched log for a page.
+
+    Lines are queued and pushed to the ListView in one update at most every
+    `flush_interval` seconds or `flush_every` lines, and only the newest
+    `max_lines` stay on screen. The full log of a job is kept in its log file.
+    """
+
+    def __init__(self, list_view, max_lines=500, flush_interval=0.5, flush_every=200):
+        self.list_view = list_view
+        self.max_lines = max_lines
+        self.flush_interval = flush_interval
+        self.flush_every = flush_every
+        self.pending = deque(maxlen=max_lines)
+        self.pending_count = 0
+        self.last_flush = time.monotonic()
+        # Page handlers and job pollers write from different threads
+        self.lock = threading.RLock()
+
+    def write(self, text):
+        with self.lock:
+            self.pending.append(text)
+            self.pending_count += 1
+            if self.pending_count >= self.flush_every or time.monotonic() - self.last_flush >= self.flush_interval:
+                self.flush()
+
+    def flush(self):
+        with self.lock:
+            self.last_flush = time.monotonic()
+            self.pending_count = 0
+            if not self.pending:
+                return
+            controls = self.list_view.controls
+            controls.extend(ft.Text(line, selectable=True) for line in self.pending)
+            self.pending.clear()
+            if len(controls) > self.max_lines:
+                del controls[:len(controls) - self.max_lines]
+            self.list_view.update()
+
+
+# Browser session -> its pages' attached JobViews
+_attached_views = {}
+
+
+def session_key(page):
+    """
+    The browser session a page belongs to. In web mode every session gets its own
+    jobs and job views, so one user can neither see nor cancel another's work.
+    """
+    return getattr(page, "session_id", None) or page.session.id
+
+
+class JobView:
+    """
+    Shows a background Job on a page: progress bar, a live rows/s, ETA and
+    success/failure line, the job's log lines and a Cancel button.
+
+    The job is polled while the page is open. Leaving the page only detaches the
+    view; coming back re-attaches to the same job instead of starting another.
+    """
+
+    def __init__(self, page, progress, status, log, cancel_button, poll_interval=0.5):
+        self.session = session_key(page)
+        self.progress = progress
+        self.status = status
+        self.log = log
+        self.cancel_button = cancel_button
+        self.poll_interval = poll_interval
+        self.job = None
+        self.seen = 0
+        self.attached = False
+        cancel_button.on_click = self.cancel
+
+    def attach(self, job):
+        if self.job is job and self.attached:
+            return
+        self.detach()
+        self.job = job
+        self.seen = 0
+        self.attached = True
+        _attached_views.setdefault(self.session, []).append(self)
+        threading.Thread(target=self.poll, daemon=True).start()
+
+    def detach(self):
+        self.attached = False
+
+    def cancel(self, e=None):
+        if self.job and self.job.running:
+            self.job.cancel()
+            self.log.write("Cancelling after the rows in progress...")
+            self.log.flush()
+
+    def poll(self):
+        while self.attached:
+            running = self.job.running
+            self.refresh()
+            if not running:
+                break
+            time.sleep(self.poll_interval)
+
+    def refresh(self):
+        job = self.job
+        self.seen, lines = job.lines_since(self.seen)
+        for line in lines:
+            self.log.write(line)
+        self.log.flush()
+        self.progress.visible = job.running
+        self.progress.value = job.fraction()
+        self.status.value = job.describe()
+        self.cancel_button.visible = job.running
+        self.progress.update()
+        self.status.update()
+        self.cancel_button.update()
+
+
+def detach_job_views(page):
+    """Stop the polling of every job view in this page's session before its controls are cleared away."""
+    for view in _attached_views.pop(session_key(page), []):
+        view.detach()
+
+
+def page_log_path(name):
+    """Per-job verbose log file in the log directory."""
+    return os.path.join(log_dir(), f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
+
+
+def offer_download(page, job, path, filename):
+    """
+    Web mode: hand a finished temp file to the download server and open its link.
+    The server streams it from disk and deletes it when the link expires.
+    """
+    token = download_server().register(path, filename, job=job.name)
+    warning = unreachable_warning(page.url)
+    if warning:
+        job.log(warning)
+    page.launch_url(download_url(token, page.url))
+    job.log(f"Download of {filename} started; the link stays valid for {download_server().ttl // 60} minutes.")
+
 #####################################################
 
 
@@ -56,135 +211,6 @@ def page1(page: ft.Page):
 # Page 2: DSpace to Datacite CSV Converter
 
 
-def reverse_name_order(name):
-    """Reverse the order of a name formatted as 'LASTNAME, FIRSTNAME' and strip trailing periods."""
-    parts = [part.strip().rstrip(".") for part in name.split(",")]
-    if len(parts) == 2:
-        return f"{parts[1]} {parts[0]}"
-    return name.strip().rstrip(".")
-
-#Map DSpace types =>  Datacite types.
-def map_type(dspace_type, type_mapping):
-    if not dspace_type:
-        return "Unknown" 
-    dspace_type = dspace_type.strip().lower()  # Normalize input
-    for pattern, datacite_type in type_mapping.items():
-        if re.match(pattern, dspace_type, re.IGNORECASE):
-            return datacite_type
-    return "Unknown" 
-def extract_year(date_str):
-    try:
-        # Attempt to parse the date in different formats
-        for fmt in ("%Y", "%d/%m/%Y", "%d-%b", "%Y-%m-%d", "%d-%b-%Y"):
-            try:
-                parsed_date = datetime.strptime(date_str, fmt)
-                return parsed_date.year
-            except ValueError:
-                continue
-        # If no format matches, return "Unknown"
-        return "Unknown"
-    except Exception:
-        return "Unknown"
-
-
-def process_csv(dspace_csv, datacite_csv, type_mapping, progress, log):
-    uri_patterns = ["http://hdl.handle.net/10613", "http://hdl.handle.net/10170"]
-
-    try:
-        with open(dspace_csv, mode="r", encoding="utf-8") as dspace_file:
-            dspace_reader = csv.DictReader(dspace_file)
-
-            datacite_fieldnames = [
-                "title", "year", "type", "description",
-                "creator1", "creator1_type", "creator1_given", "creator1_family",
-                "creator2", "creator2_type", "creator2_given", "creator2_family",
-                "publisher", "source"
-            ]
-
-            datacite_rows = []
-            input_row_count = 0
-            output_row_count = 0
-
-            for row in dspace_reader:
-                input_row_count += 1
-                progress.value = input_row_count
-                progress.update()
-
-                title = row.get("dc.title[en]", row.get("dc.title", row.get("dc.title[]", ""))).strip()
-                #year = row.get("dc.date.issued[]", row.get("dc.date.issued[en]", row.get("dc.date.issued", ""))).strip()
-                year_raw = str(row.get("dc.date.issued[]", row.get("dc.date.issued[en]", row.get("dc.date.issued", "")))).strip()
-                year = str(extract_year(year_raw))
-                type_field = map_type(row.get("dc.type[en]", row.get("dc.type", row.get("dc.type[]", ""))).strip(), type_mapping)
-                description = row.get("dc.description.abstract[en]", row.get("dc.description", row.get("dc.description[]", ""))).strip()
-                publisher = row.get("dc.publisher[en]", "").strip()
-
-                source = ""
-                for uri_field in ["dc.identifier.uri[]", "dc.identifier.uri", "dc.identifier.uri[en]"]:
-                    if uri_field in row and any(pattern in row[uri_field] for pattern in uri_patterns):
-                        source = row[uri_field].split("||")[0].strip()
-                        break
-
-                contributors = []
-
-                def get_field_data(row, base_field_name):
-                    for suffix in ["[en]", "[]", ""]:
-                        value = row.get(f"{base_field_name}{suffix}", "").strip()
-                        if value:
-                            return value
-                    return ""
-
-                for field_group in ["author", "other", "editor", "advisor"]:
-                    field_data = get_field_data(row, f"dc.contributor.{field_group}")
-                    if field_data:
-                        contributors.extend([
-                            re.sub(r"::.*", "", name).strip().rstrip(".")
-                            for name in field_data.split("||") if name.strip()
-                        ])
-
-                if len(contributors) == 0:
-                    creator1, creator2 = "Unknown", ""
-                else:
-                    creator1 = reverse_name_order(contributors[0])
-                    creator2 = reverse_name_order(contributors[1]) if len(contributors) > 1 else ""
-
-                def split_name(name):
-                    parts = name.split()
-                    if len(parts) > 1:
-                        return " ".join(parts[:-1]), parts[-1]
-                    return "", name
-
-                creator1_given, creator1_family = split_name(creator1 if creator1 != "Unknown" else "")
-                creator2_given, creator2_family = split_name(creator2)
-
-                datacite_rows.append({
-                    "title": title,
-                    "year": year,
-                    "type": type_field,
-                    "description": description,
-                    "creator1": creator1,
-                    "creator1_type": "Personal" if creator1 != "Unknown" else "",
-                    "creator1_given": creator1_given,
-                    "creator1_family": creator1_family,
-                    "creator2": creator2,
-                    "creator2_type": "Personal" if creator2 else "",
-                    "creator2_given": creator2_given,
-                    "creator2_family": creator2_family,
-                    "publisher": publisher,
-                    "source": source
-                })
-                output_row_count += 1
-
-        with open(datacite_csv, mode="w", encoding="utf-8", newline="") as datacite_file:
-            writer = csv.DictWriter(datacite_file, fieldnames=datacite_fieldnames)
-            writer.writeheader()
-            writer.writerows(datacite_rows)
-
-        log.controls.append(ft.Text(f"\nTransformed data saved to {datacite_csv}\nRows in input file: {input_row_count}\nRows in output file: {output_row_count}", selectable=True))
-        log.update()
-    except Exception as e:
-        log.controls.append(ft.Text(f"\nError: {str(e)}", selectable=True))
-        log.update()
-
 def page2(page: ft.Page):
     page.title = "DSpace to Datacite CSV Converter"
 
@@ -205,7 +231,9 @@ def page2(page: ft.Page):
     
     spacer = ft.Container(height=10)
 
-    dspace_csv = ft.TextField(label="DSpace Export CSV File", disabled=True, width=500)
+    dspace_csv = ft.TextField(label="DSpace Export CSV Files", disabled=True, multiline=True, max_lines=5, width=500)
+    # Every picked export, or the CSVs of a picked folder
+    dspace_csvs = []
     datacite_filename = ft.TextField(
         label="Output Filename",
         label_style=ft.TextStyle(color=ft.Colors.PINK_100),
@@ -219,55 +247,48 @@ def page2(page: ft.Page):
         disabled=True,
         width=500
     )
+    per_file_output = ft.Checkbox(
+        label="One output file per input (DataciteImport_<input name>.csv)",
+        value=False,
+        # Web mode hands back a single download
+        disabled=page.web,
+    )
     type_mapping_display = ft.TextField(label="Type Mapping", multiline=True, width=500)
-    log = ft.ListView(expand=True, spacing=5, padding=10, auto_scroll=True)
+    log_view = ft.ListView(expand=True, spacing=5, padding=10, auto_scroll=True)
+    log = LogPanel(log_view)
     progress = ft.ProgressBar(width=500, visible=False)
+    job_status = ft.Text("", size=12, color=ft.Colors.GREY_600)
+    cancel_button = ft.ElevatedButton("Cancel Conversion", visible=False)
+    job_view = JobView(page, progress, job_status, log, cancel_button)
 
-    type_mapping = {
-        r"abstract.*": "Text",
-        r"archival.*": "Other",
-        r"article.*": "Text",    
-        r"audio.*": "Sound",
-        r"blog.*": "Text",
-        r"book": "Book",
-        r"book chapter.*": "BookChapter",
-        r"book review.*": "Other",
-        r"brief.*": "Other",
-        r"case.*": "Report",
-        r"chapbook": "Book",
-        r"conference.*": "ConferencePaper",
-        r"data.*": "Dataset",
-        r"guidebook": "Book",
-        r"illustration.*": "Image",
-        r"image.*": "Image",
-        r"interview.*": "Other",
-        r"journal.*": "Journal",
-        r"magazine.*": "JournalArticle",
-        r".*project.*": "Project",
-        r"map": "Other",
-        r"news.*": "Newspaper",
-        "Other": "Other",
-        r"paper.*": "Project",
-        r"play.*": "Other",
-        r"poster*": "Image",
-        r"presentation.*": "Other",
-        r"realia.*": "Other",
-        r".*oral.*": "Sound",
-        r".*report.*": "Report",
-        r"research.*": "Project",
-        r"spoken.*": "Sound",
-        r"template.*": "Other",
-        r"thesis.*": "Dissertation",
-        r"video.*": "Audiovisual",
-        r"web.*": "InteractiveResource",
-        r"working paper.*": "Project"
-    }
-    type_mapping_display.value = json.dumps(type_mapping, indent=4)
+    try:
+        type_mapping = load_type_mapping()
+    except ValueError as ex:
+        # Not on the page yet, so no update()
+        log_view.controls.append(ft.Text(f"Error loading {TYPE_MAPPING_FILE}, using the default type mapping: {ex}", selectable=True))
+        type_mapping = TypeMatcher(DEFAULT_TYPE_MAPPING)
+    type_mapping_display.value = json.dumps(type_mapping.mapping, indent=4)
+
+    def show_dspace_inputs(paths):
+        dspace_csvs[:] = paths
+        dspace_csv.value = "\n".join(paths)
+        dspace_csv.update()
+        if len(paths) > 1:
+            log.write(f"{len(paths)} DSpace export CSVs selected.")
+            log.flush()
 
     def pick_dspace_file(e: FilePickerResultEvent):
         if e.files:
-            dspace_csv.value = e.files[0].path
-            dspace_csv.update()
+            show_dspace_inputs([file.path for file in e.files])
+
+    def pick_dspace_folder(e: FilePickerResultEvent):
+        if e.path:
+            paths = dspace_inputs([e.path])
+            if not paths:
+                log.write(f"No CSV files in {e.path}.")
+                log.flush()
+                return
+            show_dspace_inputs(paths)
 
     def pick_save_location(e: FilePickerResultEvent):
         if e.path:
@@ -277,56 +298,101 @@ def page2(page: ft.Page):
     def save_type_mapping(e):
         try:
             nonlocal type_mapping
-            type_mapping = json.loads(type_mapping_display.value)
-            with open("type_mapping.json", "w") as file:
-                json.dump(type_mapping, file, indent=4)
-            log.controls.append(ft.Text("Type mapping saved successfully!", selectable=True))
-            log.update()
+            # Compiling first means a bad pattern is reported now and never saved
+            type_mapping = TypeMatcher(json.loads(type_mapping_display.value))
+            with open(TYPE_MAPPING_FILE, "w") as file:
+                json.dump(type_mapping.mapping, file, indent=4)
+            log.write("Type mapping saved successfully!")
+            log.flush()
         except Exception as ex:
-            log.controls.append(ft.Text(f"Error saving type mapping: {ex}", selectable=True))
-            log.update()
+            log.write(f"Error saving type mapping: {ex}")
+            log.flush()
 
     def start_conversion(e):
-        if not dspace_csv.value or not datacite_filename.value or not output_directory.value or not type_mapping:
-            log.controls.append(ft.Text("\nPlease select all required files and specify output location.", selectable=True))
-            log.update()
+        if not dspace_csvs or not datacite_filename.value or not output_directory.value or not type_mapping:
+            log.write("\nPlease select all required files and specify output location.")
+            log.flush()
             return
 
-        progress.visible = True
-        progress.update()
-
         # Combine directory and filename
         output_path = os.path.join(output_directory.value, datacite_filename.value)
-        
-        try:
-            if page.web:
-                # save to temp file
-                temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.csv')
-                process_csv(dspace_csv.value, temp_file.name, type_mapping, progress, log)
-                
-                # download
-                with open(temp_file.name, 'rb') as f:
-                    page.client_storage.set('download_data', f.read())
-                    page.launch_url(f"/download/{os.path.basename(output_path)}")
-                
-                # Clean up the temporary file
-                os.unlink(temp_file.name)
+        source_csvs = list(dspace_csvs)
+        matcher = type_mapping
+        web = page.web
+        per_file = bool(per_file_output.value) and not web
+        output_directory_value = output_directory.value
+
+        def conversion(job):
+            if web:
+                # save to temp file, compressed as the chosen name says
+                temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.csv' + compression_suffix(output_path))
+                temp_file.close()
+                target = temp_file.name
             else:
                 # For local app, save directly to the specified location
-                process_csv(dspace_csv.value, output_path, type_mapping, progress, log)
-        except Exception as e:
-            log.controls.append(ft.Text(f"\nError during conversion: {str(e)}", selectable=True))
-            log.update()
-
-        progress.visible = False
-        progress.update()
+                target = output_path
+            cancelled = False
+            try:
+                if len(source_csvs) == 1 and not per_file:
+                    input_row_count, output_row_count = process_csv(
+                        source_csvs[0], target, matcher,
+                        progress=lambda done, total: job.update(done=done, total=total, succeeded=done),
+                        cancel=job.cancel_event,
+                        metrics=job.metrics,
+                    )
+                    job.update(total=input_row_count)
+                    job.log(f"\nTransformed data saved to {output_path}\nRows in input file: {input_row_count}\nRows in output file: {output_row_count}")
+                else:
+                    job.log(f"Converting {len(source_csvs)} files...")
+                    try:
+                        results = process_csv_batch(
+                            source_csvs, target, matcher,
+                            combine=not per_file,
+                            # A file per CPU at once; the worker processes may import this
+                            # script (spawn/forkserver), which only starts the app under __main__
+                            workers=min(len(source_csvs), os.cpu_count() or 1),
+                            progress=lambda done, total: job.update(done=done, total=total, succeeded=done),
+                            cancel=job.cancel_event,
+                            log=job.log,
+                            metrics=job.metrics,
+                        )
+                    except Cancelled:
+                        job.log("Conversion cancelled; the rows converted so far were kept.")
+                        raise
+                    input_row_count = sum(result["input_rows"] for result in results)
+                    output_row_count = sum(result["output_rows"] for result in results)
+                    failed = [result for result in results if result["status"] == "failed"]
+                    job.update(total=input_row_count, failed=len(failed))
+                    saved_to = output_directory_value if per_file else output_path
+                    job.log(f"\nTransformed data from {len(results)} files saved to {saved_to}\nRows in input files: {input_row_count}\nRows in output: {output_row_count}")
+                    if failed:
+                        job.log(f"{len(failed)} files could not be converted: " + ", ".join(os.path.basename(result["input"]) for result in failed))
+            except Cancelled:
+                cancelled = True
+            except BaseException:
+                if web:
+                    os.unlink(target)
+                raise
+
+            if web:
+                # Streamed from the temp file, which the download server cleans up
+                offer_download(page, job, target, os.path.basename(output_path))
+            if cancelled:
+                raise Cancelled()
+
+        job, started = start_job("convert", conversion, page_log_path("converter"), owner=session_key(page))
+        if not started:
+            log.write("A conversion is already running; showing its progress.")
+            log.flush()
+        job_view.attach(job)
 
     pick_dspace_file_picker = ft.FilePicker(on_result=pick_dspace_file)
+    pick_dspace_folder_picker = ft.FilePicker(on_result=pick_dspace_folder)
     save_location_picker = ft.FilePicker(
         on_result=pick_save_location
     )
     
-    page.overlay.extend([pick_dspace_file_picker, save_location_picker])
+    page.overlay.extend([pick_dspace_file_picker, pick_dspace_folder_picker, save_location_picker])
 
     nav_link = ft.Row(
         [
@@ -339,10 +405,17 @@ def page2(page: ft.Page):
 
     file_controls = ft.Column([
         dspace_csv,
-        ft.ElevatedButton(
-            "Select DSpace Export CSV",
-            on_click=lambda _: pick_dspace_file_picker.pick_files(allow_multiple=False,allowed_extensions=["csv"])
-        ),
+        ft.Row([
+            ft.ElevatedButton(
+                "Select DSpace Export CSVs",
+                on_click=lambda _: pick_dspace_file_picker.pick_files(allow_multiple=True,allowed_extensions=["csv", "gz", "zst"])
+            ),
+            ft.ElevatedButton(
+                "Select Folder of Exports",
+                on_click=lambda _: pick_dspace_folder_picker.get_directory_path(),
+                visible=not page.web,
+            ),
+        ]),
     
         ft.Container(height=10),
         datacite_filename, 
@@ -351,6 +424,7 @@ def page2(page: ft.Page):
             "Choose Save Location",
             on_click=lambda _: save_location_picker.get_directory_path()
         ),
+        per_file_output,
         ft.Container(height=15),
     ])
 
@@ -365,7 +439,9 @@ def page2(page: ft.Page):
         ft.ElevatedButton("Save Type Mapping", on_click=save_type_mapping),
         ft.ElevatedButton("Start Conversion", on_click=start_conversion),
         progress,
-        log,
+        job_status,
+        cancel_button,
+        log_view,
         nav_link
                ],
         scroll=True, 
@@ -374,6 +450,11 @@ def page2(page: ft.Page):
 
     page.add(scrollable_content)
 
+    # Pick up a conversion that is still running (or just finished) from an earlier visit
+    job = get_job("convert", owner=session_key(page))
+    if job:
+        job_view.attach(job)
+
 #####################################################
 
 # Page 3: DOI Generator and Config Editor
@@ -415,9 +496,20 @@ def page3(page: ft.Page):
         disabled=True,
         width=515
     )
-    log_area = ft.ListView(expand=True, spacing=5, padding=10, auto_scroll=True)
+    concurrency_input = ft.TextField(label="Concurrent Requests", width=245, value="4")
+    rate_limit_input = ft.TextField(label="Max Requests per Second", width=245, value="10")
+    resume_checkbox = ft.Checkbox(label="Resume interrupted run (skip rows already minted in the journal)", value=False)
+    update_checkbox = ft.Checkbox(
+        label="Update existing DOIs instead (send only rows whose metadata changed since it was last sent)",
+        value=False,
+    )
+    log_view = ft.ListView(expand=True, spacing=5, padding=10, auto_scroll=True)
+    log_area = LogPanel(log_view)
 
     progress = ft.ProgressBar(width=500, visible=False)
+    job_status = ft.Text("", size=12, color=ft.Colors.GREY_600)
+    cancel_button = ft.ElevatedButton("Cancel Submission", visible=False)
+    job_view = JobView(page, progress, job_status, log_area, cancel_button)
 
     # File pickers
     def pick_input_csv(e):
@@ -452,10 +544,10 @@ def page3(page: ft.Page):
                     doi_prefix_input.update()
                     username_input.update()
                     password_input.update()
-                    log_area.controls.append(ft.Text("Credentials file loaded successfully!", selectable=True))
+                    log_area.write("Credentials file loaded successfully!")
             except Exception as ex:
-                log_area.controls.append(ft.Text(f"Error loading credentials file: {ex}", selectable=True))
-            log_area.update()
+                log_area.write(f"Error loading credentials file: {ex}")
+            log_area.flush()
 
     credentials_picker = ft.FilePicker(on_result=pick_credentials_file)
     page.overlay.append(credentials_picker)
@@ -463,155 +555,130 @@ def page3(page: ft.Page):
     # Process CSV and submit DOIs
     def process_and_submit(e):
         if not input_csv.value:
-            log_area.controls.append(ft.Text("Please select an input CSV file.", selectable=True))
-            log_area.update()
+            log_area.write("Please select an input CSV file.")
+            log_area.flush()
             return
 
         if not output_filename.value or not output_directory.value:
-            log_area.controls.append(ft.Text("Please specify both output filename and location.", selectable=True))
-            log_area.update()
+            log_area.write("Please specify both output filename and location.")
+            log_area.flush()
             return
 
         if not url_input.value or not doi_prefix_input.value or not username_input.value or not password_input.value:
-            log_area.controls.append(ft.Text("Please upload a credentials file.", selectable=True))
-            log_area.update()
+            log_area.write("Please upload a credentials file.")
+            log_area.flush()
             return
 
-        progress.visible = True
-        progress.update()
-
         try:
-            # Combine directory and filename for output path
-            output_path = os.path.join(output_directory.value, output_filename.value)
-            log_dir = os.path.join(os.getcwd(), "log")
-            os.makedirs(log_dir, exist_ok=True)
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            log_file_path = os.path.join(log_dir, f"datacite_export_{timestamp}.csv")
-
-            with open(input_csv.value, "r", newline="", encoding="utf-8") as file:
-                header = [h.strip().lower() for h in file.readline().split(',')]
-                reader = csv.DictReader(file, fieldnames=header)
-                dois = []
-
-                for row in reader:
-                    creators = []
-                    i = 1
-                    while f"creator{i}" in row:
-                        if row[f"creator{i}"]:
-                            name_type = row.get(f"creator{i}_type", "").strip() or "Personal"
-                            creators.append({
-                                "name": row[f"creator{i}"].strip(),
-                                "nameType": name_type,
-                                "givenName": row.get(f"creator{i}_given", "").strip(),
-                                "familyName": row.get(f"creator{i}_family", "").strip()
-                            })
-                        i += 1
-
-                    dois.append({
-                        "creators": creators,
-                        "year": row["year"].strip(),
-                        "url": row["source"].strip(),
-                        "title": row["title"].strip(),
-                        "type": row["type"].strip(),
-                        "descriptions": [{
-                            "description": row["description"].strip(),
-                            "descriptionType": "Abstract"
-                        }],
-                        "publisher": row["publisher"].strip(),
-                        "doi": ""
-                    })
-
-                results = []
-                success_count = 0
-                for doi in dois:
-                    data = {
-                        "data": {
-                            "type": "dois",
-                            "attributes": {
-                                "event": "publish",
-                                "prefix": doi_prefix_input.value,
-                                "creators": doi["creators"],
-                                "titles": [{"title": doi["title"]}],
-                                "publisher": doi["publisher"],
-                                "publicationYear": doi["year"],
-                                "descriptions": doi["descriptions"],
-                                "types": {
-                                    "resourceTypeGeneral": "Text",
-                                    "resourceType": doi["type"]
-                                },
-                                "schemaVersion": "http://datacite.org/schema/kernel-4",
-                                "url": doi["url"]
-                            }
-                        }
-                    }
-
-                    response = requests.post(
-                        url_input.value,
-                        headers={"Content-Type": "application/vnd.api+json"},
-                        data=json.dumps(data).encode("utf-8"),
-                        auth=(username_input.value, password_input.value)
-                    )
+            concurrency = int(concurrency_input.value)
+            rate_limit = float(rate_limit_input.value)
+        except ValueError:
+            log_area.write("Concurrent requests and requests per second must be numbers.")
+            log_area.flush()
+            return
 
-                    log_area.controls.append(ft.Text(f"\nSubmitting data to DataCite:\n{json.dumps(data, indent=4)}", selectable=True))
-                    log_area.controls.append(ft.Text(f"Response for DOI generation: {response.status_code}", selectable=True))
-                    log_area.controls.append(ft.Text(response.text, selectable=True))
-                    log_area.update()
-
-                    if response.status_code == 201:
-                        success_count += 1
-                        results.append({
-                            "title": doi["title"],
-                            "source": doi["url"],
-                            "doi": f"https://doi.org/{response.json()['data']['id']}",
-                            "status": 201,
-                            "error_message": ""
-                        })
-                    else:
-                        results.append({
-                            "title": doi["title"],
-                            "source": doi["url"],
-                            "doi": None,
-                            "status": response.status_code,
-                            "error_message": response.json().get("errors", [{}])[0].get("title", "Unknown error")
-                        })
-
-                # Save results
-                if page.web:
-                    # For web, save to temporary file and trigger download
-                    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.csv')
-                    with open(temp_file.name, "w", newline="") as output_file:
-                        writer = csv.DictWriter(output_file, fieldnames=["title", "source", "doi", "status", "error_message"])
-                        writer.writeheader()
-                        writer.writerows(results)
-                    
-                    with open(temp_file.name, 'rb') as f:
-                        page.client_storage.set('download_data', f.read())
-                        page.launch_url(f"/download/{os.path.basename(output_path)}")
-                    
-                    os.unlink(temp_file.name)
+        # Combine directory and filename for output path
+        output_path = os.path.join(output_directory.value, output_filename.value)
+        source_csv = input_csv.value
+        credentials = {
+            "url": url_input.value,
+            "doiPrefix": doi_prefix_input.value,
+            "username": username_input.value,
+            "password": password_input.value,
+        }
+        resume = resume_checkbox.value
+        update_mode = update_checkbox.value
+        web = page.web
+
+        def minting(job):
+            def show_response(body, response, result):
+                # Full payload and response go to the log file only; the screen gets one line per DOI
+                job.log(f"\nSubmitting data to DataCite:\n{body.decode('utf-8')}", verbose=True)
+                if response is not None:
+                    job.log(f"Response for DOI generation: {response.status_code}", verbose=True)
+                    job.log(response.text, verbose=True)
+                if result.status in (200, 201):
+                    job.update(succeeded=job.succeeded + 1)
+                    job.log(f"{result.status} {result.doi} {result.source}")
                 else:
-                    # For local app, save directly to specified location
-                    with open(output_path, "w", newline="") as output_file:
-                        writer = csv.DictWriter(output_file, fieldnames=["title", "source", "doi", "status", "error_message"])
-                        writer.writeheader()
-                        writer.writerows(results)
-
-                    # Save a copy to the log directory
-                    with open(log_file_path, "w", newline="") as log_file:
-                        writer = csv.DictWriter(log_file, fieldnames=["title", "source", "doi", "status", "error_message"])
-                        writer.writeheader()
-                        writer.writerows(results)
-
-                log_area.controls.append(ft.Text(f"\nDOIs processed. Results saved to {output_path}.", selectable=True))
-                log_area.controls.append(ft.Text(f"Total DOIs successfully generated: {success_count}/{len(dois)}", selectable=True))
-                log_area.update()
-
-        except Exception as ex:
-            log_area.controls.append(ft.Text(f"Error processing CSV: {ex}", selectable=True))
-            log_area.update()
+                    job.update(failed=job.failed + 1)
+                    job.log(f"{result.status or 'No response'} ({result.error_type}) {result.title}: {result.error_message}")
+
+            if web:
+                # For web, save to temporary file and trigger download
+                temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.csv' + compression_suffix(output_path))
+                temp_file.close()
+                result_path = temp_file.name
+            else:
+                # For local app, save directly to specified location plus a copy in the log directory
+                result_path = output_path
 
-        progress.visible = False
-        progress.update()
+            registry = DoiRegistry()
+            try:
+                if update_mode:
+                    summary = run_update(
+                        source_csv,
+                        result_path,
+                        credentials,
+                        registry,
+                        concurrency=concurrency,
+                        rate_limit=rate_limit,
+                        log=job.log,
+                        on_response=show_response,
+                        progress=lambda done, total: job.update(done=done, total=total),
+                        cancel=job.cancel_event,
+                        metrics=job.metrics,
+                    )
+                else:
+                    summary = run_mint(
+                        source_csv,
+                        result_path,
+                        credentials,
+                        concurrency=concurrency,
+                        rate_limit=rate_limit,
+                        resume=resume,
+                        log_copy=not web,
+                        log=job.log,
+                        on_response=show_response,
+                        progress=lambda done, total: job.update(done=done, total=total),
+                        cancel=job.cancel_event,
+                        registry=registry,
+                        metrics=job.metrics,
+                    )
+            except Cancelled:
+                # A cancelled run still writes its output from the journal before raising
+                if web:
+                    offer_download(page, job, result_path, os.path.basename(output_path))
+                raise
+            except BaseException:
+                if web and os.path.exists(result_path):
+                    # Empty or cut short: never offered as if it were the results
+                    os.unlink(result_path)
+                raise
+            finally:
+                registry.close()
+            if web:
+                # Streamed from the temp file, which the download server cleans up
+                offer_download(page, job, result_path, os.path.basename(output_path))
+
+            if update_mode:
+                job.log(f"\nUpdates processed. Results saved to {output_path}.")
+                job.log(f"Rows checked: {summary['checked']}")
+                job.log(f"Unchanged since the last update: {summary['unchanged']}")
+                job.log(f"DOIs updated: {summary['updated']}/{summary['sent']}")
+                return summary
+            job.log(f"\nDOIs processed. Results saved to {output_path}.")
+            job.log(f"Rows submitted this run: {summary['submitted']}")
+            if summary["already_registered"]:
+                job.log(f"Rows skipped (DOI already in the registry): {summary['already_registered']}")
+            job.log(f"Total DOIs successfully generated: {summary['successful']}/{summary['total']}")
+            return summary
+
+        job, started = start_job("mint", minting, page_log_path("doi_creator"), owner=session_key(page))
+        if not started:
+            log_area.write("DOIs are already being submitted; showing that run's progress.")
+            log_area.flush()
+        job_view.attach(job)
 
 
     nav_link = ft.Row(
@@ -640,7 +707,7 @@ def page3(page: ft.Page):
             ft.Column(
                 [
                     ft.Row([
-                        ft.ElevatedButton("Select Input CSV", on_click=lambda _: input_csv_picker.pick_files(allow_multiple=False, allowed_extensions=["csv"])),
+                        ft.ElevatedButton("Select Input CSV", on_click=lambda _: input_csv_picker.pick_files(allow_multiple=False, allowed_extensions=["csv", "jsonl", "gz", "zst"])),
                         input_csv
                     ]),
                     # space
@@ -653,13 +720,18 @@ def page3(page: ft.Page):
                         ),
                         output_directory
                     ]),
+                    ft.Row([concurrency_input, rate_limit_input]),
+                    resume_checkbox,
+                    update_checkbox,
                 ],
                 spacing=10,
             ),
             ft.ElevatedButton("Process and Submit DOIs", on_click=process_and_submit),
             ft.Text("   Scroll to view log", size=12, color=ft.Colors.PINK_100),
             progress,
-            log_area,
+            job_status,
+            cancel_button,
+            log_view,
             nav_link
         ],
         scroll=True,  
@@ -668,6 +740,11 @@ def page3(page: ft.Page):
 
     page.add(scrollable_content)
 
+    # Pick up a submission that is still running (or just finished) from an earlier visit
+    job = get_job("mint", owner=session_key(page))
+    if job:
+        job_view.attach(job)
+
 
 #####################################################
 
@@ -686,9 +763,14 @@ def page4(page: ft.Page):
 
     auto_prefix_csv = ft.TextField(label="Datacite DOI export CSV file", disabled=True, width=500)
     dspace_csv = ft.TextField(label="DSpace CSV Import File", disabled=True, width=500)
+    from_registry = ft.Checkbox(label="Take DOIs from the DOI registry instead of an export CSV", value=False)
     
-    log = ft.ListView(expand=True, spacing=5, padding=10, auto_scroll=True)
+    log_view = ft.ListView(expand=True, spacing=5, padding=10, auto_scroll=True)
+    log = LogPanel(log_view)
     progress = ft.ProgressBar(width=500, visible=False)
+    job_status = ft.Text("", size=12, color=ft.Colors.GREY_600)
+    cancel_button = ft.ElevatedButton("Cancel Merge", visible=False)
+    job_view = JobView(page, progress, job_status, log, cancel_button)
 
 
     def pick_auto_prefix_file(e: FilePickerResultEvent):
@@ -703,89 +785,43 @@ def page4(page: ft.Page):
 
 
     def start_merging(e):
-        if not dspace_csv.value or not auto_prefix_csv.value:
-            log.controls.append(ft.Text("\nPlease select both input files.", selectable=True))
-            log.update()
+        if not dspace_csv.value or not (auto_prefix_csv.value or from_registry.value):
+            log.write("\nPlease select both input files.")
+            log.flush()
             return
 
-        progress.visible = True
-        progress.update()
+        export_csv = None if from_registry.value else auto_prefix_csv.value
+        import_csv = dspace_csv.value
 
-        try:
-            # Load Auto-prefix output CSV into a dictionary for easy lookup
-            auto_prefix_data = {}
-            with open(auto_prefix_csv.value, mode="r", encoding="utf-8") as auto_file:
-                auto_reader = csv.DictReader(auto_file)
-                for row in auto_reader:
-                    auto_prefix_data[row["source"]] = row["doi"]
-
-            # Define all possible `dc.identifier.uri` field names
-            uri_fields = ["dc.identifier.uri[]", "dc.identifier.uri", "dc.identifier.uri[en]"]
-
-            # Initialize counters
-            dois_added = 0
-            rows_skipped = 0
-            total_auto_prefix_dois = len(auto_prefix_data)
-
-            # Read the Dspace Import CSV and update the dc.identifier.uri fields
-            updated_rows = []
-            with open(dspace_csv.value, mode="r", encoding="utf-8") as dspace_file:
-                dspace_reader = csv.DictReader(dspace_file)
-                fieldnames = dspace_reader.fieldnames  # Retain original fieldnames
-
-                for row in dspace_reader:
-                    matched = False 
-                    for uri_field in uri_fields:
-                        if uri_field in row and row[uri_field].strip():  # Check if the field exists and has data
-                            existing_uri = row[uri_field].strip()
-
-                            # Skip if the URI already contains a DOI
-                            if any(prefix in existing_uri for prefix in ["10.25316", "https://doi.org"]):
-                                log.controls.append(ft.Text(f"Skipping row with existing DOI in field {uri_field}: {existing_uri}", selectable=True))
-                                rows_skipped += 1
-                                matched = True  # Mark as handled to avoid "No match" message
-                                break
-
-                            # Check for a match with the source
-                            if existing_uri in auto_prefix_data:
-                                log.controls.append(ft.Text(f"Match found for: {existing_uri} in field {uri_field}", selectable=True))
-                                row[uri_field] += "||" + auto_prefix_data[existing_uri]
-                                dois_added += 1
-                                matched = True
-                                break  # Stop further processing once a match is found
-
-                    if not matched:
-                        # Log a "No match" message only if no action was taken for any URI field
-                        log.controls.append(ft.Text(f"No match for any field in row ID: {row.get('id', 'Unknown')}", selectable=True))
-
-                    updated_rows.append(row)
-
-            # Write the updated data back to a new CSV file
-            from pathlib import Path
-
-            dspace_path = Path(dspace_csv.value.strip())  
-            output_csv = str(dspace_path.parent / f"updated_{dspace_path.name}")
-
-            # Write the updated data back to a new CSV file
-            with open(output_csv, mode="w", encoding="utf-8", newline="") as output_file:
-                writer = csv.DictWriter(output_file, fieldnames=fieldnames)
-                writer.writeheader()
-                writer.writerows(updated_rows)
+        def merging(job):
+            registry = DoiRegistry() if export_csv is None else None
+            try:
+                summary = merge_dois(
+                    export_csv, import_csv,
+                    log=job.log,
+                    progress=lambda done, total: job.update(done=done, total=total),
+                    cancel=job.cancel_event,
+                    registry=registry,
+                    metrics=job.metrics,
+                )
+            finally:
+                if registry is not None:
+                    registry.close()
+            job.update(succeeded=summary["dois_added"], failed=summary["rows_unmatched"])
 
             # Sum it up!
-            log.controls.append(ft.Text("\n--- Summary ---", selectable=True))
-            log.controls.append(ft.Text(f"Total DOIs in Datacite Export CSV: {total_auto_prefix_dois}", selectable=True))
-            log.controls.append(ft.Text(f"DOIs added: {dois_added}", selectable=True))
-            log.controls.append(ft.Text(f"Rows skipped (DOI already present): {rows_skipped}", selectable=True))
-            log.controls.append(ft.Text(f"Updated CSV saved as: {output_csv}", selectable=True))
-            log.update()
-
-        except Exception as ex:
-            log.controls.append(ft.Text(f"Error processing CSV: {ex}", selectable=True))
-            log.update()
-
-        progress.visible = False
-        progress.update()
+            job.log("\n--- Summary ---")
+            job.log(f"Total DOIs in {'the DOI registry' if export_csv is None else 'Datacite Export CSV'}: {summary['total_export_dois']}")
+            job.log(f"DOIs added: {summary['dois_added']}")
+            job.log(f"Rows skipped (DOI already present): {summary['rows_skipped']}")
+            job.log(f"Updated CSV saved as: {summary['output_csv']}")
+            return summary
+
+        job, started = start_job("merge", merging, page_log_path("csv_merger"), owner=session_key(page))
+        if not started:
+            log.write("A merge is already running; showing its progress.")
+            log.flush()
+        job_view.attach(job)
 
     pick_dspace_file_picker = ft.FilePicker(on_result=pick_dspace_file)
     pick_auto_prefix_file_picker = ft.FilePicker(on_result=pick_auto_prefix_file)
@@ -805,15 +841,23 @@ def page4(page: ft.Page):
         description,
         spacer,
         auto_prefix_csv,
-        ft.ElevatedButton("Select Datacite DOI Export CSV", on_click=lambda _: pick_auto_prefix_file_picker.pick_files(allow_multiple=False, allowed_extensions=["csv"])),
+        ft.ElevatedButton("Select Datacite DOI Export CSV", on_click=lambda _: pick_auto_prefix_file_picker.pick_files(allow_multiple=False, allowed_extensions=["csv", "gz", "zst"])),
+        from_registry,
         dspace_csv,
-        ft.ElevatedButton("Select DSpace Import CSV", on_click=lambda _: pick_dspace_file_picker.pick_files(allow_multiple=False, allowed_extensions=["csv"])),
+        ft.ElevatedButton("Select DSpace Import CSV", on_click=lambda _: pick_dspace_file_picker.pick_files(allow_multiple=False, allowed_extensions=["csv", "gz", "zst"])),
         ft.ElevatedButton("Start Merging", on_click=start_merging),
         progress,
-        log,
+        job_status,
+        cancel_button,
+        log_view,
         nav_link
     )
 
+    # Pick up a merge that is still running (or just finished) from an earlier visit
+    job = get_job("merge", owner=session_key(page))
+    if job:
+        job_view.attach(job)
+
 
 #####################################################
 # Page 5: Statistics
@@ -836,31 +880,6 @@ def page5(page: ft.Page):
         height=400
     )
     
-    def count_dois_by_prefix():
-        prefix_counts = {}
-        log_dir = os.path.join(os.getcwd(), "log")
-        
-        if not os.path.exists(log_dir):
-            return prefix_counts
-            
-        try:
-            for filename in os.listdir(log_dir):
-                if filename.startswith("datacite_export_") and filename.endswith(".csv"):
-                    with open(os.path.join(log_dir, filename), 'r', encoding='utf-8') as csvfile:
-                        reader = csv.DictReader(csvfile)
-                        for row in reader:
-                            # Only count successfully created DOIs (status 201)
-                            if row.get('status') == '201' and row.get('doi') and row['doi'].startswith('https://doi.org/'):
-                                # Extract prefix from DOI
-                                prefix = row['doi'].split('/')[3].split('.')[0] + '.' + row['doi'].split('/')[3].split('.')[1]
-                                prefix_counts[prefix] = prefix_counts.get(prefix, 0) + 1
-        except Exception as e:
-            stats_container.controls.append(
-                ft.Text(f"Error reading file: {str(e)}", color=ft.colors.RED)
-            )
-            
-        return prefix_counts
-
     def update_stats(e=None):
         # Clear existing statistics
         stats_container.controls.clear()
@@ -875,7 +894,39 @@ def page5(page: ft.Page):
         )
         
         # Get DOI counts
-        prefix_counts = count_dois_by_prefix()
+        stats = collect_doi_stats(
+            log=lambda message: stats_container.controls.append(ft.Text(message, color=ft.colors.RED))
+        )
+        prefix_counts = stats["by_prefix"]
+
+        def stat_card(label, count, unit="DOIs"):
+            return ft.Container(
+                content=ft.Row(
+                    [
+                        ft.Text(
+                            label,
+                            size=16,
+                            weight="bold",
+                            color=ft.Colors.GREY_900,
+                            width=200
+                        ),
+                        ft.Text(
+                            f"{count} {unit}",
+                            size=16,
+                            color=ft.Colors.GREY_900,
+                            weight="bold"
+                        )
+                    ],
+                    alignment=ft.MainAxisAlignment.SPACE_BETWEEN
+                ),
+                padding=10,
+                bgcolor=ft.Colors.PINK_100,
+                #border=ft.border.all(1, ft.Colors.GREY_300),
+                border_radius=5
+            )
+
+        def section(title):
+            return ft.Text(title, size=14, color=ft.Colors.GREY_600)
         
         if not prefix_counts:
             stats_container.controls.append(
@@ -888,32 +939,20 @@ def page5(page: ft.Page):
             
             # Create a card for each prefix
             for prefix, count in sorted_prefixes:
-                stats_container.controls.append(
-                    ft.Container(
-                        content=ft.Row(
-                            [
-                                ft.Text(
-                                    f"Prefix {prefix}",
-                                    size=16,
-                                    weight="bold",
-                                    color=ft.Colors.GREY_900,
-                                    width=200
-                                ),
-                                ft.Text(
-                                    f"{count} DOIs",
-                                    size=16,
-                                    color=ft.Colors.GREY_900,
-                                    weight="bold"
-                                )
-                            ],
-                            alignment=ft.MainAxisAlignment.SPACE_BETWEEN
-                        ),
-                        padding=10,
-                        bgcolor=ft.Colors.PINK_100,
-                        #border=ft.border.all(1, ft.Colors.GREY_300),
-                        border_radius=5
-                    )
-                )
+                stats_container.controls.append(stat_card(f"Prefix {prefix}", count))
+
+            stats_container.controls.append(section("DOIs Created by Month"))
+            for month, count in sorted(stats["by_month"].items(), reverse=True):
+                stats_container.controls.append(stat_card(month, count))
+
+            stats_container.controls.append(section("DOIs Created by Day (last 30 days with activity)"))
+            for day, count in sorted(stats["by_day"].items(), reverse=True)[:30]:
+                stats_container.controls.append(stat_card(day, count))
+
+        if stats["by_status"]:
+            stats_container.controls.append(section("All Submissions by Response Status"))
+            for status, count in sorted(stats["by_status"].items(), key=lambda x: x[1], reverse=True):
+                stats_container.controls.append(stat_card(f"Status {status or 'unknown'}", count, "rows"))
         
         stats_container.update()
 
@@ -943,26 +982,31 @@ def page5(page: ft.Page):
 
 # Navigation functions
 def navigate_to_page1(page: ft.Page):
+    detach_job_views(page)
     page.controls.clear()
     page1(page)
     page.update()
 
 def navigate_to_page2(page: ft.Page):
+    detach_job_views(page)
     page.controls.clear()
     page2(page)
     page.update()
 
 def navigate_to_page3(page: ft.Page):
+    detach_job_views(page)
     page.controls.clear()
     page3(page)
     page.update()
 
 def navigate_to_page4(page: ft.Page):
+    detach_job_views(page)
     page.controls.clear()
     page4(page)
     page.update()
 
 def navigate_to_page5(page: ft.Page):
+    detach_job_views(page)
     page.controls.clear()
     page5(page)
     page.update()
@@ -972,4 +1016,5 @@ def main(page: ft.Page):
     page.title = "DSpace and DataCite Tools"
     page1(page)  # Start with Page 1
 
-ft.app(target=main)
+if __name__ == "__main__":
+    ft.app(target=main)
@@ -0,0 +1,7 @@
+"""
+Core of Super-Duper-App-Local: DSpace -> DataCite conversion, bulk DOI minting,
+merging DOIs back into DSpace and DOI statistics, without the Flet UI.
+
+Submodules are imported on demand (``from super_duper import convert``) so that
+headless jobs only load what they use.
+"""
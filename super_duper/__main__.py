@@ -0,0 +1,5 @@
+import sys
+
+from super_duper.cli import main
+
+sys.exit(main())
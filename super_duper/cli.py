@@ -0,0 +1,487 @@
+"""
+Headless command line for the same jobs the app runs:
+
+    python -m super_duper convert DSPACE_EXPORT.csv DataciteImport.csv
+    python -m super_duper convert exports/ DataciteImport.csv --per-file --workers 0
+    python -m super_duper build-payloads DataciteImport.csv batch.jsonl --credentials creds.json
+    python -m super_duper mint DataciteImport.csv DataciteExport.csv --credentials creds.json
+    python -m super_duper update DataciteImport.csv DataciteUpdates.csv --credentials creds.json
+    python -m super_duper merge DataciteExport.csv DSPACE_IMPORT.csv
+    python -m super_duper merge --from-registry DSPACE_IMPORT.csv
+    python -m super_duper registry backfill
+    python -m super_duper stats
+    python -m super_duper compress-logs --older-than 30
+    python -m super_duper reconcile DSPACE_EXPORT.csv report.csv --credentials creds.json
+    python -m super_duper shards split DataciteImport.csv /shared/run1 --shards 16
+    python -m super_duper shards work /shared/run1 --credentials creds.json
+    python -m super_duper shards merge /shared/run1 DataciteExport.csv
+    python -m super_duper mock-datacite --latency lognormal:80,0.6 --error-rate 0.02
+
+Any CSV or payload batch named `*.gz` or `*.zst` is read and written compressed.
+Each subcommand imports only the module it needs. The first Ctrl-C asks the
+running job to stop cleanly (partial outputs are kept); a second one aborts.
+"""
+import argparse
+import os
+import signal
+import sys
+import threading
+
+from super_duper.jobs import Cancelled
+
+# Commands whose runs are instrumented and leave metrics behind
+METERED_COMMANDS = {"convert", "mint", "update", "merge", "stats", "reconcile", "shards"}
+
+
+def cmd_convert(args):
+    from super_duper.convert import (
+        TYPE_MAPPING_FILE, dspace_inputs, load_type_mapping, process_csv, process_csv_batch,
+    )
+
+    type_mapping = load_type_mapping(args.type_mapping or TYPE_MAPPING_FILE)
+    dspace_csvs = dspace_inputs(args.dspace_csv)
+    if not dspace_csvs:
+        print("No DSpace export CSVs found.", file=sys.stderr)
+        return 1
+    workers = args.workers or os.cpu_count()
+
+    if len(dspace_csvs) == 1 and not args.per_file:
+        input_row_count, output_row_count = process_csv(
+            dspace_csvs[0], args.datacite_csv, type_mapping, cancel=args.cancel,
+            workers=workers, metrics=args.metrics,
+        )
+        print(f"Transformed data saved to {args.datacite_csv}")
+        print(f"Rows in input file: {input_row_count}")
+        print(f"Rows in output file: {output_row_count}")
+        return 0
+
+    results = process_csv_batch(
+        dspace_csvs, args.datacite_csv, type_mapping, combine=not args.per_file, workers=workers,
+        cancel=args.cancel, log=print, metrics=args.metrics,
+    )
+    print(f"{len(results)} files, {sum(result['input_rows'] for result in results)} rows in, "
+          f"{sum(result['output_rows'] for result in results)} rows out")
+    if not args.per_file:
+        print(f"Transformed data saved to {args.datacite_csv}")
+    return 1 if any(result["status"] == "failed" for result in results) else 0
+
+
+def cmd_mint(args):
+    from super_duper.logs import log_dir
+    from super_duper.mint import (
+        RetryPolicy, failed_rows, journal_path_for, load_credentials, parse_rows, read_journal, run_mint,
+    )
+    from super_duper.registry import DoiRegistry, registry_path
+
+    def on_response(data, response, result):
+        if result.status == 201:
+            print(f"{result.status} {result.doi} {result.source}")
+        else:
+            print(f"{result.status or 'No response'} ({result.error_type}) {result.title}: {result.error_message}")
+
+    only_rows = parse_rows(args.rows) if args.rows else None
+    if args.failed_only:
+        # Replaying failures builds on the existing journal, as a resume does
+        failed = failed_rows(read_journal(journal_path_for(args.datacite_csv, log_dir())))
+        only_rows = failed if only_rows is None else only_rows & failed
+        args.resume = True
+        print(f"{len(only_rows)} failed rows to send again.")
+
+    registry = None if args.no_registry else DoiRegistry(registry_path())
+    try:
+        summary = run_mint(
+            args.datacite_csv,
+            args.output_csv,
+            load_credentials(args.credentials),
+            concurrency=args.concurrency,
+            rate_limit=args.rate_limit,
+            resume=args.resume,
+            log=print,
+            on_response=on_response if args.verbose else None,
+            cancel=args.cancel,
+            retry_policy=RetryPolicy(args.connect_timeout, args.read_timeout, args.max_attempts),
+            only_rows=only_rows,
+            registry=registry,
+            metrics=args.metrics,
+        )
+    finally:
+        if registry is not None:
+            registry.close()
+    print(f"DOIs processed. Results saved to {summary['output_path']}.")
+    print(f"Rows submitted this run: {summary['submitted']}")
+    print(f"Total DOIs successfully generated: {summary['successful']}/{summary['total']}")
+    return 0
+
+
+def cmd_update(args):
+    from super_duper.mint import RetryPolicy, load_credentials, run_update
+    from super_duper.registry import DoiRegistry, registry_path
+
+    def on_response(data, response, result):
+        if result.status == 200:
+            print(f"{result.status} {result.doi} {result.source}")
+        else:
+            print(f"{result.status or 'No response'} ({result.error_type}) {result.title}: {result.error_message}")
+
+    with DoiRegistry(registry_path()) as registry:
+        summary = run_update(
+            args.datacite_csv,
+            args.output_csv,
+            load_credentials(args.credentials),
+            registry,
+            concurrency=args.concurrency,
+            rate_limit=args.rate_limit,
+            force=args.force,
+            log=print,
+            on_response=on_response if args.verbose else None,
+            cancel=args.cancel,
+            retry_policy=RetryPolicy(args.connect_timeout, args.read_timeout, args.max_attempts),
+            metrics=args.metrics,
+        )
+    print(f"Rows checked: {summary['checked']}")
+    print(f"Unchanged since the last update: {summary['unchanged']}")
+    print(f"DOIs updated: {summary['updated']}/{summary['sent']}")
+    print(f"Results saved to {summary['output_path']}.")
+    return 0 if summary["updated"] == summary["sent"] else 1
+
+
+def cmd_build_payloads(args):
+    from super_duper.mint import build_payload_batch, load_credentials
+
+    doi_prefix = args.prefix or load_credentials(args.credentials)["doiPrefix"]
+    count = build_payload_batch(args.datacite_csv, args.batch_jsonl, doi_prefix, cancel=args.cancel)
+    print(f"{count} payloads for prefix {doi_prefix} saved to {args.batch_jsonl}")
+    return 0
+
+
+def cmd_merge(args):
+    from super_duper.merge import MAX_IN_MEMORY_SOURCES, merge_dois
+    from super_duper.registry import DoiRegistry, registry_path
+
+    if bool(args.from_registry) == bool(args.datacite_export_csv):
+        print("Give either a DataCite export CSV or --from-registry.", file=sys.stderr)
+        return 2
+    registry = DoiRegistry(registry_path()) if args.from_registry else None
+    try:
+        summary = merge_dois(
+            args.datacite_export_csv, args.dspace_csv, args.output,
+            log=print if args.verbose else None, cancel=args.cancel,
+            max_in_memory=args.max_in_memory or MAX_IN_MEMORY_SOURCES,
+            registry=registry,
+            metrics=args.metrics,
+        )
+    finally:
+        if registry is not None:
+            registry.close()
+    print("--- Summary ---")
+    print(f"Total DOIs in {'the DOI registry' if args.from_registry else 'Datacite Export CSV'}: {summary['total_export_dois']}")
+    print(f"DOIs added: {summary['dois_added']}")
+    print(f"Rows skipped (DOI already present): {summary['rows_skipped']}")
+    print(f"Rows with no match: {summary['rows_unmatched']}")
+    print(f"Updated CSV saved as: {summary['output_csv']}")
+    return 0
+
+
+def cmd_stats(args):
+    from super_duper.stats import collect_doi_stats
+
+    stats = collect_doi_stats(args.log_dir, log=lambda message: print(message, file=sys.stderr), metrics=args.metrics)
+    counts = stats[f"by_{args.by}"]
+    if not stats["by_prefix"]:
+        print("No successful DOIs found in the log files.")
+    if args.by in ("prefix", "status"):
+        # Biggest first, as on the statistics page
+        ordered = sorted(counts.items(), key=lambda x: x[1], reverse=True)
+    else:
+        ordered = sorted(counts.items())
+    for key, count in ordered:
+        print(f"{key}\t{count}")
+    return 0
+
+
+def cmd_compress_logs(args):
+    from super_duper.logs import compress_old_logs
+
+    compressed = compress_old_logs(args.log_dir, args.older_than, "zstd" if args.zstd else "gzip", log=print)
+    print(f"{len(compressed)} mint logs compressed.")
+    return 0
+
+
+def cmd_mock_datacite(args):
+    from super_duper.mockapi import MockDataCite
+
+    mock = MockDataCite(
+        args.host, args.port, username=args.username, password=args.password, latency=args.latency,
+        error_rate=args.error_rate, reject_rate=args.reject_rate, auth_failure_rate=args.auth_failure_rate,
+        rate_limit=args.rate_limit, burst=args.burst, seed=args.seed,
+    )
+    with mock:
+        print(f"Mock DataCite API listening; set the credentials url to {mock.url} (Ctrl-C to stop)")
+        while not args.cancel.wait(1):
+            pass
+    for status, count in sorted(mock.counts.items()):
+        print(f"{status}\t{count}")
+    return 0
+
+
+def cmd_reconcile(args):
+    from super_duper.mint import RetryPolicy, load_credentials
+    from super_duper.reconcile import DIFF_KINDS, reconcile
+
+    summary = reconcile(
+        load_credentials(args.credentials), args.dspace_csv, args.report_csv,
+        concurrency=args.concurrency,
+        retry_policy=RetryPolicy(args.connect_timeout, args.read_timeout, args.max_attempts),
+        log=print, cancel=args.cancel, metrics=args.metrics,
+    )
+    print(f"Report saved to {summary['report_csv']}")
+    return 1 if any(summary[kind] for kind in DIFF_KINDS) else 0
+
+
+def cmd_registry(args):
+    from super_duper.compression import open_text
+    from super_duper.records import write_export_rows
+    from super_duper.registry import DoiRegistry, registry_path
+
+    with DoiRegistry(registry_path(args.log_dir)) as registry:
+        if args.action == "backfill":
+            files, rows = registry.backfill(args.log_dir, log=lambda message: print(message, file=sys.stderr))
+            print(f"{rows} rows from {files} new mint logs recorded.")
+            for status, count in sorted(registry.counts().items()):
+                print(f"{status or 'No response'}\t{count}")
+        elif args.action == "lookup":
+            minted = registry.minted(args.sources)
+            for source in args.sources:
+                print(f"{source}\t{minted.get(source, '')}")
+        else:
+            with open_text(args.export_csv, "w", newline="") as file:
+                write_export_rows(file, registry.export_rows())
+            print(f"Registry saved to {args.export_csv}")
+    return 0
+
+
+def cmd_shards(args):
+    from super_duper import shards
+
+    if args.action == "split":
+        manifest = shards.split_import(args.datacite_csv, args.shard_dir, args.shards)
+        print(f"{manifest['rows']} rows split into {len(manifest['shards'])} shards in {args.shard_dir}")
+    elif args.action == "status":
+        counts = {}
+        for index, state, detail in shards.shard_status(args.shard_dir, args.lease_seconds):
+            counts[state] = counts.get(state, 0) + 1
+            print(f"{index}\t{state}\t{detail}")
+        print(", ".join(f"{count} {state}" for state, count in sorted(counts.items())))
+    elif args.action == "work":
+        from super_duper.mint import RetryPolicy, load_credentials
+        from super_duper.registry import DoiRegistry, registry_path
+
+        registry = None if args.no_registry else DoiRegistry(registry_path())
+        try:
+            finished = shards.work_shards(
+                args.shard_dir,
+                load_credentials(args.credentials),
+                concurrency=args.concurrency,
+                rate_limit=args.rate_limit,
+                lease_seconds=args.lease_seconds,
+                log=print,
+                cancel=args.cancel,
+                retry_policy=RetryPolicy(args.connect_timeout, args.read_timeout, args.max_attempts),
+                registry=registry,
+                metrics=args.metrics,
+            )
+        finally:
+            if registry is not None:
+                registry.close()
+        print(f"No shards left to claim; {len(finished)} finished by this worker.")
+    else:
+        summary = shards.merge_shard_results(args.shard_dir, args.output_csv, log=print)
+        print(f"Results saved to {summary['output_path']}.")
+        print(f"Total DOIs successfully generated: {summary['successful']}/{summary['total']}")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="super_duper", description="DSpace and DataCite tools without the GUI.")
+    parser.add_argument("--metrics-dir", help="Where run metrics (JSON and Prometheus textfile) go (default: ./log/metrics)")
+    parser.add_argument("--no-metrics", action="store_true", help="Don't save run metrics")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    convert = commands.add_parser("convert", help="Convert DSpace export CSVs to a Datacite import CSV")
+    convert.add_argument("dspace_csv", nargs="+", help="DSpace export CSVs, or directories of them")
+    convert.add_argument("datacite_csv", help="Output CSV; with --per-file, the name each output is based on")
+    convert.add_argument("--per-file", action="store_true",
+                         help="Write one output per input (DataciteImport_<input name>.csv) instead of combining them")
+    convert.add_argument("--type-mapping", help="Type mapping JSON (default: type_mapping.json if present, else built-in)")
+    convert.add_argument("--workers", type=int, default=1,
+                         help="Convert across this many processes, one file each when there are several; "
+                              "0 for one per CPU (default: 1)")
+    convert.set_defaults(func=cmd_convert)
+
+    build = commands.add_parser("build-payloads", help="Write the DataCite request bodies for an import CSV to a JSONL batch")
+    build.add_argument("datacite_csv")
+    build.add_argument("batch_jsonl")
+    prefix = build.add_mutually_exclusive_group(required=True)
+    prefix.add_argument("--prefix", help="DOI prefix to mint under")
+    prefix.add_argument("--credentials", help="Take the DOI prefix from this credentials JSON")
+    build.set_defaults(func=cmd_build_payloads)
+
+    mint = commands.add_parser("mint", help="Mint DOIs for a Datacite import CSV or a payload batch (.jsonl)")
+    mint.add_argument("datacite_csv", metavar="datacite_csv_or_batch")
+    mint.add_argument("output_csv")
+    mint.add_argument("--credentials", required=True, help="Credentials JSON, see templatecreds.json.sample")
+    mint.add_argument("--concurrency", type=int, default=4, help="Concurrent requests (default: 4)")
+    mint.add_argument("--rate-limit", type=float, default=10, help="Max requests per second (default: 10)")
+    mint.add_argument("--resume", action="store_true", help="Skip rows already minted in this file's journal")
+    mint.add_argument("--rows", help="Only send these rows (batch lines), e.g. 1-100,250")
+    mint.add_argument("--failed-only", action="store_true",
+                      help="Only send rows whose last attempt in this file's journal failed")
+    mint.add_argument("--connect-timeout", type=float, default=10, help="Seconds to wait for a connection (default: 10)")
+    mint.add_argument("--read-timeout", type=float, default=60, help="Seconds to wait for a response (default: 60)")
+    mint.add_argument("--max-attempts", type=int, default=5,
+                      help="Tries per row for throttling, 5xx and network errors (default: 5)")
+    mint.add_argument("--no-registry", action="store_true",
+                      help="Neither skip sources the DOI registry has DOIs for nor record this run in it")
+    mint.add_argument("-v", "--verbose", action="store_true", help="Print one line per DOI")
+    mint.set_defaults(func=cmd_mint)
+
+    update = commands.add_parser("update", help="Send changed metadata of already minted DOIs to DataCite")
+    update.add_argument("datacite_csv", metavar="datacite_csv_or_batch")
+    update.add_argument("output_csv")
+    update.add_argument("--credentials", required=True, help="Credentials JSON, see templatecreds.json.sample")
+    update.add_argument("--force", action="store_true", help="Send every registered row, changed or not")
+    update.add_argument("--concurrency", type=int, default=4, help="Concurrent requests (default: 4)")
+    update.add_argument("--rate-limit", type=float, default=10, help="Max requests per second (default: 10)")
+    update.add_argument("--connect-timeout", type=float, default=10, help="Seconds to wait for a connection (default: 10)")
+    update.add_argument("--read-timeout", type=float, default=60, help="Seconds to wait for a response (default: 60)")
+    update.add_argument("--max-attempts", type=int, default=5,
+                        help="Tries per row for throttling, 5xx and network errors (default: 5)")
+    update.add_argument("-v", "--verbose", action="store_true", help="Print one line per DOI")
+    update.set_defaults(func=cmd_update)
+
+    merge = commands.add_parser("merge", help="Add minted DOIs to a DSpace import CSV")
+    merge.add_argument("datacite_export_csv", nargs="?", help="DataCite export CSV (leave out with --from-registry)")
+    merge.add_argument("dspace_csv")
+    merge.add_argument("--from-registry", action="store_true", help="Take the DOIs from the DOI registry")
+    merge.add_argument("--output", help="Output CSV (default: updated_<dspace_csv> alongside it)")
+    merge.add_argument("--max-in-memory", type=int,
+                       help="Export DOIs to hold in memory before indexing them on disk (default: 500000)")
+    merge.add_argument("-v", "--verbose", action="store_true", help="Print one line per row")
+    merge.set_defaults(func=cmd_merge)
+
+    stats = commands.add_parser("stats", help="Count created DOIs from the log directory")
+    stats.add_argument("--log-dir", help="Log directory (default: ./log)")
+    stats.add_argument("--by", choices=["prefix", "day", "month", "status"], default="prefix",
+                       help="Break created DOIs down by prefix, day or month, or all rows by status (default: prefix)")
+    stats.set_defaults(func=cmd_stats)
+
+    compress = commands.add_parser("compress-logs", help="Compress old mint logs in the log directory")
+    compress.add_argument("--log-dir", help="Log directory (default: ./log)")
+    compress.add_argument("--older-than", type=float, default=30, metavar="DAYS",
+                          help="Only logs last written more than this many days ago (default: 30)")
+    compress.add_argument("--zstd", action="store_true", help="Compress to .csv.zst (needs zstandard) rather than .csv.gz")
+    compress.set_defaults(func=cmd_compress_logs)
+
+    reconcile = commands.add_parser("reconcile", help="Compare the prefix's DOIs at DataCite with a DSpace export")
+    reconcile.add_argument("dspace_csv")
+    reconcile.add_argument("report_csv")
+    reconcile.add_argument("--credentials", required=True, help="Credentials JSON, see templatecreds.json.sample")
+    reconcile.add_argument("--concurrency", type=int, default=4, help="Creation years listed at once (default: 4)")
+    reconcile.add_argument("--connect-timeout", type=float, default=10, help="Seconds to wait for a connection (default: 10)")
+    reconcile.add_argument("--read-timeout", type=float, default=60, help="Seconds to wait for a response (default: 60)")
+    reconcile.add_argument("--max-attempts", type=int, default=5,
+                           help="Tries per page for throttling, 5xx and network errors (default: 5)")
+    reconcile.set_defaults(func=cmd_reconcile)
+
+    registry = commands.add_parser("registry", help="Work with the source -> DOI registry (log/doi_registry.sqlite)")
+    registry.add_argument("--log-dir", help="Log directory holding the registry and mint logs (default: ./log)")
+    actions = registry.add_subparsers(dest="action", required=True)
+    actions.add_parser("backfill", help="Record every mint log not read before")
+    lookup = actions.add_parser("lookup", help="Print the DOI of each source, if it has one")
+    lookup.add_argument("sources", nargs="+")
+    export = actions.add_parser("export", help="Write the registry as a DataCite export CSV")
+    export.add_argument("export_csv")
+    registry.set_defaults(func=cmd_registry)
+
+    shards = commands.add_parser("shards", help="Mint one import from several hosts sharing a directory")
+    actions = shards.add_subparsers(dest="action", required=True)
+    split = actions.add_parser("split", help="Cut an import CSV or payload batch into shards")
+    split.add_argument("datacite_csv", metavar="datacite_csv_or_batch")
+    split.add_argument("shard_dir")
+    split.add_argument("--shards", type=int, required=True, help="Number of shards")
+    work = actions.add_parser("work", help="Claim and mint shards until none is left")
+    work.add_argument("shard_dir")
+    work.add_argument("--credentials", required=True, help="Credentials JSON, see templatecreds.json.sample")
+    work.add_argument("--concurrency", type=int, default=4, help="Concurrent requests (default: 4)")
+    work.add_argument("--rate-limit", type=float, default=10, help="Max requests per second on this host (default: 10)")
+    work.add_argument("--connect-timeout", type=float, default=10, help="Seconds to wait for a connection (default: 10)")
+    work.add_argument("--read-timeout", type=float, default=60, help="Seconds to wait for a response (default: 60)")
+    work.add_argument("--max-attempts", type=int, default=5,
+                      help="Tries per row for throttling, 5xx and network errors (default: 5)")
+    work.add_argument("--no-registry", action="store_true",
+                      help="Neither skip sources this host's DOI registry has DOIs for nor record the shards in it")
+    status = actions.add_parser("status", help="Show which shards are done, leased or waiting")
+    status.add_argument("shard_dir")
+    merge_shards = actions.add_parser("merge", help="Join the shard results into one export CSV and mint log")
+    merge_shards.add_argument("shard_dir")
+    merge_shards.add_argument("output_csv")
+    for action in (work, status):
+        action.add_argument("--lease-seconds", type=float, default=120,
+                            help="A lease not renewed for this long may be taken over (default: 120)")
+    shards.set_defaults(func=cmd_shards)
+
+    mock = commands.add_parser("mock-datacite", help="Serve a local stand-in for the DataCite /dois API")
+    mock.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: %(default)s)")
+    mock.add_argument("--port", type=int, default=8765, help="Port to listen on (default: %(default)s)")
+    mock.add_argument("--username", help="Require these Basic auth credentials (default: accept any)")
+    mock.add_argument("--password")
+    mock.add_argument("--latency", default="fixed:0",
+                      help="Response delay in ms: fixed:50, uniform:20-200, exponential:50 or lognormal:50,0.5 (default: %(default)s)")
+    mock.add_argument("--error-rate", type=float, default=0.0, help="Share of requests failing with 500/502/503 (default: 0)")
+    mock.add_argument("--reject-rate", type=float, default=0.0, help="Share of requests rejected with 422 (default: 0)")
+    mock.add_argument("--auth-failure-rate", type=float, default=0.0, help="Share of requests failing with 401 (default: 0)")
+    mock.add_argument("--rate-limit", type=float, help="Requests per second before answering 429 (default: unlimited)")
+    mock.add_argument("--burst", type=float, help="Requests allowed at once above the rate limit (default: one second's worth)")
+    mock.add_argument("--seed", type=int, help="Random seed, to repeat a run exactly")
+    mock.set_defaults(func=cmd_mock_datacite)
+
+    return parser
+
+
+def install_cancel_handler():
+    """First Ctrl-C sets the returned event, the second raises KeyboardInterrupt as usual."""
+    cancel = threading.Event()
+
+    def on_interrupt(signum, frame):
+        if cancel.is_set():
+            raise KeyboardInterrupt
+        cancel.set()
+        print("Stopping after the rows in progress (Ctrl-C again to abort)...", file=sys.stderr)
+
+    signal.signal(signal.SIGINT, on_interrupt)
+    return cancel
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.cancel = install_cancel_handler()
+    args.metrics = None
+    if args.command in METERED_COMMANDS and not args.no_metrics:
+        from super_duper.metrics import Metrics
+        args.metrics = Metrics(args.command)
+    try:
+        return args.func(args)
+    except Cancelled:
+        print("Cancelled. Output written so far has been kept.", file=sys.stderr)
+        return 130
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if args.metrics is not None:
+            from super_duper.metrics import write_run_metrics
+            try:
+                json_path, prom_path = write_run_metrics(args.metrics, args.metrics_dir)
+                print(f"Metrics saved to {json_path} and {prom_path}", file=sys.stderr)
+            except OSError as e:
+                print(f"Could not save metrics: {e}", file=sys.stderr)
@@ -0,0 +1,123 @@
+"""
+Transparent gzip and Zstandard compression for the CSVs (and payload batches) the
+tools read and write, chosen by file name: `export.csv.gz`, `DataciteImport.csv.zst`.
+
+Compressed files are streamed through the (de)compressor a buffer at a time and
+never held whole in memory. gzip comes with Python; `.zst` needs the optional
+`zstandard` package, imported only when such a file is opened.
+"""
+import gzip
+import io
+import os
+import shutil
+
+COMPRESSION_SUFFIXES = {".gz": "gzip", ".zst": "zstd"}
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 6
+
+
+def compression_for(path):
+    """'gzip', 'zstd' or None, from the file name."""
+    lower = os.fspath(path).lower()
+    for suffix, method in COMPRESSION_SUFFIXES.items():
+        if lower.endswith(suffix):
+            return method
+    return None
+
+
+def suffix_for(method):
+    return {method: suffix for suffix, method in COMPRESSION_SUFFIXES.items()}[method]
+
+
+def compression_suffix(name):
+    """'.gz', '.zst' or '' for an uncompressed name."""
+    method = compression_for(name)
+    return suffix_for(method) if method else ""
+
+
+def strip_compression(name):
+    """'theses.csv.gz' -> 'theses.csv'; other names are returned as they are."""
+    method = compression_for(name)
+    return name[:-len(suffix_for(method))] if method else name
+
+
+def has_extension(name, *extensions):
+    """Whether `name` ends in one of `extensions` ('.csv', ...), compressed or not."""
+    return strip_compression(name).lower().endswith(extensions)
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError("Reading or writing .zst files needs the zstandard package (pip install zstandard)") from None
+    return zstandard
+
+
+def _open(path, mode, method):
+    """(binary stream, underlying file) for open_binary and open_text."""
+    raw = open(path, mode)
+    try:
+        if method == "gzip":
+            # mtime=0 keeps the output the same from run to run
+            stream = gzip.GzipFile(fileobj=raw, mode=mode, compresslevel=GZIP_LEVEL, mtime=0)
+            # GzipFile leaves a file object it was given open
+            stream.myfileobj = raw
+        elif "r" in mode:
+            reader = _zstandard().ZstdDecompressor().stream_reader(raw, read_across_frames=True, closefd=True)
+            # Buffered, for readline() and iterating over lines
+            stream = io.BufferedReader(reader)
+        else:
+            stream = io.BufferedWriter(_zstandard().ZstdCompressor(level=ZSTD_LEVEL).stream_writer(raw, closefd=True))
+    except BaseException:
+        raw.close()
+        raise
+    return stream, raw
+
+
+def open_binary(path, mode="rb", compression=None):
+    """
+    Open `path` for binary reading ("rb") or writing ("wb"), through the compressor
+    its name calls for, or `compression` ('gzip', 'zstd' or None) when the name is a
+    temporary one (e.g. `out.csv.gz.part`).
+    """
+    method = compression_for(path) if compression is None else compression
+    if not method:
+        return open(path, mode)
+    return _open(path, mode, method)[0]
+
+
+def open_text(path, mode="r", encoding="utf-8", newline=None, compression=None):
+    """
+    open() for text, decompressing or compressing by file name (or `compression`) as
+    open_binary does. A compressed file's `raw_file` is the underlying file, whose
+    position is how far through the compressed data reading has got.
+    """
+    method = compression_for(path) if compression is None else compression
+    if not method:
+        return open(path, mode, encoding=encoding, newline=newline)
+    stream, raw = _open(path, mode.replace("t", "") + "b", method)
+    text = io.TextIOWrapper(stream, encoding=encoding, newline=newline)
+    text.raw_file = raw
+    return text
+
+
+def compress_file(path, method="gzip"):
+    """
+    Replace `path` with a compressed copy named `<path>.gz` (or `.zst`), keeping its
+    modification time. Returns the new path.
+    """
+    target = path + suffix_for(method)
+    partial = f"{target}.part"
+    try:
+        with open(path, "rb") as source, open_binary(partial, "wb", method) as compressed:
+            shutil.copyfileobj(source, compressed, 1024 * 1024)
+    except BaseException:
+        if os.path.exists(partial):
+            os.unlink(partial)
+        raise
+    shutil.copystat(path, partial)
+    os.replace(partial, target)
+    os.unlink(path)
+    return target
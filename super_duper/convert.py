@@ -0,0 +1,780 @@
+"""
+DSpace export -> Datacite import CSV conversion.
+
+Everything here is plain Python and stdlib only, so it can be imported by the
+Flet app, the command line and batch jobs alike.
+"""
+import csv
+import io
+import itertools
+import json
+import os
+import re
+import shutil
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from operator import itemgetter
+
+from super_duper.compression import compression_for, has_extension, open_text, strip_compression
+from super_duper.jobs import Cancelled, ReadProgress, check_cancelled
+from super_duper.metrics import Metrics
+from super_duper.records import (
+    DATACITE_IMPORT_FIELDS, IMPORT_CREATOR_GROUPS, Creator, DataciteRecord, creator_groups, import_fields,
+    widen_import_row,
+)
+
+
+def reverse_name_order(name):
+    """Reverse the order of a name formatted as 'LASTNAME, FIRSTNAME' and strip trailing periods."""
+    parts = [part.strip().rstrip(".") for part in name.split(",")]
+    if len(parts) == 2:
+        return f"{parts[1]} {parts[0]}"
+    return name.strip().rstrip(".")
+
+
+class NameNormalizer:
+    """
+    DSpace contributor names -> Creators, remembering every distinct name seen.
+
+    The same few thousand names recur across an export, so each is cleaned up
+    (authority key dropped, 'LASTNAME, FIRSTNAME' reversed, split into given and
+    family name) only once. Past `max_names` distinct names the memo starts over.
+    """
+
+    AUTHORITY = re.compile(r"::.*")
+
+    def __init__(self, max_names=100_000):
+        self.max_names = max_names
+        self.cache = {}
+
+    def creator(self, name):
+        """The Creator for one raw `||`-separated value, or None if nothing is left of it."""
+        try:
+            return self.cache[name]
+        except KeyError:
+            pass
+        cleaned = reverse_name_order(self.AUTHORITY.sub("", name).strip().rstrip("."))
+        creator = Creator(cleaned, "Personal", *split_name(cleaned)) if cleaned else None
+        if len(self.cache) >= self.max_names:
+            self.cache.clear()
+        self.cache[name] = creator
+        return creator
+
+    def creators(self, field_data):
+        """The Creators of a contributor cell, in order."""
+        creators = []
+        for name in field_data.split("||"):
+            creator = self.creator(name)
+            if creator is not None:
+                creators.append(creator)
+        return creators
+
+
+TYPE_MAPPING_FILE = "type_mapping.json"
+
+DEFAULT_TYPE_MAPPING = {
+    r"abstract.*": "Text",
+    r"archival.*": "Other",
+    r"article.*": "Text",    
+    r"audio.*": "Sound",
+    r"blog.*": "Text",
+    r"book": "Book",
+    r"book chapter.*": "BookChapter",
+    r"book review.*": "Other",
+    r"brief.*": "Other",
+    r"case.*": "Report",
+    r"chapbook": "Book",
+    r"conference.*": "ConferencePaper",
+    r"data.*": "Dataset",
+    r"guidebook": "Book",
+    r"illustration.*": "Image",
+    r"image.*": "Image",
+    r"interview.*": "Other",
+    r"journal.*": "Journal",
+    r"magazine.*": "JournalArticle",
+    r".*project.*": "Project",
+    r"map": "Other",
+    r"news.*": "Newspaper",
+    "Other": "Other",
+    r"paper.*": "Project",
+    r"play.*": "Other",
+    r"poster*": "Image",
+    r"presentation.*": "Other",
+    r"realia.*": "Other",
+    r".*oral.*": "Sound",
+    r".*report.*": "Report",
+    r"research.*": "Project",
+    r"spoken.*": "Sound",
+    r"template.*": "Other",
+    r"thesis.*": "Dissertation",
+    r"video.*": "Audiovisual",
+    r"web.*": "InteractiveResource",
+    r"working paper.*": "Project"
+}
+
+
+class TypeMatcher:
+    """
+    A type mapping compiled once into a single first-match-wins regex.
+
+    Patterns are tried in mapping order, exactly as `re.match` over each one in
+    turn would, and the answer for every distinct normalized DSpace type is
+    cached, so an export only pays for the regex a few dozen times.
+    Invalid patterns raise ValueError here rather than on every row.
+    """
+
+    def __init__(self, type_mapping):
+        self.mapping = dict(type_mapping)
+        self.datacite_types = list(self.mapping.values())
+        compiled = []
+        for pattern in self.mapping:
+            try:
+                compiled.append(re.compile(pattern, re.IGNORECASE))
+            except re.error as e:
+                raise ValueError(f"Invalid type mapping pattern {pattern!r}: {e}") from None
+
+        self.patterns = None
+        self.combined = None
+        if compiled and not any(regex.groups for regex in compiled):
+            try:
+                self.combined = re.compile(
+                    "|".join(f"(?P<_{i}>{pattern})" for i, pattern in enumerate(self.mapping)),
+                    re.IGNORECASE,
+                )
+            except re.error:
+                pass
+        if self.combined is None:
+            # Patterns with their own groups or inline flags can't share one regex
+            self.patterns = compiled
+        self.cache = {}
+
+    def __len__(self):
+        return len(self.mapping)
+
+    def match(self, dspace_type):
+        if not dspace_type:
+            return "Unknown"
+        dspace_type = dspace_type.strip().lower()  # Normalize input
+        try:
+            return self.cache[dspace_type]
+        except KeyError:
+            pass
+        datacite_type = "Unknown"
+        if self.combined is not None:
+            m = self.combined.match(dspace_type)
+            if m:
+                datacite_type = self.datacite_types[int(m.lastgroup[1:])]
+        else:
+            for regex, candidate in zip(self.patterns, self.datacite_types):
+                if regex.match(dspace_type):
+                    datacite_type = candidate
+                    break
+        self.cache[dspace_type] = datacite_type
+        return datacite_type
+
+
+def load_type_mapping(path=TYPE_MAPPING_FILE):
+    """The saved type mapping if there is one, else the built-in default, compiled."""
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as file:
+            return TypeMatcher(json.load(file))
+    return TypeMatcher(DEFAULT_TYPE_MAPPING)
+
+
+#Map DSpace types =>  Datacite types.
+def map_type(dspace_type, type_mapping):
+    if not isinstance(type_mapping, TypeMatcher):
+        type_mapping = TypeMatcher(type_mapping)
+    return type_mapping.match(dspace_type)
+
+def extract_year(date_str):
+    try:
+        # Attempt to parse the date in different formats
+        for fmt in ("%Y", "%d/%m/%Y", "%d-%b", "%Y-%m-%d", "%d-%b-%Y"):
+            try:
+                parsed_date = datetime.strptime(date_str, fmt)
+                return parsed_date.year
+            except ValueError:
+                continue
+        # If no format matches, return "Unknown"
+        return "Unknown"
+    except Exception:
+        return "Unknown"
+
+
+DSPACE_URI_PATTERNS = ["http://hdl.handle.net/10613", "http://hdl.handle.net/10170"]
+
+def split_name(name):
+    parts = name.split()
+    if len(parts) > 1:
+        return " ".join(parts[:-1]), parts[-1]
+    return "", name
+
+
+class DSpaceFieldPlan:
+    """
+    Where every field the converter needs lives in one particular DSpace export.
+
+    The `dc.title[en]` / `dc.title` / ... fallbacks are resolved against the header
+    once, and each row is projected down to just those columns, so wide exports
+    never build a dict holding provenance and fulltext for every row. Logical fields
+    are stored as positions in the projected tuple; a field the export lacks points
+    at a trailing empty string.
+    """
+
+    def __init__(self, header):
+        # Later duplicates win, as they would in a DictReader row
+        positions = {name: i for i, name in enumerate(header)}
+        self.width = len(header)
+        self.indices = []
+        slots = {}
+
+        def slot(name):
+            if name not in slots:
+                slots[name] = len(self.indices)
+                self.indices.append(positions[name])
+            return slots[name]
+
+        def first(*names):
+            for name in names:
+                if name in positions:
+                    return slot(name)
+            return None
+
+        def present(*names):
+            return tuple(slot(name) for name in names if name in positions)
+
+        self.title = first("dc.title[en]", "dc.title", "dc.title[]")
+        self.year = first("dc.date.issued[]", "dc.date.issued[en]", "dc.date.issued")
+        self.type = first("dc.type[en]", "dc.type", "dc.type[]")
+        self.description = first("dc.description.abstract[en]", "dc.description", "dc.description[]")
+        self.publisher = first("dc.publisher[en]")
+        self.uris = present("dc.identifier.uri[]", "dc.identifier.uri", "dc.identifier.uri[en]")
+        self.contributors = tuple(
+            fields for fields in (
+                present(f"dc.contributor.{group}[en]", f"dc.contributor.{group}[]", f"dc.contributor.{group}")
+                for group in ["author", "other", "editor", "advisor"]
+            ) if fields
+        )
+
+        # Missing fields read the empty string appended after the real columns
+        blank = len(self.indices)
+        self.indices.append(self.width)
+        for field in ["title", "year", "type", "description", "publisher"]:
+            if getattr(self, field) is None:
+                setattr(self, field, blank)
+        self.getter = itemgetter(*self.indices)
+
+    def project(self, row):
+        """Only the needed cells of a csv.reader row, padded if the row is short."""
+        if len(row) != self.width:
+            row = (row + [""] * self.width)[:self.width]
+        row.append("")
+        values = self.getter(row)
+        return values if len(self.indices) > 1 else (values,)
+
+
+def convert_dspace_row(values, plan, type_mapping, names=None):
+    """
+    Turn one projected DSpace export row into a DataciteRecord (one Datacite import row)
+    with a Creator for every contributor; `names` is the NameNormalizer to use.
+    """
+    names = names or NameNormalizer()
+    title = values[plan.title].strip()
+    year = str(extract_year(values[plan.year].strip()))
+    type_field = map_type(values[plan.type].strip(), type_mapping)
+    description = values[plan.description].strip()
+    publisher = values[plan.publisher].strip()
+
+    source = ""
+    for uri_slot in plan.uris:
+        if any(pattern in values[uri_slot] for pattern in DSPACE_URI_PATTERNS):
+            source = values[uri_slot].split("||")[0].strip()
+            break
+
+    creators = row_creators(values, plan, names)
+    return DataciteRecord(title, year, type_field, description, creators or [Creator("Unknown")], publisher, source)
+
+
+def row_creators(values, plan, names):
+    """The Creators of every contributor of one projected row, in field order."""
+    creators = []
+    for field_slots in plan.contributors:
+        # First non-empty of the [en], [] and bare variants
+        for field_slot in field_slots:
+            field_data = values[field_slot].strip()
+            if field_data:
+                creators += names.creators(field_data)
+                break
+    return creators
+
+
+def widen_creator_groups(partial_csv, groups, narrow_rows, compression=None):
+    """
+    Pad a converted CSV out to `groups` creator column groups: its header and those of
+    its first `narrow_rows` rows that were written with fewer get blank groups added.
+    The rows after them are already that wide and are copied as they are.
+    """
+    widened = f"{partial_csv}.wide"
+    try:
+        with open_text(partial_csv, "r", newline="", compression=compression) as narrow, \
+                open_text(widened, "w", newline="", compression=compression) as wide:
+            reader = csv.reader(narrow)
+            writer = csv.writer(wide)
+            next(reader, None)
+            writer.writerow(import_fields(groups))
+            writer.writerows(widen_import_row(row, groups) for row in itertools.islice(reader, narrow_rows))
+            shutil.copyfileobj(narrow, wide, 1024 * 1024)
+    except BaseException:
+        if os.path.exists(widened):
+            os.unlink(widened)
+        raise
+    os.replace(widened, partial_csv)
+
+
+def read_dspace_rows(dspace_file):
+    """
+    Resolve the field plan from an open DSpace export's header.
+
+    Returns (plan, rows) where rows lazily yields projected rows; blank lines are
+    skipped as DictReader would.
+    """
+    reader = csv.reader(dspace_file)
+    plan = DSpaceFieldPlan(next(reader, []))
+    return plan, (plan.project(row) for row in reader if row)
+
+
+def convert_dspace_rows(rows, plan, type_mapping, names=None):
+    """Lazily convert DSpace rows; nothing is held beyond the row being worked on."""
+    names = names or NameNormalizer()
+    for values in rows:
+        yield convert_dspace_row(values, plan, type_mapping, names)
+
+
+# Rows per unit of work in a parallel conversion
+DEFAULT_CHUNK_SIZE = 2000
+
+# Set in each worker process by _init_convert_worker: (plan, TypeMatcher, NameNormalizer)
+_worker_state = None
+
+
+def _init_convert_worker(plan, mapping):
+    global _worker_state
+    _worker_state = (plan, TypeMatcher(mapping), NameNormalizer())
+
+
+def _convert_chunk(chunk, groups):
+    """
+    Convert a list of projected rows in a worker. Returns (CSV text, creator groups): the
+    rows have `groups` creator groups, or more if one of them needs more.
+    """
+    plan, type_mapping, names = _worker_state
+    records = [convert_dspace_row(values, plan, type_mapping, names) for values in chunk]
+    groups = max(groups, max(len(record.creators) for record in records))
+    buffer = io.StringIO(newline="")
+    writer = csv.writer(buffer)
+    writer.writerows(record.csv_row(groups) for record in records)
+    return buffer.getvalue(), groups
+
+
+def _chunked(rows, chunk_size):
+    chunk = []
+    for values in rows:
+        chunk.append(values)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def convert_dspace_chunks(rows, plan, type_mapping, workers, chunk_size=DEFAULT_CHUNK_SIZE,
+                          groups=IMPORT_CREATOR_GROUPS):
+    """
+    Convert DSpace rows across `workers` processes.
+
+    Yields (row_count, csv_text, creator_groups) per chunk in input order. Each chunk
+    is written with as many creator groups as the widest chunk back so far when it was
+    sent (at least `groups`), or more if one of its own rows needs more, so a chunk
+    sent before a wider one came back can be narrower than it. At most two chunks per
+    worker are in flight, so memory stays flat however large the export is.
+    """
+    with ProcessPoolExecutor(workers, initializer=_init_convert_worker,
+                             initargs=(plan, type_mapping.mapping)) as pool:
+        pending = deque()
+
+        def finished():
+            nonlocal groups
+            count, future = pending.popleft()
+            text, chunk_groups = future.result()
+            groups = max(groups, chunk_groups)
+            return count, text, chunk_groups
+
+        try:
+            for chunk in _chunked(rows, chunk_size):
+                pending.append((len(chunk), pool.submit(_convert_chunk, chunk, groups)))
+                if len(pending) >= workers * 2:
+                    yield finished()
+            while pending:
+                yield finished()
+        finally:
+            for count, future in pending:
+                future.cancel()
+
+
+def process_csv(dspace_csv, datacite_csv, type_mapping, progress=None, cancel=None, workers=1,
+                chunk_size=DEFAULT_CHUNK_SIZE, metrics=None):
+    """
+    Convert a DSpace export CSV into a Datacite import CSV.
+
+    `type_mapping` is a TypeMatcher or a plain pattern -> type dict.
+    `progress(rows_read, estimated_total)` is called after every input row if given;
+    the total is extrapolated from how much of the file has been read. Once `cancel`
+    is set, the rows converted so far are kept as the output and Cancelled is raised.
+    With `workers` above 1 rows are converted in chunks across that many processes;
+    the output is byte-for-byte the same as the serial one.
+    The output has as many creator column groups as the row with the most contributors
+    needs (at least two). The input is read once: rows are written as wide as the
+    widest row so far, and if a later row needs more groups, the header and the rows
+    written before it are padded out once the conversion ends (widen_creator_groups).
+    Either file may be gzip or zstd compressed, by its name (`.csv.gz`, `.csv.zst`).
+    `metrics` (a Metrics) gets the row counts and the time spent reading and parsing,
+    converting, writing and widening.
+    Returns (input_row_count, output_row_count).
+    """
+    if not isinstance(type_mapping, TypeMatcher):
+        type_mapping = TypeMatcher(type_mapping)
+
+    # Rows stream straight through to a partial file, which replaces the output only once
+    # the whole export has converted cleanly, same as when everything was written at the end.
+    partial_csv = f"{datacite_csv}.part"
+    compression = compression_for(datacite_csv)
+    input_row_count = 0
+    output_row_count = 0
+    read_progress = ReadProgress(dspace_csv)
+    started = time.perf_counter()
+    read_seconds = 0.0
+    write_seconds = 0.0
+    widen_seconds = 0.0
+    groups = IMPORT_CREATOR_GROUPS
+    # Rows at the start of the output that may have fewer creator groups than `groups`
+    narrow_rows = 0
+    cancelled = False
+
+    def counted(rows):
+        nonlocal input_row_count, read_seconds
+        rows = iter(rows)
+        while True:
+            start = time.perf_counter()
+            row = next(rows, None)
+            read_seconds += time.perf_counter() - start
+            if row is None:
+                return
+            check_cancelled(cancel)
+            input_row_count += 1
+            if progress:
+                progress(input_row_count, read_progress.estimated_total(input_row_count))
+            yield row
+
+    try:
+        with open_text(dspace_csv, mode="r") as dspace_file, \
+                open_text(partial_csv, mode="w", newline="", compression=compression) as datacite_file:
+            writer = csv.writer(datacite_file)
+            writer.writerow(import_fields(groups))
+            try:
+                plan, dspace_rows = read_dspace_rows(read_progress.lines(dspace_file) if progress else dspace_file)
+                if workers and workers > 1:
+                    for count, text, chunk_groups in convert_dspace_chunks(
+                            counted(dspace_rows), plan, type_mapping, workers, chunk_size):
+                        start = time.perf_counter()
+                        datacite_file.write(text)
+                        write_seconds += time.perf_counter() - start
+                        if chunk_groups > groups:
+                            groups, narrow_rows = chunk_groups, output_row_count
+                        elif chunk_groups < groups:
+                            narrow_rows = output_row_count + count
+                        output_row_count += count
+                else:
+                    for record in convert_dspace_rows(counted(dspace_rows), plan, type_mapping):
+                        if len(record.creators) > groups:
+                            groups, narrow_rows = len(record.creators), output_row_count
+                        start = time.perf_counter()
+                        writer.writerow(record.csv_row(groups))
+                        write_seconds += time.perf_counter() - start
+                        output_row_count += 1
+            except Cancelled:
+                # Every row written so far is complete, so keep them as a valid, shorter output
+                cancelled = True
+        if groups > IMPORT_CREATOR_GROUPS:
+            start = time.perf_counter()
+            widen_creator_groups(partial_csv, groups, narrow_rows, compression)
+            widen_seconds = time.perf_counter() - start
+    except BaseException:
+        if os.path.exists(partial_csv):
+            os.unlink(partial_csv)
+        raise
+    finally:
+        if metrics is not None:
+            elapsed = time.perf_counter() - started
+            metrics.count("convert_rows_read_total", input_row_count)
+            metrics.count("convert_rows_written_total", output_row_count)
+            metrics.add_time("convert_stage_seconds_total", read_seconds, stage="read")
+            # With workers, this is the time spent waiting on them
+            metrics.add_time("convert_stage_seconds_total", elapsed - read_seconds - write_seconds - widen_seconds,
+                             stage="convert")
+            metrics.add_time("convert_stage_seconds_total", write_seconds, stage="write")
+            metrics.add_time("convert_stage_seconds_total", widen_seconds, stage="widen")
+            metrics.set("convert_rows_per_second", input_row_count / elapsed if elapsed else 0)
+            metrics.set("convert_workers", workers or 1)
+            metrics.set("convert_creator_groups", groups)
+
+    os.replace(partial_csv, datacite_csv)
+    if cancelled:
+        raise Cancelled()
+    return input_row_count, output_row_count
+
+
+def dspace_inputs(paths):
+    """
+    The DSpace export CSVs named by `paths`, in order and without repeats. A directory
+    stands for every `.csv` file directly inside it (`.csv.gz` and `.csv.zst` too), in name order.
+    """
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found.extend(sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if has_extension(name, ".csv") and os.path.isfile(os.path.join(path, name))
+            ))
+        else:
+            found.append(path)
+    seen = set()
+    return [path for path in found if not (os.path.abspath(path) in seen or seen.add(os.path.abspath(path)))]
+
+
+def per_file_output_paths(dspace_csvs, datacite_csv):
+    """
+    One output per input, named after both: `out/DataciteImport.csv` and
+    `exports/theses.csv` give `out/DataciteImport_theses.csv`. Outputs are compressed as
+    `datacite_csv` is, whatever the inputs are.
+    """
+    plain = strip_compression(datacite_csv)
+    root, ext = os.path.splitext(plain)
+    ext = (ext or ".csv") + datacite_csv[len(plain):]
+    paths = []
+    taken = set()
+    for dspace_csv in dspace_csvs:
+        stem = os.path.splitext(strip_compression(os.path.basename(dspace_csv)))[0]
+        path = f"{root}_{stem}{ext}"
+        n = 2
+        while path in taken:
+            # Same file name in two input directories
+            path = f"{root}_{stem}_{n}{ext}"
+            n += 1
+        taken.add(path)
+        paths.append(path)
+    return paths
+
+
+# Rows between progress reports from a batch worker
+BATCH_PROGRESS_EVERY = 500
+
+# Set in each batch worker process by _init_batch_worker: (cancel event, shared progress, TypeMatcher)
+_batch_state = None
+
+
+def _init_batch_worker(cancel, shared_progress, mapping):
+    global _batch_state
+    _batch_state = (cancel, shared_progress, TypeMatcher(mapping))
+
+
+def _convert_file(dspace_csv, output_csv, type_mapping, cancel=None, progress=None):
+    """
+    process_csv for one file of a batch, never raising: returns the file's summary with
+    the row counts (also for a cancelled or failed file) and its metrics counters.
+    """
+    metrics = Metrics("convert")
+    status, error = "converted", None
+    try:
+        process_csv(dspace_csv, output_csv, type_mapping, progress=progress, cancel=cancel, metrics=metrics)
+    except Cancelled:
+        status = "cancelled"
+    except Exception as e:
+        status, error = "failed", f"{type(e).__name__}: {e}"
+    return {
+        "input": dspace_csv,
+        "output": output_csv,
+        "input_rows": metrics.counters.get(("convert_rows_read_total", ()), 0),
+        "output_rows": metrics.counters.get(("convert_rows_written_total", ()), 0) if status != "failed" else 0,
+        "status": status,
+        "error": error,
+        "counters": metrics.counters,
+    }
+
+
+def _convert_batch_file(index, dspace_csv, output_csv):
+    cancel, shared_progress, type_mapping = _batch_state
+
+    def progress(done, total):
+        if done % BATCH_PROGRESS_EVERY == 0:
+            shared_progress[2 * index] = done
+            shared_progress[2 * index + 1] = total or done
+
+    return _convert_file(dspace_csv, output_csv, type_mapping, cancel, progress)
+
+
+def _combine_outputs(parts, datacite_csv):
+    """
+    Concatenate converted CSVs under one header, removing them afterwards. Parts with
+    fewer creator groups than the widest are padded to match it.
+    """
+    parts = [part for part in parts if os.path.exists(part)]
+    widths = []
+    for part in parts:
+        with open(part, "r", encoding="utf-8", newline="") as file:
+            widths.append(creator_groups(next(csv.reader(file), DATACITE_IMPORT_FIELDS)))
+    groups = max(widths, default=IMPORT_CREATOR_GROUPS)
+
+    partial_csv = f"{datacite_csv}.part"
+    with open_text(partial_csv, "w", newline="", compression=compression_for(datacite_csv)) as combined:
+        writer = csv.writer(combined)
+        writer.writerow(import_fields(groups))
+        for part, width in zip(parts, widths):
+            with open(part, "r", encoding="utf-8", newline="") as file:
+                if width == groups:
+                    file.readline()  # Its header
+                    shutil.copyfileobj(file, combined)
+                else:
+                    reader = csv.reader(file)
+                    next(reader, None)
+                    writer.writerows(widen_import_row(row, groups) for row in reader)
+    os.replace(partial_csv, datacite_csv)
+    for part in parts:
+        os.unlink(part)
+
+
+def process_csv_batch(dspace_csvs, datacite_csv, type_mapping, combine=True, workers=1, progress=None,
+                      cancel=None, log=None, metrics=None):
+    """
+    Convert several DSpace exports in one run, up to `workers` files at a time in
+    separate processes.
+
+    With `combine` every file's rows go, in input order, into `datacite_csv`;
+    otherwise each input gets its own output (see per_file_output_paths). A file that
+    fails to convert is reported and left out; the rest still convert.
+    `progress(rows_read, estimated_total)` covers all the files together and `log`
+    receives one line per finished file. Once `cancel` is set, files not yet started
+    are skipped, the rows converted so far are kept as with process_csv, and
+    Cancelled is raised after the outputs are written.
+    Returns one summary dict per input: input, output, input_rows, output_rows,
+    status (converted, cancelled, failed or skipped) and error.
+    """
+    import multiprocessing
+    from concurrent.futures import FIRST_COMPLETED, wait
+
+    log = log or (lambda message: None)
+    if not isinstance(type_mapping, TypeMatcher):
+        type_mapping = TypeMatcher(type_mapping)
+    outputs = (
+        [f"{datacite_csv}.{i}.tmp" for i in range(len(dspace_csvs))] if combine
+        else per_file_output_paths(dspace_csvs, datacite_csv)
+    )
+    sizes = [os.path.getsize(path) if os.path.exists(path) else 0 for path in dspace_csvs]
+    results = [None] * len(dspace_csvs)
+    started = time.perf_counter()
+
+    def finished(index, result):
+        result["output"] = datacite_csv if combine else result["output"]
+        counters = result.pop("counters")
+        results[index] = result
+        if metrics is not None:
+            for (name, labels), value in counters.items():
+                metrics.count(name, value, **dict(labels))
+            metrics.count("convert_files_total", status=result["status"])
+        log(format_file_summary(result))
+
+    workers = max(1, min(workers or 1, len(dspace_csvs)))
+    if workers == 1:
+        for index, (dspace_csv, output_csv) in enumerate(zip(dspace_csvs, outputs)):
+            if cancel is not None and cancel.is_set():
+                break
+            done_before = sum(result["input_rows"] for result in results[:index])
+
+            def file_progress(done, total, index=index, done_before=done_before):
+                remaining = sum(sizes[index + 1:])
+                rows_per_byte = (done_before + (total or done)) / max(1, sum(sizes[:index + 1]))
+                progress(done_before + done, round(done_before + (total or done) + remaining * rows_per_byte))
+
+            finished(index, _convert_file(dspace_csv, output_csv, type_mapping, cancel,
+                                          file_progress if progress else None))
+    else:
+        context = multiprocessing.get_context()
+        worker_cancel = context.Event()
+        # Rows read and estimated rows per file, each pair written only by the worker converting it
+        shared_progress = context.Array("d", 2 * len(dspace_csvs), lock=False)
+        with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_batch_worker,
+                                 initargs=(worker_cancel, shared_progress, type_mapping.mapping)) as pool:
+            pending = {
+                pool.submit(_convert_batch_file, index, dspace_csv, output_csv): index
+                for index, (dspace_csv, output_csv) in enumerate(zip(dspace_csvs, outputs))
+            }
+            while pending:
+                done, _ = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = pending.pop(future)
+                    if not future.cancelled():
+                        finished(index, future.result())
+                if cancel is not None and cancel.is_set() and not worker_cancel.is_set():
+                    worker_cancel.set()
+                    for future in pending:
+                        future.cancel()
+                if progress:
+                    rows_done = 0
+                    estimated = 0
+                    sized = 0
+                    for index, size in enumerate(sizes):
+                        if results[index] is not None:
+                            rows_done += results[index]["input_rows"]
+                            estimated += results[index]["input_rows"]
+                        elif shared_progress[2 * index]:
+                            rows_done += int(shared_progress[2 * index])
+                            estimated += shared_progress[2 * index + 1]
+                        else:
+                            continue
+                        sized += size
+                    # Files not started yet are assumed to hold as many rows per byte as the rest
+                    remaining = sum(sizes) - sized
+                    progress(rows_done, round(estimated + remaining * estimated / sized) if sized else None)
+
+    for index, dspace_csv in enumerate(dspace_csvs):
+        if results[index] is None:
+            results[index] = {"input": dspace_csv, "output": None, "input_rows": 0, "output_rows": 0,
+                              "status": "skipped", "error": None}
+            if metrics is not None:
+                metrics.count("convert_files_total", status="skipped")
+
+    if combine:
+        _combine_outputs(outputs, datacite_csv)
+    if metrics is not None:
+        elapsed = time.perf_counter() - started
+        input_rows = sum(result["input_rows"] for result in results)
+        metrics.set("convert_rows_per_second", input_rows / elapsed if elapsed else 0)
+        metrics.set("convert_workers", workers)
+        metrics.set("convert_files", len(dspace_csvs))
+
+    if any(result["status"] in ("cancelled", "skipped") for result in results):
+        raise Cancelled()
+    return results
+
+
+def format_file_summary(result):
+    """One line of a batch summary."""
+    name = os.path.basename(result["input"])
+    if result["status"] == "failed":
+        return f"{name}: failed after {result['input_rows']} rows ({result['error']})"
+    if result["status"] == "skipped":
+        return f"{name}: skipped"
+    line = f"{name}: {result['input_rows']} rows in, {result['output_rows']} rows out -> {result['output']}"
+    return line + (" (cancelled)" if result["status"] == "cancelled" else "")
@@ -0,0 +1,255 @@
+"""
+Hand finished outputs to a browser in web mode without loading them into memory.
+
+Each output is registered under a random, expiring token and served from disk
+in chunks by a small HTTP server next to the Flet app, on the interface Flet's
+web server uses (localhost unless configured otherwise):
+
+    GET /download/<token>/<filename>
+
+Only that exact path serves the file: the token is 192 random bits, and the file
+name must match too.
+
+A token stays valid for `ttl` seconds so an interrupted download can be retried.
+When it expires, is revoked, or is replaced by a newer output for the same job,
+the file is deleted. Files still registered at exit are deleted then.
+"""
+import atexit
+import ipaddress
+import os
+import secrets
+import shutil
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote, urlparse
+
+from super_duper.compression import compression_for
+
+CHUNK_SIZE = 64 * 1024
+DEFAULT_TTL = 15 * 60
+
+# Compressed outputs are sent as the files they are, not with a Content-Encoding the
+# browser would undo before saving them under their .gz/.zst name
+COMPRESSED_CONTENT_TYPES = {"gzip": "application/gzip", "zstd": "application/zstd"}
+
+
+def is_loopback(host):
+    """Whether `host` (a name or address) is this machine only."""
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return host == "localhost"
+
+
+def content_type(filename):
+    method = compression_for(filename)
+    return COMPRESSED_CONTENT_TYPES[method] if method else "text/csv; charset=utf-8"
+
+
+class Download:
+    def __init__(self, path, filename, job, expires):
+        self.path = path
+        self.filename = filename
+        self.job = job
+        self.expires = expires
+        self.active = 0  # Responses still streaming it
+
+
+class DownloadServer:
+    """Token -> file registry plus the HTTP server that streams them."""
+
+    def __init__(self, host="127.0.0.1", port=0, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.downloads = {}
+        self.server = ThreadingHTTPServer((host, port), self.make_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+        self.janitor = None
+        self.stopped = threading.Event()
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="downloads", daemon=True)
+        self.thread.start()
+        self.janitor = threading.Thread(target=self.sweep_forever, name="downloads-janitor", daemon=True)
+        self.janitor.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.server.shutdown()
+        self.server.server_close()
+        with self.lock:
+            tokens = list(self.downloads)
+        for token in tokens:
+            self.revoke(token)
+
+    def register(self, path, filename, job=None):
+        """
+        Make `path` downloadable as `filename` and return its token. The file now belongs
+        to the server and is deleted once the token is gone. A newer output for the same
+        `job` replaces the older one.
+        """
+        token = secrets.token_urlsafe(24)
+        with self.lock:
+            replaced = [t for t, download in self.downloads.items() if job is not None and download.job == job]
+            self.downloads[token] = Download(path, filename, job, time.monotonic() + self.ttl)
+        for old in replaced:
+            self.revoke(old)
+        return token
+
+    def url_path(self, token):
+        with self.lock:
+            download = self.downloads.get(token)
+        return f"/download/{token}/{quote(download.filename if download else 'download')}"
+
+    def revoke(self, token):
+        with self.lock:
+            download = self.downloads.pop(token, None)
+        if download is not None and download.active == 0:
+            remove_file(download.path)
+
+    def sweep(self):
+        """Drop every expired token and its file."""
+        now = time.monotonic()
+        with self.lock:
+            expired = [token for token, download in self.downloads.items() if download.expires <= now]
+        for token in expired:
+            self.revoke(token)
+
+    def sweep_forever(self, interval=30):
+        while not self.stopped.wait(interval):
+            self.sweep()
+
+    def open(self, token, filename):
+        """
+        (download, opened file, None) for a live `token` issued for `filename`, else
+        (None, None, HTTP status): 410 once it has expired, 404 if no such download was
+        issued. Call release() when done.
+        """
+        with self.lock:
+            download = self.downloads.get(token)
+            if download is None or not secrets.compare_digest(download.filename, filename):
+                return None, None, 404
+            if download.expires <= time.monotonic():
+                return None, None, 410
+            try:
+                file = open(download.path, "rb")
+            except OSError:
+                return None, None, 404
+            download.active += 1
+            return download, file, None
+
+    def release(self, download, file):
+        file.close()
+        with self.lock:
+            download.active -= 1
+            orphaned = download.active == 0 and all(d is not download for d in self.downloads.values())
+        if orphaned:
+            # Revoked while it was streaming
+            remove_file(download.path)
+
+    def make_handler(self):
+        downloads = self
+
+        class Handler(BaseHTTPRequestHandler):
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_HEAD(self):
+                self.do_GET(body=False)
+
+            def do_GET(self, body=True):
+                parts = urlparse(self.path).path.strip("/").split("/")
+                if len(parts) != 3 or parts[0] != "download":
+                    self.send_error(404)
+                    return
+                download, file, status = downloads.open(unquote(parts[1]), unquote(parts[2]))
+                if download is None:
+                    self.send_error(status, "This download link has expired." if status == 410 else None)
+                    return
+                try:
+                    size = os.fstat(file.fileno()).st_size
+                    self.send_response(200)
+                    self.send_header("Content-Type", content_type(download.filename))
+                    self.send_header("Content-Length", str(size))
+                    self.send_header("Content-Disposition", f"attachment; filename*=UTF-8''{quote(download.filename)}")
+                    self.send_header("Cache-Control", "no-store")
+                    self.end_headers()
+                    if body:
+                        shutil.copyfileobj(file, self.wfile, CHUNK_SIZE)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # The browser gave up; the token is still good for a retry
+                finally:
+                    downloads.release(download, file)
+
+        return Handler
+
+
+def remove_file(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def download_server():
+    """
+    The process's download server, started on first use.
+
+    SUPER_DUPER_DOWNLOAD_HOST and SUPER_DUPER_DOWNLOAD_PORT choose where it listens
+    (by default where Flet's web server does, FLET_SERVER_IP, else 127.0.0.1 so only
+    this machine, and a free port); SUPER_DUPER_DOWNLOAD_TTL sets the token lifetime in
+    seconds.
+    """
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = DownloadServer(
+                os.environ.get("SUPER_DUPER_DOWNLOAD_HOST") or os.environ.get("FLET_SERVER_IP") or "127.0.0.1",
+                int(os.environ.get("SUPER_DUPER_DOWNLOAD_PORT", "0")),
+                int(os.environ.get("SUPER_DUPER_DOWNLOAD_TTL", DEFAULT_TTL)),
+            ).start()
+            atexit.register(_server.stop)
+        return _server
+
+
+def download_url(token, page_url=None):
+    """
+    Where a browser can fetch `token`: under SUPER_DUPER_DOWNLOAD_URL when set (e.g. a
+    reverse proxy), else on the download server's port of the host the page was served from.
+    """
+    server = download_server()
+    base = os.environ.get("SUPER_DUPER_DOWNLOAD_URL")
+    if not base:
+        page = urlparse(page_url or "")
+        base = f"{page.scheme or 'http'}://{page.hostname or '127.0.0.1'}:{server.port}"
+    return base.rstrip("/") + server.url_path(token)
+
+
+def unreachable_warning(page_url=None):
+    """
+    A message saying why a browser that loaded the page from `page_url` cannot reach the
+    download links, or None: the server listens on this machine only but the page came
+    from another host, and no SUPER_DUPER_DOWNLOAD_URL points elsewhere.
+    """
+    if os.environ.get("SUPER_DUPER_DOWNLOAD_URL"):
+        return None
+    host = download_server().server.server_address[0]
+    page_host = urlparse(page_url or "").hostname
+    if not is_loopback(host) or not page_host or is_loopback(page_host):
+        return None
+    return (f"The download server only listens on {host}, so a browser that loaded this page from "
+            f"{page_host} cannot fetch the file. Set SUPER_DUPER_DOWNLOAD_HOST (e.g. 0.0.0.0) or "
+            "SUPER_DUPER_DOWNLOAD_URL and restart the app.")
@@ -0,0 +1,219 @@
+"""
+Long-running jobs on background threads, with live counts and cooperative cancellation.
+
+The core functions take an optional `cancel` object (anything with `is_set()`,
+normally a Job's `cancel_event`) and check it between rows. When it is set they
+stop taking new work, leave their outputs consistent and raise Cancelled.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+from super_duper.metrics import Metrics, write_run_metrics
+
+
+class Cancelled(Exception):
+    """Raised by a core function that stopped early because its job was cancelled."""
+
+
+def check_cancelled(cancel):
+    if cancel is not None and cancel.is_set():
+        raise Cancelled()
+
+
+class ReadProgress:
+    """
+    Estimate how many rows a CSV holds from the share of its characters read so far,
+    or for a compressed file (see compression.open_text) of its compressed bytes.
+    """
+
+    def __init__(self, path):
+        self.size = os.path.getsize(path)
+        self.chars_read = 0
+        self.raw_file = None
+
+    def lines(self, file):
+        self.raw_file = getattr(file, "raw_file", None)
+        for line in file:
+            self.chars_read += len(line)
+            yield line
+
+    def estimated_total(self, rows_read):
+        if self.raw_file is not None:
+            # Read ahead in buffers, so early estimates run a little low
+            bytes_read = self.raw_file.tell() if not self.raw_file.closed else self.size
+            return round(rows_read * self.size / bytes_read) if bytes_read else None
+        if not self.chars_read:
+            return None
+        return round(rows_read * self.size / self.chars_read)
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+class Job:
+    """
+    One run of `work(job)` with counters a UI can poll.
+
+    The work function reports through `update()` and `log()` and can hand
+    `job.metrics` to the core functions; the metrics are saved when the run ends.
+    Recent screen lines are kept in a bounded buffer so a page opened mid-run can
+    catch up; every line, including verbose-only detail, is streamed to
+    `log_file_path` when given.
+    """
+
+    def __init__(self, name, work, log_file_path=None, max_lines=500):
+        self.name = name
+        self.work = work
+        self.log_file_path = log_file_path
+        self.log_file = None
+        self.lock = threading.Lock()
+        self.cancel_event = threading.Event()
+        self.thread = None
+
+        self.state = "pending"
+        self.error = None
+        self.result = None
+        self.done = 0
+        self.total = None
+        self.succeeded = 0
+        self.failed = 0
+        self.started = None
+        self.finished = None
+
+        self.lines = deque(maxlen=max_lines)
+        self.line_count = 0
+        self.metrics = Metrics(name)
+
+    @property
+    def running(self):
+        return self.state == "running"
+
+    def start(self):
+        """Run the job on a daemon thread."""
+        self.thread = threading.Thread(target=self.run, name=f"job-{self.name}", daemon=True)
+        self.thread.start()
+        return self
+
+    def run(self):
+        """Run the job in the calling thread. Returns its result; errors are kept on the job."""
+        self.state = "running"
+        self.started = time.monotonic()
+        try:
+            self.result = self.work(self)
+            state = "finished"
+        except Cancelled:
+            self.log("Cancelled. Output written so far has been kept.")
+            state = "cancelled"
+        except Exception as e:
+            self.error = e
+            self.log(f"Error: {e}")
+            state = "failed"
+        try:
+            json_path, _ = write_run_metrics(self.metrics)
+            self.log(f"Metrics saved to {json_path}", verbose=True)
+        except OSError as e:
+            self.log(f"Could not save metrics: {e}")
+        with self.lock:
+            if self.log_file:
+                self.log_file.close()
+                self.log_file = None
+        self.finished = time.monotonic()
+        # Last, so a UI that sees the job stop also sees every line it logged
+        self.state = state
+        return self.result
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def update(self, done=None, total=None, succeeded=None, failed=None):
+        if done is not None:
+            self.done = done
+        if total is not None:
+            self.total = total
+        if succeeded is not None:
+            self.succeeded = succeeded
+        if failed is not None:
+            self.failed = failed
+
+    def log(self, text, verbose=False):
+        with self.lock:
+            if self.log_file_path:
+                if self.log_file is None:
+                    os.makedirs(os.path.dirname(self.log_file_path), exist_ok=True)
+                    self.log_file = open(self.log_file_path, "a", encoding="utf-8")
+                self.log_file.write(text.rstrip("\n") + "\n")
+            if not verbose:
+                self.lines.append(text)
+                self.line_count += 1
+
+    def lines_since(self, seen):
+        """Screen lines logged after the first `seen`, and the new count to pass next time."""
+        with self.lock:
+            if self.log_file:
+                self.log_file.flush()
+            new = min(self.line_count - seen, len(self.lines))
+            return self.line_count, list(self.lines)[len(self.lines) - new:] if new > 0 else []
+
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+    def rate(self):
+        elapsed = self.elapsed()
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def fraction(self):
+        if not self.total:
+            return None
+        return min(self.done / self.total, 1.0)
+
+    def eta(self):
+        """Seconds left at the current rate, or None when the total or rate is unknown."""
+        rate = self.rate()
+        if not self.total or not rate or not self.running:
+            return None
+        return max(self.total - self.done, 0) / rate
+
+    def describe(self):
+        parts = [f"{self.done}" + (f" of {self.total}" if self.total else "") + " rows", f"{self.rate():.1f} rows/s"]
+        eta = self.eta()
+        if eta is not None:
+            parts.append(f"ETA {format_duration(eta)}")
+        parts.append(f"{self.succeeded} succeeded, {self.failed} failed")
+        if not self.running:
+            parts.append(f"{self.state} in {format_duration(self.elapsed())}")
+        return " · ".join(parts)
+
+
+# (owner, name) -> latest Job; the owner is e.g. a web session, so users only see their own jobs
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+def get_job(name, owner=None):
+    """The latest job `owner` started under `name`, running or not."""
+    with _jobs_lock:
+        return _jobs.get((owner, name))
+
+
+def start_job(name, work, log_file_path=None, owner=None):
+    """
+    Start `work` as `owner`'s job `name` unless they already have one running under that name.
+
+    Returns (job, started): the running job is handed back rather than duplicated.
+    """
+    with _jobs_lock:
+        job = _jobs.get((owner, name))
+        if job is not None and job.running:
+            return job, False
+        job = Job(name, work, log_file_path)
+        # Mark it running before anyone else can look it up
+        job.state = "running"
+        _jobs[(owner, name)] = job
+    job.start()
+    return job, True
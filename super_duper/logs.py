@@ -0,0 +1,73 @@
+"""Where the tools keep their run logs."""
+import os
+import time
+from datetime import datetime
+
+EXPORT_LOG_PREFIX = "datacite_export_"
+
+
+def log_dir():
+    """The log directory under the current working directory, as the app has always used."""
+    return os.path.join(os.getcwd(), "log")
+
+
+def run_timestamp():
+    return datetime.now().strftime("%Y%m%d_%H%M%S")
+
+
+def export_log_path(timestamp, directory=None):
+    """
+    The `log/datacite_export_<timestamp>.csv` copy of a mint run that statistics are built from.
+
+    Two runs finishing within the same second get `_1`, `_2`, ... rather than overwriting each other.
+    """
+    directory = directory or log_dir()
+    path = os.path.join(directory, f"{EXPORT_LOG_PREFIX}{timestamp}.csv")
+    suffix = 0
+    while os.path.exists(path):
+        suffix += 1
+        path = os.path.join(directory, f"{EXPORT_LOG_PREFIX}{timestamp}_{suffix}.csv")
+    return path
+
+
+def compress_old_logs(directory=None, older_than_days=30, method="gzip", log=None):
+    """
+    Compress the `datacite_export_*.csv` logs last written more than `older_than_days`
+    days ago to `.csv.gz` (or `.csv.zst`), keeping their times so statistics still
+    date them the same. The statistics and registry read compressed logs as they are.
+    Returns the paths written.
+    """
+    from super_duper.compression import compress_file
+
+    if method not in ("gzip", "zstd"):
+        raise ValueError(f"Unknown compression {method!r}; use gzip or zstd")
+    log = log or (lambda message: None)
+    directory = directory or log_dir()
+    if not os.path.isdir(directory):
+        return []
+    cutoff = time.time() - older_than_days * 86400
+    compressed = []
+    for entry in sorted(os.scandir(directory), key=lambda entry: entry.name):
+        if not (entry.name.startswith(EXPORT_LOG_PREFIX) and entry.name.endswith(".csv")):
+            continue
+        if entry.stat().st_mtime >= cutoff:
+            continue
+        compressed.append(compress_file(entry.path, method))
+        log(f"Compressed {entry.name} to {os.path.basename(compressed[-1])}.")
+    return compressed
+
+
+def auto_compress_logs(directory=None, log=None):
+    """
+    compress_old_logs() as configured by SUPER_DUPER_COMPRESS_LOGS_AFTER_DAYS (off when
+    unset) and SUPER_DUPER_COMPRESS_LOGS_METHOD (gzip or zstd). Errors are logged, not raised.
+    """
+    log = log or (lambda message: None)
+    days = os.environ.get("SUPER_DUPER_COMPRESS_LOGS_AFTER_DAYS")
+    if not days:
+        return []
+    try:
+        return compress_old_logs(directory, float(days), os.environ.get("SUPER_DUPER_COMPRESS_LOGS_METHOD", "gzip"), log)
+    except (OSError, ValueError) as e:
+        log(f"Could not compress old logs: {e}")
+        return []
@@ -0,0 +1,245 @@
+"""Merge minted DOIs from a DataCite export CSV back into a DSpace import CSV."""
+import csv
+import os
+import sqlite3
+import tempfile
+import time
+from contextlib import nullcontext
+from pathlib import Path
+
+from super_duper.compression import compression_for, open_text
+from super_duper.jobs import Cancelled, ReadProgress
+from super_duper.records import read_export_rows
+
+# All possible `dc.identifier.uri` field names
+URI_FIELDS = ["dc.identifier.uri[]", "dc.identifier.uri", "dc.identifier.uri[en]"]
+
+# A URI cell containing one of these already carries a DOI
+EXISTING_DOI_MARKERS = ["10.25316", "https://doi.org"]
+
+# DSpace's separator for multi-valued cells
+VALUE_SEPARATOR = "||"
+
+# Export sources held in a dict before the lookup moves to an on-disk index
+MAX_IN_MEMORY_SOURCES = 500_000
+
+
+def updated_csv_path(dspace_csv):
+    """`updated_<original_filename>` next to the DSpace CSV."""
+    dspace_path = Path(dspace_csv.strip())
+    return str(dspace_path.parent / f"updated_{dspace_path.name}")
+
+
+class DoiLookup:
+    """
+    source -> DOI from a DataCite export, in a dict until it grows past
+    `max_in_memory` sources and in a temporary SQLite file after that.
+
+    As with a plain dict, a source listed twice keeps its last DOI.
+    """
+
+    def __init__(self, max_in_memory=MAX_IN_MEMORY_SOURCES):
+        self.max_in_memory = max_in_memory
+        self.dois = {}
+        self.db = None
+        self.db_path = None
+
+    @property
+    def spilled(self):
+        return self.db is not None
+
+    def add_many(self, pairs):
+        if self.db is None:
+            self.dois.update(pairs)
+            if len(self.dois) > self.max_in_memory:
+                self.spill()
+        else:
+            self.db.executemany("INSERT OR REPLACE INTO dois (source, doi) VALUES (?, ?)", pairs)
+
+    def spill(self):
+        fd, self.db_path = tempfile.mkstemp(prefix="super_duper_merge_", suffix=".sqlite")
+        os.close(fd)
+        self.db = sqlite3.connect(self.db_path)
+        # A scratch index: nothing to recover if the process dies
+        self.db.execute("PRAGMA journal_mode = OFF")
+        self.db.execute("PRAGMA synchronous = OFF")
+        self.db.execute("CREATE TABLE dois (source TEXT PRIMARY KEY, doi TEXT) WITHOUT ROWID")
+        self.db.executemany("INSERT OR REPLACE INTO dois (source, doi) VALUES (?, ?)", self.dois.items())
+        self.dois = {}
+
+    def get(self, source):
+        if self.db is None:
+            return self.dois.get(source)
+        found = self.db.execute("SELECT doi FROM dois WHERE source = ?", (source,)).fetchone()
+        return found[0] if found else None
+
+    def __len__(self):
+        if self.db is None:
+            return len(self.dois)
+        return self.db.execute("SELECT COUNT(*) FROM dois").fetchone()[0]
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+            os.unlink(self.db_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_doi_lookup(datacite_export_csv, max_in_memory=MAX_IN_MEMORY_SOURCES, batch_size=10_000):
+    """Read the export's `source` and `doi` columns into a DoiLookup."""
+    lookup = DoiLookup(max_in_memory)
+    try:
+        with open_text(datacite_export_csv, mode="r") as auto_file:
+            batch = []
+            for result in read_export_rows(auto_file):
+                batch.append((result.source, result.doi))
+                if len(batch) >= batch_size:
+                    lookup.add_many(batch)
+                    batch = []
+            lookup.add_many(batch)
+        if lookup.spilled:
+            lookup.db.commit()
+    except BaseException:
+        lookup.close()
+        raise
+    return lookup
+
+
+def merge_dois(datacite_export_csv, dspace_csv, output_csv=None, log=None, progress=None, cancel=None,
+               max_in_memory=MAX_IN_MEMORY_SOURCES, registry=None, metrics=None):
+    """
+    Append the DOI for each matching `source` to the row's `dc.identifier.uri` field.
+    Any of the CSVs may be gzip or zstd compressed (`.csv.gz`, `.csv.zst`).
+
+    DOIs come from the DataCite export CSV, or with `datacite_export_csv` None from
+    `registry` (a DoiRegistry), which is then used in place and left open.
+
+    Each URI in a `||`-separated cell is looked up on its own. Rows that already carry
+    a DOI are skipped. Rows are written as they are processed; `log(message)` receives
+    one line per row and `progress(rows_done, estimated_total)` is called after each.
+    Once `cancel` is set the remaining rows are copied through unchanged, so the output
+    is still a complete DSpace CSV, and Cancelled is raised after it is written.
+    `metrics` (a Metrics) gets the summary counters and the time spent loading the
+    export and merging.
+    Returns a dict of the summary counters and the output path.
+    """
+    log = log or (lambda message: None)
+    output_csv = output_csv or updated_csv_path(dspace_csv)
+    started = time.perf_counter()
+    partial_csv = f"{output_csv}.part"
+
+    # Initialize counters
+    dois_added = 0
+    rows_skipped = 0
+    rows_unmatched = 0
+    rows_done = 0
+    cancelled = False
+
+    if datacite_export_csv is None:
+        lookup = nullcontext(registry)
+    else:
+        lookup = load_doi_lookup(datacite_export_csv, max_in_memory)
+    with lookup as auto_prefix_data:
+        total_auto_prefix_dois = len(auto_prefix_data)
+        # Only an export's lookup can spill; the registry is a database to begin with
+        spilled = datacite_export_csv is not None and auto_prefix_data.spilled
+        loaded = time.perf_counter()
+        if datacite_export_csv is None:
+            log(f"{total_auto_prefix_dois} DOIs in the registry available for the merge.")
+        elif spilled:
+            log(f"{total_auto_prefix_dois} export DOIs indexed on disk for the merge.")
+
+        # Stream the Dspace Import CSV, updating the dc.identifier.uri fields on the way
+        read_progress = ReadProgress(dspace_csv)
+        with open_text(dspace_csv, mode="r") as dspace_file, \
+                open_text(partial_csv, mode="w", newline="", compression=compression_for(output_csv)) as output_file:
+            # Rows stay lists; only the URI and id columns are looked up, by position
+            dspace_reader = csv.reader(read_progress.lines(dspace_file) if progress else dspace_file)
+            fieldnames = next(dspace_reader, [])
+            positions = {name: i for i, name in enumerate(fieldnames)}
+            uri_fields = [(uri_field, positions[uri_field]) for uri_field in URI_FIELDS if uri_field in positions]
+            id_position = positions.get("id")
+            writer = csv.writer(output_file)
+            writer.writerow(fieldnames)  # Retain original fieldnames
+
+            try:
+                for row in dspace_reader:
+                    if not row:
+                        continue
+                    if len(row) < len(fieldnames):
+                        row += [""] * (len(fieldnames) - len(row))
+                    if cancelled or (cancel is not None and cancel.is_set()):
+                        cancelled = True
+                        writer.writerow(row)
+                        continue
+
+                    rows_done += 1
+                    if progress:
+                        progress(rows_done, read_progress.estimated_total(rows_done))
+
+                    matched = False
+                    for uri_field, position in uri_fields:
+                        if row[position].strip():  # Check if the field has data
+                            existing_uri = row[position].strip()
+
+                            # Skip if the URI already contains a DOI
+                            if any(prefix in existing_uri for prefix in EXISTING_DOI_MARKERS):
+                                log(f"Skipping row with existing DOI in field {uri_field}: {existing_uri}")
+                                rows_skipped += 1
+                                matched = True  # Mark as handled to avoid "No match" message
+                                break
+
+                            # Check each URI in the cell for a match with a source
+                            new_dois = []
+                            for uri in existing_uri.split(VALUE_SEPARATOR):
+                                doi = auto_prefix_data.get(uri.strip())
+                                if doi and doi not in new_dois:
+                                    log(f"Match found for: {uri.strip()} in field {uri_field}")
+                                    new_dois.append(doi)
+                            if new_dois:
+                                row[position] += "".join(VALUE_SEPARATOR + doi for doi in new_dois)
+                                dois_added += len(new_dois)
+                                matched = True
+                                break  # Stop further processing once a match is found
+
+                    if not matched:
+                        # Log a "No match" message only if no action was taken for any URI field
+                        log(f"No match for any field in row ID: {row[id_position] if id_position is not None else 'Unknown'}")
+                        rows_unmatched += 1
+
+                    writer.writerow(row)
+            except BaseException:
+                output_file.close()
+                os.unlink(partial_csv)
+                raise
+
+    os.replace(partial_csv, output_csv)
+
+    if metrics is not None:
+        metrics.add_time("merge_stage_seconds_total", loaded - started, stage="load_export")
+        metrics.add_time("merge_stage_seconds_total", time.perf_counter() - loaded, stage="merge")
+        metrics.count("merge_rows_total", rows_done)
+        metrics.count("merge_dois_added_total", dois_added)
+        metrics.count("merge_rows_skipped_total", rows_skipped)
+        metrics.count("merge_rows_unmatched_total", rows_unmatched)
+        metrics.set("merge_export_dois", total_auto_prefix_dois)
+        metrics.set("merge_export_spilled_to_disk", int(spilled))
+        metrics.set("merge_from_registry", int(datacite_export_csv is None))
+
+    if cancelled:
+        log(f"Stopped after {rows_done} rows; the remaining rows were copied unchanged to {output_csv}.")
+        raise Cancelled()
+
+    return {
+        "total_export_dois": total_auto_prefix_dois,
+        "dois_added": dois_added,
+        "rows_skipped": rows_skipped,
+        "rows_unmatched": rows_unmatched,
+        "output_csv": output_csv,
+    }
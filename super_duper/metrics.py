@@ -0,0 +1,216 @@
+"""
+Counters, stage timers and latency histograms for one run of a job.
+
+The core functions take an optional `metrics` (a Metrics) and record into it;
+at the end of a run `write_run_metrics` saves a JSON summary under
+`log/metrics/` and rewrites `log/metrics/super_duper_<job>.prom`, in the
+Prometheus text format, for node_exporter's textfile collector to pick up.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from super_duper.logs import log_dir, run_timestamp
+
+METRIC_PREFIX = "super_duper_"
+
+# Upper bounds in seconds, tuned for HTTP round trips
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.075, 0.1, 0.15, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 3, 5, 10, 30, 60)
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def metrics_dir():
+    return os.path.join(log_dir(), "metrics")
+
+
+def peak_rss_bytes():
+    """This process's peak resident memory so far, where the platform reports it."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def bounds(self):
+        return [str(bound) for bound in self.buckets] + ["+Inf"]
+
+    def percentile(self, p):
+        """Estimated by interpolating within the bucket the p-th observation falls in."""
+        if not self.count:
+            return None
+        rank = self.count * p / 100
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                low = self.buckets[i - 1] if i > 0 else 0.0
+                high = self.buckets[i] if i < len(self.buckets) else self.max
+                return low + (high - low) * (rank - seen) / count
+            seen += count
+        return self.max
+
+
+class Metrics:
+    """
+    Everything measured during one run of `job`. Safe to record into from worker threads.
+
+    Counters and stage times are keyed by name plus optional labels, e.g.
+    `count("responses_total", status="201")` or `with timer("stage_seconds", stage="write")`.
+    """
+
+    def __init__(self, job):
+        self.job = job
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.finished = None
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def add_time(self, name, seconds, **labels):
+        self.count(name, seconds, **labels)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start, **labels)
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(buckets)
+            histogram.observe(value)
+
+    def set(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def finish(self):
+        """Stamp the end of the run and its peak memory; called by write_run_metrics."""
+        self.finished = time.time()
+        peak = peak_rss_bytes()
+        if peak is not None:
+            self.set("peak_rss_bytes", peak)
+
+    def summary(self):
+        """The run as a JSON-friendly dict, with histogram percentiles worked out."""
+        with self.lock:
+            duration = (self.finished or time.time()) - self.started
+            counters = {}
+            for (name, labels), value in sorted(self.counters.items()):
+                label = ",".join(f"{k}={v}" for k, v in labels)
+                counters[f"{name}{{{label}}}" if label else name] = round(value, 6) if isinstance(value, float) else value
+            histograms = {
+                name: {
+                    "count": histogram.count,
+                    "sum": round(histogram.sum, 6),
+                    "max": round(histogram.max, 6),
+                    **{f"p{p}": round(histogram.percentile(p), 6) if histogram.count else None for p in PERCENTILES},
+                }
+                for name, histogram in sorted(self.histograms.items())
+            }
+            return {
+                "job": self.job,
+                "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+                "duration_seconds": round(duration, 3),
+                "counters": counters,
+                "histograms": histograms,
+                "gauges": dict(self.gauges),
+            }
+
+    def prometheus(self):
+        """The run in the Prometheus text exposition format, every series labelled with its command."""
+        def labels(pairs):
+            # Not "job": Prometheus sets that label itself for every scrape
+            pairs = [("command", self.job)] + list(pairs)
+            escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+            return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+        lines = []
+        with self.lock:
+            by_name = {}
+            for (name, label_pairs), value in sorted(self.counters.items()):
+                by_name.setdefault(name, []).append((label_pairs, value))
+            for name, series in by_name.items():
+                full = METRIC_PREFIX + name
+                lines.append(f"# TYPE {full} counter")
+                lines.extend(f"{full}{labels(pairs)} {value}" for pairs, value in series)
+
+            for name, histogram in sorted(self.histograms.items()):
+                full = METRIC_PREFIX + name
+                lines.append(f"# TYPE {full} histogram")
+                cumulative = 0
+                for bound, count in zip(histogram.bounds(), histogram.counts):
+                    cumulative += count
+                    lines.append(f"{full}_bucket{labels([('le', bound)])} {cumulative}")
+                lines.append(f"{full}_sum{labels([])} {histogram.sum}")
+                lines.append(f"{full}_count{labels([])} {histogram.count}")
+
+            gauges = dict(self.gauges)
+            gauges["last_run_timestamp_seconds"] = self.finished or time.time()
+            gauges["last_run_duration_seconds"] = (self.finished or time.time()) - self.started
+            for name, value in sorted(gauges.items()):
+                full = METRIC_PREFIX + name
+                lines.append(f"# TYPE {full} gauge")
+                lines.append(f"{full}{labels([])} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def write_run_metrics(metrics, directory=None):
+    """
+    Save the run's JSON summary as `<job>_<timestamp>.json` and replace the job's
+    Prometheus textfile. Returns (json_path, prom_path).
+    """
+    directory = directory or metrics_dir()
+    os.makedirs(directory, exist_ok=True)
+    if metrics.finished is None:
+        metrics.finish()
+
+    stem = os.path.join(directory, f"{metrics.job}_{run_timestamp()}")
+    json_path = f"{stem}.json"
+    n = 1
+    while os.path.exists(json_path):
+        json_path = f"{stem}_{n}.json"
+        n += 1
+    with open(json_path, "w", encoding="utf-8") as file:
+        json.dump(metrics.summary(), file, indent=2)
+
+    # Written aside and renamed, so the collector never reads half a file
+    prom_path = os.path.join(directory, f"{METRIC_PREFIX}{metrics.job}.prom")
+    with open(f"{prom_path}.part", "w", encoding="utf-8") as file:
+        file.write(metrics.prometheus())
+    os.replace(f"{prom_path}.part", prom_path)
+    return json_path, prom_path
@@ -0,0 +1,836 @@
+"""
+Bulk DOI minting against the DataCite REST API.
+
+`requests` is only imported once a session is opened, so importing this module
+(e.g. to read a journal) stays cheap.
+"""
+import csv
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from super_duper.compression import compression_for, has_extension, open_binary, open_text, strip_compression
+from super_duper.jobs import Cancelled
+from super_duper.logs import auto_compress_logs, export_log_path, log_dir, run_timestamp
+from super_duper.records import DATACITE_EXPORT_FIELDS, DoiRecord, MintResult, read_import_records, write_export_rows
+
+# Import rows checked against the DOI registry per query
+REGISTRY_CHECK_CHUNK = 500
+
+
+def load_credentials(path):
+    """Read a credentials JSON file shaped like templatecreds.json.sample."""
+    with open(path, "r") as file:
+        credentials = json.load(file)
+    missing = [key for key in ["url", "doiPrefix", "username", "password"] if not credentials.get(key)]
+    if missing:
+        raise ValueError(f"Credentials file is missing: {', '.join(missing)}")
+    return credentials
+
+
+def read_datacite_import(datacite_csv):
+    """Yield a DoiRecord per row of a Datacite import CSV (as written by page 2)."""
+    with open_text(datacite_csv, "r", newline="") as file:
+        yield from read_import_records(file)
+
+
+def metadata_attributes(doi):
+    """The DataCite attributes describing a DOI record, as sent both on creation and on update."""
+    return {
+        "creators": [creator.datacite() for creator in doi.creators],
+        "titles": [{"title": doi.title}],
+        "publisher": doi.publisher,
+        "publicationYear": doi.year,
+        "descriptions": [{
+            "description": doi.description,
+            "descriptionType": "Abstract"
+        }],
+        "types": {
+            "resourceTypeGeneral": "Text",
+            "resourceType": doi.type
+        },
+        "schemaVersion": "http://datacite.org/schema/kernel-4",
+        "url": doi.source
+    }
+
+
+def build_doi_payload(doi, doi_prefix):
+    """Wrap a DOI record in the JSON:API body DataCite expects for a new, published DOI."""
+    return {
+        "data": {
+            "type": "dois",
+            "attributes": {
+                "event": "publish",
+                "prefix": doi_prefix,
+                **metadata_attributes(doi),
+            }
+        }
+    }
+
+
+# Attributes that say how to send a record rather than what it describes
+NON_CONTENT_ATTRIBUTES = ("event", "prefix", "doi")
+
+
+def build_update_payload(doi, doi_id):
+    """
+    The JSON:API body for a PUT that replaces the metadata of the existing DOI `doi_id`,
+    from the record's fields or its ready-made creation `body`.
+    """
+    if doi.body:
+        attributes = json.loads(doi.body)["data"]["attributes"]
+        attributes = {k: v for k, v in attributes.items() if k not in NON_CONTENT_ATTRIBUTES}
+    else:
+        attributes = metadata_attributes(doi)
+    return {
+        "data": {
+            "id": doi_id,
+            "type": "dois",
+            "attributes": attributes,
+        }
+    }
+
+
+def content_hash(doi):
+    """
+    A hash of a record's metadata, the same however it is sent: from its ready-made
+    `body` (a payload batch line) or from its fields.
+    """
+    attributes = build_update_payload(doi, None)["data"]["attributes"]
+    canonical = json.dumps(attributes, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def serialize_payload(payload):
+    """The request body for a payload: compact JSON, UTF-8."""
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def is_payload_batch(path):
+    return has_extension(path, ".jsonl")
+
+
+def build_payload_batch(datacite_csv, batch_path, doi_prefix, progress=None, cancel=None):
+    """
+    Write the request body for every row of a Datacite import CSV to a JSONL batch.
+
+    Line N is the exact body that will be sent for import row N, so a batch can be
+    inspected, sliced and sent later without rebuilding anything. Once `cancel` is
+    set the partial batch is discarded and Cancelled is raised.
+    Returns the number of rows written.
+    """
+    partial = f"{batch_path}.part"
+    count = 0
+    try:
+        with open_binary(partial, "wb", compression_for(batch_path)) as batch:
+            for doi in read_datacite_import(datacite_csv):
+                if cancel is not None and cancel.is_set():
+                    raise Cancelled()
+                batch.write(serialize_payload(build_doi_payload(doi, doi_prefix)) + b"\n")
+                count += 1
+                if progress:
+                    progress(count, None)
+    except BaseException:
+        os.unlink(partial)
+        raise
+    os.replace(partial, batch_path)
+    return count
+
+
+def read_payload_batch(batch_path):
+    """Yield a DoiRecord per line of a payload batch, carrying its ready-made `body`."""
+    with open_binary(batch_path, "rb") as batch:
+        for row_number, line in enumerate(batch, start=1):
+            body = line.rstrip(b"\r\n")
+            if not body:
+                continue
+            attributes = json.loads(body)["data"]["attributes"]
+            titles = attributes.get("titles") or [{}]
+            yield DoiRecord(row_number, body, title=titles[0].get("title", ""), source=attributes.get("url", ""))
+
+
+def parse_rows(spec):
+    """'1-100,250' -> {1, ..., 100, 250}."""
+    rows = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        try:
+            rows.update(range(int(first), int(last or first) + 1))
+        except ValueError:
+            raise ValueError(f"Invalid row range {part!r}; use e.g. 1-100,250") from None
+    return rows
+
+
+class RateLimiter:
+    """Hand out request slots so that no more than `rate` requests start per second."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+
+    def wait(self):
+        with self.lock:
+            slot = max(self.next_slot, time.monotonic())
+            self.next_slot = slot + self.interval
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def pause(self, seconds):
+        """Start nothing else for `seconds`, e.g. when the server has asked us to back off."""
+        with self.lock:
+            self.next_slot = max(self.next_slot, time.monotonic() + seconds)
+
+
+def make_datacite_session(pool_size):
+    """One keep-alive session shared by every worker, with a connection pool to match."""
+    import requests  # Only minting needs it; keep it out of every other job's startup
+    import requests.adapters
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Content-Type": "application/vnd.api+json"})
+    return session
+
+
+class RetryPolicy:
+    """
+    How long to wait on DataCite and when to try a row again.
+
+    Throttling (429), gateway and server errors (408, 500, 502, 503, 504), timeouts and
+    dropped connections are retryable; anything else (400, 401, 403, 404, 422...) is
+    permanent. A new DOI's POST that times out or drops after it was sent is
+    ambiguous instead: DataCite picks the suffix, so the first request may already
+    have minted one and a resend would mint a second. A row is tried at most
+    `max_attempts` times, waiting as long as the server's Retry-After asks or else an
+    exponential backoff with full jitter.
+    """
+
+    RETRYABLE_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+    def __init__(self, connect_timeout=10, read_timeout=60, max_attempts=5, backoff=1.0, max_backoff=60,
+                 max_retry_after=600):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_attempts = max(1, int(max_attempts))
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_retry_after
+
+    @property
+    def timeout(self):
+        return (self.connect_timeout, self.read_timeout)
+
+    def delay(self, attempt, retry_after=None):
+        """Seconds to wait before attempt number `attempt + 1`."""
+        if retry_after is not None:
+            return min(retry_after, self.max_retry_after)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+
+
+def parse_retry_after(value):
+    """Seconds from a Retry-After header, given either as seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+def error_message_for(response):
+    """DataCite's `errors[0].title`, or the start of whatever else the server sent back."""
+    try:
+        errors = response.json().get("errors") or [{}]
+        return errors[0].get("title") or "Unknown error"
+    except (ValueError, AttributeError, IndexError):
+        text = " ".join(response.text.split())[:200]
+        return f"HTTP {response.status_code} {response.reason}" + (f": {text}" if text else "")
+
+
+def may_have_been_sent(error):
+    """
+    Whether a request that failed with `error` (a requests exception) may have reached
+    DataCite. Only a connection that was never made (refused, unresolvable, connect
+    timeout) is known not to have.
+    """
+    import requests
+    from urllib3.exceptions import NewConnectionError
+
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return False
+    if isinstance(error, requests.exceptions.ConnectionError) and not isinstance(error, requests.exceptions.SSLError):
+        reason = getattr(error.args[0], "reason", None) if error.args else None
+        return not isinstance(reason, NewConnectionError)
+    return True
+
+
+def mint_result(doi, response=None, error=None, error_type="permanent"):
+    """
+    The MintResult (export CSV row) for one attempt at one DOI record; `error_type`
+    (retryable, ambiguous or permanent) classifies an `error` without a response.
+    """
+    result = MintResult(doi.title, doi.source, status=response.status_code if response is not None else None)
+    if error is not None:
+        result.error_message = error
+        result.error_type = error_type
+    elif response.status_code in (200, 201):
+        # 201 for a new DOI, 200 for an update
+        try:
+            result.doi = f"https://doi.org/{response.json()['data']['id']}"
+        except (ValueError, KeyError, TypeError):
+            # It was created, so sending it again would only make a duplicate
+            result.error_message = "DOI created, but the response could not be read: " + response.text[:200]
+            result.error_type = "permanent"
+    else:
+        result.error_message = error_message_for(response)
+        result.error_type = "retryable" if response.status_code in RetryPolicy.RETRYABLE_STATUSES else "permanent"
+    return result
+
+
+def mint_dois(dois, url, doi_prefix, auth, concurrency=4, rate_limit=10, on_result=None, cancel=None,
+              retry_policy=None, on_retry=None, max_deferred=1000, metrics=None):
+    """
+    Submit DOI records to DataCite from a bounded worker pool.
+
+    `dois` are DoiRecords. Yields (body, response, result) tuples as rows finish, where
+    `body` is the request body as sent (a record's own `body` if it has one, as from a
+    payload batch, otherwise built here once), `result` is its MintResult and
+    `response` is None if no response came back.  At most `concurrency` requests are in flight and at most `rate_limit`
+    start per second.
+
+    A retryable failure is put on a deferred queue with its backoff time rather than
+    waited on, so healthy rows keep going meanwhile; `on_retry(doi, result, attempt,
+    delay)` is called when that happens. A 429 with Retry-After also holds back every
+    other request for that long. Once `max_deferred` rows are waiting, no new rows are
+    started until some of them have been retried.
+
+    `on_result(doi, result)` is called once per row with its final result, before it
+    is yielded. Once `cancel` is set no new rows or retries are sent; requests
+    already in flight are finished, rows waiting for a retry are yielded with their
+    last failure, then Cancelled is raised.
+
+    `metrics` (a Metrics) gets a histogram of request latencies, responses by status,
+    retries, and the time spent building payloads, waiting on the rate limit and on
+    the network (summed over workers).
+    """
+    concurrency = max(1, int(concurrency))
+    retry_policy = retry_policy or RetryPolicy()
+    limiter = RateLimiter(rate_limit)
+    session = make_datacite_session(concurrency)
+    import requests  # Already loaded by the session
+
+    transient = (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                 requests.exceptions.ChunkedEncodingError)
+
+    def timed(stage, started):
+        seconds = time.perf_counter() - started
+        if metrics is not None:
+            metrics.add_time("mint_stage_seconds_total", seconds, stage=stage)
+        return seconds
+
+    def submit(doi, data):
+        started = time.perf_counter()
+        limiter.wait()
+        timed("throttle", started)
+        started = time.perf_counter()
+        try:
+            # Update records carry their own method and DOI URL
+            response = session.request(doi.method, doi.endpoint or url, data=data, auth=auth,
+                                       timeout=retry_policy.timeout)
+        except requests.exceptions.RequestException as e:
+            timed("network", started)
+            if metrics is not None:
+                metrics.count("datacite_responses_total", status="none")
+            if not isinstance(e, transient):
+                error_type = "permanent"
+            elif doi.method == "POST" and may_have_been_sent(e):
+                # Not idempotent: a DOI may already exist for it
+                error_type = "ambiguous"
+            else:
+                error_type = "retryable"
+            return None, mint_result(doi, error=f"{type(e).__name__}: {e}", error_type=error_type), None
+        latency = timed("network", started)
+        if metrics is not None:
+            metrics.observe("datacite_request_seconds", latency)
+            metrics.count("datacite_responses_total", status=str(response.status_code))
+        retry_after = parse_retry_after(response.headers.get("Retry-After")) if response.status_code not in (200, 201) else None
+        return response, mint_result(doi, response), retry_after
+
+    def finish(doi, data, response, result):
+        if on_result:
+            on_result(doi, result)
+        return data, response, result
+
+    window = concurrency * 2
+    in_flight = {}  # future -> (doi, payload, attempt)
+    deferred = []   # heap of (due, sequence, doi, payload, attempt, last (response, result))
+    sequence = itertools.count()
+    rows = iter(dois)
+    exhausted = False
+    cancelled = False
+
+    def is_cancelled():
+        return cancelled or (cancel is not None and cancel.is_set())
+
+    with session, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while True:
+            cancelled = is_cancelled()
+
+            # Retries that are due go first, then new rows while there is room
+            while not cancelled and deferred and deferred[0][0] <= time.monotonic() and len(in_flight) < window:
+                _, _, doi, data, attempt, _ = heapq.heappop(deferred)
+                in_flight[pool.submit(submit, doi, data)] = (doi, data, attempt + 1)
+            while not (cancelled or exhausted) and len(in_flight) < window and len(deferred) < max_deferred:
+                doi = next(rows, None)
+                if doi is None:
+                    exhausted = True
+                    break
+                started = time.perf_counter()
+                data = doi.body or serialize_payload(build_doi_payload(doi, doi_prefix))
+                timed("build", started)
+                in_flight[pool.submit(submit, doi, data)] = (doi, data, 1)
+
+            next_due = max(0.0, deferred[0][0] - time.monotonic()) if deferred and not cancelled else None
+            if not in_flight:
+                if next_due is None:
+                    break
+                # Nothing in flight: just wait for the next retry to come due (or a cancel)
+                if cancel is not None:
+                    cancel.wait(next_due)
+                else:
+                    time.sleep(next_due)
+                continue
+
+            done, _ = wait(in_flight, timeout=next_due if next_due is not None else 1.0, return_when=FIRST_COMPLETED)
+            for future in done:
+                doi, data, attempt = in_flight.pop(future)
+                response, result, retry_after = future.result()
+                if result.error_type == "retryable" and attempt < retry_policy.max_attempts and not cancelled:
+                    delay = retry_policy.delay(attempt, retry_after)
+                    if retry_after is not None:
+                        limiter.pause(delay)
+                    heapq.heappush(deferred, (time.monotonic() + delay, next(sequence), doi, data, attempt,
+                                              (response, result)))
+                    if metrics is not None:
+                        metrics.count("datacite_retries_total")
+                    if on_retry:
+                        on_retry(doi, result, attempt, delay)
+                    continue
+                yield finish(doi, data, response, result)
+
+        # Only left over after a cancel: they keep their last failure so a resume sends them again
+        for _, _, doi, data, _, (response, result) in sorted(deferred):
+            yield finish(doi, data, response, result)
+    if cancelled:
+        raise Cancelled()
+
+
+def journal_path_for(datacite_csv, directory):
+    """Each import CSV gets its own journal, so a rerun of the same file can pick up where it stopped."""
+    stem = os.path.splitext(strip_compression(os.path.basename(datacite_csv)))[0]
+    digest = hashlib.sha1(os.path.abspath(datacite_csv).encode("utf-8")).hexdigest()[:8]
+    return os.path.join(directory, f"mint_journal_{stem}_{digest}.jsonl")
+
+
+class MintJournal:
+    """Append-only JSON-lines record of every DataCite response, fsync'd as each one arrives."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, "a+b")
+        # A crash can leave a torn last line behind; start our entries on a fresh one.
+        if self.file.tell() > 0:
+            self.file.seek(-1, os.SEEK_END)
+            if self.file.read(1) != b"\n":
+                self.file.write(b"\n")
+                self._sync()
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def record(self, row, result):
+        line = json.dumps({"row": row, **result.as_dict()}, ensure_ascii=False) + "\n"
+        with self.lock:
+            self.file.write(line.encode("utf-8"))
+            self._sync()
+
+    def checkpoint(self, log_file_path):
+        """Mark every entry so far as copied into the statistics log."""
+        line = json.dumps({"checkpoint": os.path.basename(log_file_path)}) + "\n"
+        with self.lock:
+            self.file.write(line.encode("utf-8"))
+            self._sync()
+
+    def close(self):
+        self.file.close()
+
+
+def read_journal(path, unlogged_only=False):
+    """
+    Latest journal entry (a MintResult) for every input row, keyed by row number. Torn or
+    garbled lines are ignored.
+
+    With `unlogged_only`, only rows recorded since the last checkpoint are returned, i.e. the
+    ones that have not yet been copied into a `log/datacite_export_*.csv` file.
+    """
+    entries = {}
+    if not os.path.exists(path):
+        return entries
+    with open(path, "r", encoding="utf-8", errors="replace") as file:
+        for line in file:
+            try:
+                entry = json.loads(line)
+                if "checkpoint" in entry:
+                    if unlogged_only:
+                        entries.clear()
+                    continue
+                entries[int(entry["row"])] = MintResult.from_dict(entry)
+            except (ValueError, KeyError, TypeError):
+                continue
+    return entries
+
+
+def failed_rows(entries):
+    """
+    Row numbers whose latest journal entry is not a 201, leaving out ambiguous ones
+    (which may have a DOI already).
+    """
+    return {row for row, entry in entries.items() if entry.status != 201 and entry.error_type != "ambiguous"}
+
+
+def ambiguous_sources(entries):
+    """Sources whose latest request may or may not have minted a DOI, according to the journal."""
+    return {entry.source for entry in entries.values() if entry.error_type == "ambiguous" and entry.source}
+
+
+def minted_sources(entries):
+    """Sources that already have a live DOI according to the journal."""
+    return {entry.source for entry in entries.values() if entry.status == 201 and entry.source}
+
+
+def write_results_from_journal(entries, paths):
+    """Rebuild the export CSV(s) from the journal in input order. Returns (total, successful)."""
+    rows = [entries[row] for row in sorted(entries)]
+    for path in paths:
+        with open_text(path, "w", newline="") as output_file:
+            write_export_rows(output_file, rows)
+    return len(rows), sum(1 for row in rows if row.status == 201)
+
+
+def run_mint(datacite_csv, output_path, credentials, concurrency=4, rate_limit=10, resume=False,
+             log_copy=True, log=None, on_response=None, progress=None, cancel=None, retry_policy=None,
+             only_rows=None, registry=None, journal_path=None, metrics=None):
+    """
+    Mint DOIs for every row of a Datacite import CSV, or of a payload batch built from
+    one (a `.jsonl` path), and write the export CSV. Inputs and output may be gzip or
+    zstd compressed (`.csv.gz`, `.jsonl.zst`, ...). With `only_rows` (a set of row
+    numbers) just those rows are sent.
+
+    With a `registry` (a DoiRegistry), it is first backfilled from any new mint logs,
+    rows whose source it already has a DOI for are skipped (checked in bulk, before
+    anything is sent), and every response is recorded in it.
+
+    Every row's final response is journaled as it arrives (in `journal_path`, by default
+    one per import file in the log directory); with `resume`, rows the
+    journal already has a 201 for are skipped, so rows that ran out of retries are
+    sent again. Rows whose last POST was ambiguous (in the journal, or the registry)
+    are held back rather than risk a second DOI, unless `only_rows` names them. Transient failures are retried per `retry_policy` (a RetryPolicy). The output is rebuilt from the journal, and with
+    `log_copy` the rows not yet in any `log/datacite_export_*.csv` are copied there.
+    `on_response(body, response, result)` is called for each submitted row as it
+    finishes (`response` is None when none came back), `progress(submitted, to_submit)`
+    after it, and `log(message)` for progress messages and retries.
+
+    If `cancel` is set, rows in flight are finished and journaled, the outputs are
+    written from the journal as usual (so the run can be resumed later) and
+    Cancelled is raised.
+
+    `metrics` gets what mint_dois records, plus the time spent journaling and row counts.
+
+    Returns a dict with submitted, total, successful, retryable, already_registered and
+    ambiguous counts and the paths written.
+    """
+    log = log or (lambda message: None)
+    retry_policy = retry_policy or RetryPolicy()
+    directory = log_dir()
+    os.makedirs(directory, exist_ok=True)
+    timestamp = run_timestamp()
+    log_file_path = export_log_path(timestamp, directory)
+
+    journal_path = journal_path or journal_path_for(datacite_csv, directory)
+    if registry is not None:
+        files, rows = registry.backfill(directory, log=log)
+        if files:
+            log(f"DOI registry updated from {files} mint logs ({rows} rows).")
+        if os.path.exists(journal_path):
+            # Responses of an earlier run of this file that never reached a log (e.g. it crashed)
+            registry.record_many(read_journal(journal_path).values())
+            registry.commit()
+    unsettled = set()
+    if resume:
+        entries = read_journal(journal_path)
+        already_minted = minted_sources(entries)
+        log(f"Resuming from {journal_path}: {len(already_minted)} rows already have DOIs and will be skipped.")
+        if only_rows is None:
+            unsettled = ambiguous_sources(entries)
+    else:
+        already_minted = set()
+        if os.path.exists(journal_path):
+            # Keep the old record of minted DOIs, but start this run with a clean journal
+            os.replace(journal_path, f"{journal_path}.{timestamp}.bak")
+
+    read_records = read_payload_batch if is_payload_batch(datacite_csv) else read_datacite_import
+
+    registered = set()
+    held_back = set()
+
+    def pending_dois():
+        candidates = (
+            doi for doi in read_records(datacite_csv)
+            if not (doi.source and doi.source in already_minted)
+            and (only_rows is None or doi.row in only_rows)
+        )
+        # Checked against the registry a chunk of rows at a time
+        while True:
+            chunk = list(itertools.islice(candidates, REGISTRY_CHECK_CHUNK))
+            if not chunk:
+                return
+            minted = registry.minted(doi.source for doi in chunk) if registry is not None else {}
+            ambiguous = unsettled
+            if registry is not None and only_rows is None:
+                ambiguous = unsettled | registry.ambiguous(doi.source for doi in chunk)
+            for doi in chunk:
+                if doi.source in minted:
+                    registered.add(doi.row)
+                elif doi.source in ambiguous:
+                    held_back.add(doi.row)
+                else:
+                    yield doi
+
+    to_submit = sum(1 for _ in pending_dois()) if progress else None
+    submit_count = 0
+    cancelled = False
+    journal = MintJournal(journal_path)
+
+    def record(doi, result):
+        started = time.perf_counter()
+        journal.record(doi.row, result)
+        if registry is not None:
+            registry.record(result, content_hash=content_hash(doi) if result.status == 201 else None)
+        if metrics is not None:
+            metrics.add_time("mint_stage_seconds_total", time.perf_counter() - started, stage="journal")
+
+    try:
+        minted = mint_dois(
+            pending_dois(),
+            credentials["url"],
+            credentials["doiPrefix"],
+            (credentials["username"], credentials["password"]),
+            concurrency=concurrency,
+            rate_limit=rate_limit,
+            on_result=record,
+            cancel=cancel,
+            retry_policy=retry_policy,
+            on_retry=lambda doi, result, attempt, delay: log(
+                f"Row {doi.row}: {result.status or 'no response'} {result.error_message}; "
+                f"retrying in {delay:.1f}s (attempt {attempt + 1} of {retry_policy.max_attempts})"
+            ),
+            metrics=metrics,
+        )
+        for data, response, result in minted:
+            submit_count += 1
+            if on_response:
+                on_response(data, response, result)
+            if progress:
+                progress(submit_count, to_submit)
+    except Cancelled:
+        cancelled = True
+    finally:
+        journal.close()
+        if registry is not None:
+            registry.commit()
+
+    # The journal is the record of truth; outputs are rebuilt from it, including rows minted by earlier runs
+    entries = read_journal(journal_path)
+    total_count, success_count = write_results_from_journal(entries, [output_path])
+    retryable_count = sum(1 for entry in entries.values() if entry.error_type == "retryable")
+    if metrics is not None:
+        metrics.count("mint_rows_submitted_total", submit_count)
+        metrics.set("mint_rows_total", total_count)
+        metrics.set("mint_rows_successful", success_count)
+        metrics.set("mint_rows_retryable", retryable_count)
+        metrics.set("mint_rows_already_registered", len(registered))
+    unanswered = held_back | {row for row, entry in entries.items() if entry.error_type == "ambiguous"}
+    if metrics is not None:
+        metrics.set("mint_rows_ambiguous", len(unanswered))
+    if registered:
+        log(f"{len(registered)} rows already had DOIs in the registry and were not sent.")
+    if unanswered:
+        log(f"{len(unanswered)} rows were sent without an answer and may already have DOIs, "
+            "so they are not sent again automatically. Check them at DataCite (e.g. with reconcile) "
+            "and send the ones still missing with only those rows selected.")
+    if retryable_count:
+        log(f"{retryable_count} rows failed with errors that may clear up; resume this file to send them again.")
+    if log_copy:
+        # The log copy only gets rows no earlier log file has, so statistics never count a DOI twice
+        write_results_from_journal(read_journal(journal_path, unlogged_only=True), [log_file_path])
+        journal = MintJournal(journal_path)
+        journal.checkpoint(log_file_path)
+        journal.close()
+        auto_compress_logs(directory, log=log)
+
+    if cancelled:
+        log(f"Stopped after {submit_count} rows; resume this file to send the rest.")
+        raise Cancelled()
+
+    return {
+        "submitted": submit_count,
+        "total": total_count,
+        "successful": success_count,
+        "retryable": retryable_count,
+        "already_registered": len(registered),
+        "ambiguous": len(unanswered),
+        "output_path": output_path,
+        "journal_path": journal_path,
+        "log_file_path": log_file_path if log_copy else None,
+    }
+
+
+def run_update(datacite_csv, output_path, credentials, registry, concurrency=4, rate_limit=10, force=False,
+               log=None, on_response=None, progress=None, cancel=None, retry_policy=None, metrics=None):
+    """
+    Push changed metadata to existing DOIs: a PUT per row of an import CSV (or payload
+    batch) whose source has a DOI in `registry` (a DoiRegistry) and whose metadata
+    hash differs from the one last sent for it. With `force`, every such row is sent.
+
+    Rows without a DOI in the registry are left for a mint run. The hash is stored
+    only once DataCite accepts the update, so rerunning after failures or a cancel
+    sends exactly what is still out of date. Results are written to `output_path` in
+    the DATACITE_EXPORT_FIELDS layout as they arrive (200 for an update).
+    `log`, `on_response`, `progress`, `cancel`, `retry_policy` and `metrics` are as
+    for run_mint; Cancelled is raised after the output is written.
+
+    Returns a dict with checked, unchanged, unregistered, sent and updated counts and
+    the output path.
+    """
+    log = log or (lambda message: None)
+    retry_policy = retry_policy or RetryPolicy()
+    directory = log_dir()
+    os.makedirs(directory, exist_ok=True)
+    files, rows = registry.backfill(directory, log=log)
+    if files:
+        log(f"DOI registry updated from {files} mint logs ({rows} rows).")
+
+    read_records = read_payload_batch if is_payload_batch(datacite_csv) else read_datacite_import
+    endpoint = credentials["url"].rstrip("/")
+    counts = {"checked": 0, "unchanged": 0, "unregistered": 0}
+
+    def changed_dois():
+        records = read_records(datacite_csv)
+        while True:
+            chunk = list(itertools.islice(records, REGISTRY_CHECK_CHUNK))
+            if not chunk:
+                return
+            known = registry.minted_hashes(doi.source for doi in chunk)
+            for doi in chunk:
+                counts["checked"] += 1
+                if doi.source not in known:
+                    counts["unregistered"] += 1
+                    continue
+                doi_url, sent_hash = known[doi.source]
+                doi.content_hash = content_hash(doi)
+                if doi.content_hash == sent_hash and not force:
+                    counts["unchanged"] += 1
+                    continue
+                doi_id = doi_url.split("doi.org/", 1)[-1]
+                doi.body = serialize_payload(build_update_payload(doi, doi_id))
+                doi.method = "PUT"
+                doi.endpoint = f"{endpoint}/{doi_id}"
+                yield doi
+
+    to_send = None
+    if progress:
+        to_send = sum(1 for _ in changed_dois())
+        counts = {"checked": 0, "unchanged": 0, "unregistered": 0}
+    sent = updated = 0
+    cancelled = False
+
+    def record(doi, result):
+        if result.status == 200:
+            registry.set_content_hash(doi.source, doi.content_hash)
+
+    partial = f"{output_path}.part"
+    with open_text(partial, "w", newline="", compression=compression_for(output_path)) as output_file:
+        writer = csv.writer(output_file)
+        writer.writerow(DATACITE_EXPORT_FIELDS)
+        try:
+            results = mint_dois(
+                changed_dois(),
+                credentials["url"],
+                credentials["doiPrefix"],
+                (credentials["username"], credentials["password"]),
+                concurrency=concurrency,
+                rate_limit=rate_limit,
+                on_result=record,
+                cancel=cancel,
+                retry_policy=retry_policy,
+                on_retry=lambda doi, result, attempt, delay: log(
+                    f"Row {doi.row}: {result.status or 'no response'} {result.error_message}; "
+                    f"retrying in {delay:.1f}s (attempt {attempt + 1} of {retry_policy.max_attempts})"
+                ),
+                metrics=metrics,
+            )
+            for data, response, result in results:
+                sent += 1
+                updated += result.status == 200
+                writer.writerow(result.csv_row())
+                if on_response:
+                    on_response(data, response, result)
+                if progress:
+                    progress(sent, to_send)
+        except Cancelled:
+            cancelled = True
+        except BaseException:
+            output_file.close()
+            os.unlink(partial)
+            raise
+        finally:
+            registry.commit()
+    os.replace(partial, output_path)
+
+    if metrics is not None:
+        metrics.count("update_rows_total", counts["unchanged"], result="unchanged")
+        metrics.count("update_rows_total", counts["unregistered"], result="unregistered")
+        metrics.count("update_rows_total", updated, result="updated")
+        metrics.count("update_rows_total", sent - updated, result="failed")
+    if counts["unregistered"]:
+        log(f"{counts['unregistered']} rows have no DOI in the registry yet; mint them first.")
+    if cancelled:
+        log(f"Stopped after {sent} updates; run again to send the rest.")
+        raise Cancelled()
+
+    return {**counts, "sent": sent, "updated": updated, "output_path": output_path}
+
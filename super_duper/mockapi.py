@@ -0,0 +1,370 @@
+"""
+A local stand-in for the DataCite `GET /dois` listing and the `POST /dois` and
+`PUT /dois/<doi>` endpoints, for offline load and failure testing.
+
+    python -m super_duper mock-datacite --port 8765 --latency lognormal:80,0.6 --error-rate 0.02
+
+then point the credentials `url` at http://127.0.0.1:8765/dois. Successful
+requests get a 201 with the same JSON:API shape as DataCite (`data.id` is the new
+DOI), updates of a DOI it minted get a 200, and failures carry `errors[].title`.
+The listing pages through the DOIs it holds with DataCite's cursor links and
+`created` year facets; `add_doi` preloads DOIs to list. Latency, 5xx errors, 422 rejections,
+429 rate limiting and 401 auth failures are all configurable and seeded, so a
+run can be repeated.
+"""
+import base64
+import bisect
+import json
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlencode, urlparse
+
+# DataCite's auto-generated suffixes: two groups of four base32 characters
+SUFFIX_ALPHABET = "0123456789abcdefghjkmnpqrstvwxyz"
+
+GATEWAY_ERROR_PAGE = "<html><head><title>{code} {reason}</title></head><body><h1>{code} {reason}</h1></body></html>"
+
+
+def errors(status, title, source=None):
+    """A JSON:API error document, as DataCite sends."""
+    error = {"status": str(status), "title": title}
+    if source:
+        error["source"] = source
+    return {"errors": [error]}
+
+
+def parse_latency(spec):
+    """
+    A function returning one response delay in seconds, from a spec in milliseconds:
+
+    'fixed:50', 'uniform:20-200', 'exponential:50' (mean) or 'lognormal:50,0.5'
+    (median and sigma). A bare number is fixed.
+    """
+    kind, _, arguments = spec.partition(":") if ":" in spec else ("fixed", "", spec)
+    try:
+        if kind == "fixed":
+            delay = float(arguments) / 1000
+            return lambda rng: delay
+        if kind == "uniform":
+            low, high = (float(value) / 1000 for value in arguments.split("-"))
+            return lambda rng: rng.uniform(low, high)
+        if kind == "exponential":
+            mean = float(arguments) / 1000
+            return lambda rng: rng.expovariate(1 / mean) if mean > 0 else 0.0
+        if kind == "lognormal":
+            median, sigma = arguments.split(",")
+            median, sigma = float(median) / 1000, float(sigma)
+            return lambda rng: median * rng.lognormvariate(0, sigma)
+    except ValueError:
+        pass
+    raise ValueError(f"Invalid latency {spec!r}; use e.g. fixed:50, uniform:20-200, exponential:50 or lognormal:50,0.5")
+
+
+class TokenBucket:
+    """Allow `rate` requests per second with bursts of up to `burst`."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        """0 if the request may go ahead, else the seconds until it could."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+
+class MockDataCite:
+    """
+    The mock API server. `start()` serves it on a background thread; `url` is the
+    endpoint to put in the credentials file and `counts` tallies responses by status.
+    """
+
+    def __init__(self, host="127.0.0.1", port=8765, username=None, password=None, latency="fixed:0",
+                 error_rate=0.0, reject_rate=0.0, auth_failure_rate=0.0, rate_limit=None, burst=None,
+                 seed=None):
+        self.username = username
+        self.password = password
+        self.latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.reject_rate = reject_rate
+        self.auth_failure_rate = auth_failure_rate
+        self.bucket = TokenBucket(rate_limit, burst) if rate_limit else None
+
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.dois = {}
+        self.counts = {}
+        self.listing = None  # Sorted (created, doi) keys, rebuilt after changes
+
+        self.server = ThreadingHTTPServer((host, port), self.make_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/dois"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="mock-datacite", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def roll(self):
+        with self.lock:
+            return self.rng.random()
+
+    def delay(self):
+        with self.lock:
+            return self.latency(self.rng)
+
+    def count(self, status):
+        with self.lock:
+            self.counts[status] = self.counts.get(status, 0) + 1
+
+    def new_suffix(self):
+        with self.lock:
+            chars = "".join(self.rng.choice(SUFFIX_ALPHABET) for _ in range(8))
+        return f"{chars[:4]}-{chars[4:]}"
+
+    def authorized(self, header):
+        if self.username is None:
+            return True
+        expected = base64.b64encode(f"{self.username}:{self.password or ''}".encode("utf-8")).decode("ascii")
+        return header == f"Basic {expected}"
+
+    def create_doi(self, body):
+        """(status, response body, extra headers) for one POST /dois payload."""
+        try:
+            attributes = body["data"]["attributes"]
+            prefix = attributes["prefix"]
+        except (KeyError, TypeError):
+            return 400, errors(400, "Bad request: expected a JSON:API document with data.attributes.prefix"), {}
+
+        blank = [field for field in ("url", "publisher", "publicationYear") if not attributes.get(field)]
+        if not attributes.get("titles") or not attributes["titles"][0].get("title"):
+            blank.append("titles")
+        if not attributes.get("creators"):
+            blank.append("creators")
+        if blank:
+            return 422, {"errors": [{"source": field, "title": "Can't be blank"} for field in blank]}, {}
+        if self.roll() < self.reject_rate:
+            return 422, errors(422, "This DOI has already been taken", source="doi"), {}
+
+        now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        while True:
+            doi = f"{prefix}/{self.new_suffix()}"
+            with self.lock:
+                if doi not in self.dois:
+                    self.dois[doi] = {**attributes, "created": now}
+                    self.listing = None
+                    break
+        return 201, self.doi_document(doi, attributes, now, now), {}
+
+    def add_doi(self, doi, url, created="2020-01-01T00:00:00Z", **attributes):
+        """Preload a DOI, e.g. to give the listing something to page through."""
+        with self.lock:
+            self.dois[doi] = {"url": url, "created": created, **attributes}
+            self.listing = None
+
+    def list_dois(self, query, base_url):
+        """(status, response body, extra headers) for one GET /dois page."""
+        params = {key: values[-1] for key, values in parse_qs(query).items()}
+        prefix = params.get("prefix")
+        year = params.get("created")
+        try:
+            size = max(0, min(1000, int(params.get("page[size]", 25))))
+        except ValueError:
+            return 400, errors(400, "Bad request: page[size] must be a number"), {}
+        cursor = params.get("page[cursor]")
+
+        with self.lock:
+            if self.listing is None:
+                self.listing = sorted((attributes.get("created", ""), doi) for doi, attributes in self.dois.items())
+            matching = [
+                key for key in self.listing
+                if (not prefix or key[1].startswith(prefix + "/")) and (not year or key[0].startswith(year))
+            ]
+            years = {}
+            for created, _ in matching:
+                years[created[:4]] = years.get(created[:4], 0) + 1
+            # Cursors are the last key of the previous page
+            start = 0
+            if cursor and cursor != "1":
+                try:
+                    created, doi = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split(" ", 1)
+                except (ValueError, UnicodeDecodeError):
+                    return 400, errors(400, "Bad request: invalid cursor"), {}
+                start = bisect.bisect_right(matching, (created, doi))
+            page = matching[start:start + size]
+            data = [self.doi_document(doi, self.dois[doi], created, created)["data"] for created, doi in page]
+
+        links = {}
+        if page and start + size < len(matching):
+            last = " ".join(page[-1])
+            next_params = {**params, "page[cursor]": base64.urlsafe_b64encode(last.encode("utf-8")).decode("ascii")}
+            links["next"] = f"{base_url}?{urlencode(next_params)}"
+        return 200, {
+            "data": data,
+            "meta": {
+                "total": len(matching),
+                "totalPages": -(-len(matching) // size) if size else 0,
+                "created": [{"id": y, "title": y, "count": n} for y, n in sorted(years.items(), reverse=True)],
+            },
+            "links": links,
+        }, {}
+
+    def update_doi(self, doi, body):
+        """(status, response body, extra headers) for one PUT /dois/<doi> payload."""
+        try:
+            attributes = body["data"]["attributes"]
+        except (KeyError, TypeError):
+            return 400, errors(400, "Bad request: expected a JSON:API document with data.attributes"), {}
+        with self.lock:
+            if doi not in self.dois:
+                return 404, errors(404, "The resource you are looking for doesn't exist."), {}
+            self.dois[doi] = {**self.dois[doi], **attributes}
+            attributes = self.dois[doi]
+            self.listing = None
+        now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        return 200, self.doi_document(doi, attributes, attributes.get("created", now), now), {}
+
+    def doi_document(self, doi, attributes, created, updated):
+        prefix = doi.split("/", 1)[0]
+        return {
+            "data": {
+                "id": doi,
+                "type": "dois",
+                "attributes": {
+                    **attributes,
+                    "doi": doi,
+                    "prefix": prefix,
+                    "suffix": doi.split("/", 1)[1],
+                    "state": "findable" if attributes.get("event") == "publish" else "draft",
+                    "created": created,
+                    "registered": created,
+                    "updated": updated,
+                },
+                "relationships": {"client": {"data": {"id": "mock.client", "type": "clients"}}},
+            }
+        }
+
+    def make_handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out as separate writes; don't let them wait on delayed ACKs
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def send(self, status, body, headers=None, content_type="application/vnd.api+json; charset=utf-8"):
+                data = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                # Counted first, so a client that has its response finds it in `counts`
+                mock.count(status)
+                self.wfile.write(data)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path.rstrip("/") == "/heartbeat":
+                    self.send(200, b"OK", content_type="text/plain")
+                elif url.path.rstrip("/") == "/dois":
+                    if self.injected_failure():
+                        return
+                    host, port = mock.server.server_address[:2]
+                    status, response, headers = mock.list_dois(url.query, f"http://{self.headers.get('Host') or f'{host}:{port}'}/dois")
+                    self.send(status, response, headers)
+                else:
+                    self.send(404, errors(404, "The resource you are looking for doesn't exist."))
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length)
+                if self.path.split("?", 1)[0].rstrip("/") != "/dois":
+                    self.send(404, errors(404, "The resource you are looking for doesn't exist."))
+                    return
+                if self.injected_failure():
+                    return
+
+                try:
+                    body = json.loads(raw)
+                except ValueError:
+                    self.send(400, errors(400, "Bad request: the body is not valid JSON"))
+                    return
+                status, response, headers = mock.create_doi(body)
+                self.send(status, response, headers)
+
+            def do_PUT(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length)
+                path = unquote(self.path.split("?", 1)[0].rstrip("/"))
+                if not path.startswith("/dois/"):
+                    self.send(404, errors(404, "The resource you are looking for doesn't exist."))
+                    return
+                if self.injected_failure():
+                    return
+
+                try:
+                    body = json.loads(raw)
+                except ValueError:
+                    self.send(400, errors(400, "Bad request: the body is not valid JSON"))
+                    return
+                status, response, headers = mock.update_doi(path[len("/dois/"):], body)
+                self.send(status, response, headers)
+
+            def injected_failure(self):
+                """Apply the latency and send a configured failure, if one is due. True if sent."""
+                time.sleep(mock.delay())
+
+                if mock.bucket is not None:
+                    wait = mock.bucket.take()
+                    if wait:
+                        self.send(429, errors(429, "Too many requests"), {"Retry-After": str(max(1, round(wait)))})
+                        return True
+                if not mock.authorized(self.headers.get("Authorization")) or mock.roll() < mock.auth_failure_rate:
+                    self.send(401, errors(401, "Bad credentials."), {"WWW-Authenticate": 'Basic realm="mock"'})
+                    return True
+                if mock.roll() < mock.error_rate:
+                    # Gateways answer with HTML, the application itself with JSON
+                    with mock.lock:
+                        status = mock.rng.choice([500, 502, 503])
+                    if status == 500:
+                        self.send(500, errors(500, "Internal server error"))
+                    else:
+                        reason = self.responses[status][0]
+                        page = GATEWAY_ERROR_PAGE.format(code=status, reason=reason).encode("utf-8")
+                        self.send(status, page, content_type="text/html")
+                    return True
+                return False
+
+        return Handler
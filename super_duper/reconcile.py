@@ -0,0 +1,309 @@
+"""
+Check what DataCite holds for our prefix against a DSpace export.
+
+Every DOI under the prefix is listed from `GET /dois`, split by creation year so
+that one cursor-paginated listing per year can run at the same time. The DOIs and
+their landing-page URLs go into a temporary SQLite index next to the handle URLs
+and DOIs found in the export's `dc.identifier.uri` cells, and the differences are
+written to a CSV report:
+
+- missing_in_dspace: a DOI whose URL is an item's handle, but the item doesn't list it
+- orphan: a DOI whose URL is no item's handle, and no item lists it
+- url_mismatch: an item lists a DOI that DataCite resolves to some other URL
+- not_at_datacite: an item lists a DOI under our prefix that DataCite doesn't have
+"""
+import csv
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from super_duper.compression import compression_for, open_text
+from super_duper.jobs import Cancelled, ReadProgress
+from super_duper.merge import URI_FIELDS, VALUE_SEPARATOR
+
+REPORT_FIELDS = ["kind", "doi", "datacite_url", "dspace_id", "dspace_uri"]
+
+DIFF_KINDS = ["missing_in_dspace", "orphan", "url_mismatch", "not_at_datacite"]
+
+# DataCite's largest page
+PAGE_SIZE = 1000
+
+# Concurrent listings (one per creation year at a time)
+DEFAULT_CONCURRENCY = 4
+
+_DOI = re.compile(r"\b(10\.\d{4,9}/[^\s|]+)", re.IGNORECASE)
+
+
+def normalize_doi(text):
+    """'https://doi.org/10.25316/IR-1' -> '10.25316/ir-1'; DOIs are case-insensitive."""
+    m = _DOI.search(text)
+    return m.group(1).rstrip(".,;").lower() if m else None
+
+
+def normalize_url(url):
+    return (url or "").strip().rstrip("/")
+
+
+class RemoteIndex:
+    """DOI -> URL from the DataCite listing, plus the export's handles and DOIs, in a temporary SQLite file."""
+
+    def __init__(self):
+        fd, self.path = tempfile.mkstemp(prefix="super_duper_reconcile_", suffix=".sqlite")
+        os.close(fd)
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        # A scratch index: nothing to recover if the process dies
+        self.db.execute("PRAGMA journal_mode = OFF")
+        self.db.execute("PRAGMA synchronous = OFF")
+        self.db.executescript("""
+            CREATE TABLE remote (doi TEXT PRIMARY KEY, url TEXT) WITHOUT ROWID;
+            CREATE TABLE handles (url TEXT, item TEXT);
+            CREATE TABLE listed (doi TEXT, item TEXT, uri TEXT);
+        """)
+        self.lock = threading.Lock()
+
+    def add_remote(self, pairs):
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO remote VALUES (?, ?)", pairs)
+
+    def add_item(self, item, handles, dois):
+        self.db.executemany("INSERT INTO handles VALUES (?, ?)", [(url, item) for url in handles])
+        self.db.executemany("INSERT INTO listed VALUES (?, ?, ?)", [(doi, item, uri) for doi, uri in dois])
+
+    def diff(self, prefix):
+        """Yield REPORT_FIELDS rows for every difference."""
+        self.db.execute("CREATE INDEX remote_url ON remote (url)")
+        self.db.execute("CREATE INDEX handles_url ON handles (url)")
+        self.db.execute("CREATE INDEX listed_doi ON listed (doi)")
+        queries = {
+            "missing_in_dspace": """
+                SELECT r.doi, r.url, h.item, h.url FROM remote r JOIN handles h ON h.url = r.url
+                WHERE NOT EXISTS (SELECT 1 FROM listed l WHERE l.doi = r.doi AND l.item = h.item)
+                ORDER BY r.doi""",
+            "orphan": """
+                SELECT r.doi, r.url, '', '' FROM remote r
+                WHERE NOT EXISTS (SELECT 1 FROM handles h WHERE h.url = r.url)
+                AND NOT EXISTS (SELECT 1 FROM listed l WHERE l.doi = r.doi)
+                ORDER BY r.doi""",
+            "url_mismatch": """
+                SELECT r.doi, r.url, l.item, l.uri FROM listed l JOIN remote r ON r.doi = l.doi
+                WHERE NOT EXISTS (SELECT 1 FROM handles h WHERE h.item = l.item AND h.url = r.url)
+                ORDER BY r.doi""",
+            "not_at_datacite": """
+                SELECT l.doi, '', l.item, l.uri FROM listed l
+                WHERE l.doi LIKE ? AND NOT EXISTS (SELECT 1 FROM remote r WHERE r.doi = l.doi)
+                ORDER BY l.doi""",
+        }
+        for kind in DIFF_KINDS:
+            params = (prefix.lower() + "/%",) if kind == "not_at_datacite" else ()
+            for doi, url, item, uri in self.db.execute(queries[kind], params):
+                yield {"kind": kind, "doi": doi, "datacite_url": url, "dspace_id": item, "dspace_uri": uri}
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM remote").fetchone()[0]
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+            os.unlink(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def get_json(session, url, params, auth, retry_policy, cancel=None, metrics=None):
+    """GET a listing page, retrying throttling, server and network errors per `retry_policy`."""
+    import requests
+
+    from super_duper.mint import RetryPolicy, error_message_for, parse_retry_after
+
+    for attempt in range(1, retry_policy.max_attempts + 1):
+        if cancel is not None and cancel.is_set():
+            raise Cancelled()
+        started = time.perf_counter()
+        retry_after = None
+        try:
+            response = session.get(url, params=params, auth=auth, timeout=retry_policy.timeout)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                requests.exceptions.ChunkedEncodingError) as e:
+            problem = f"{type(e).__name__}: {e}"
+        else:
+            if metrics is not None:
+                metrics.observe("datacite_request_seconds", time.perf_counter() - started)
+                metrics.count("datacite_responses_total", status=str(response.status_code))
+            if response.status_code == 200:
+                return response.json()
+            problem = f"{response.status_code} {error_message_for(response)}"
+            if response.status_code not in RetryPolicy.RETRYABLE_STATUSES:
+                break
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        if attempt < retry_policy.max_attempts:
+            time.sleep(retry_policy.delay(attempt, retry_after))
+    raise RuntimeError(f"DataCite listing failed: {problem}")
+
+
+def list_partition(session, url, params, auth, retry_policy, index, on_page, cancel=None, metrics=None):
+    """Follow one cursor-paginated listing to its end, indexing every DOI. Returns the DOIs seen."""
+    params = {**params, "page[cursor]": "1", "page[size]": str(PAGE_SIZE)}
+    seen = 0
+    while True:
+        page = get_json(session, url, params, auth, retry_policy, cancel, metrics)
+        records = page.get("data") or []
+        index.add_remote([
+            (record["id"].lower(), normalize_url((record.get("attributes") or {}).get("url")))
+            for record in records
+        ])
+        seen += len(records)
+        on_page(len(records))
+        next_url = (page.get("links") or {}).get("next")
+        if not records or not next_url:
+            return seen
+        # The next link carries the cursor and every other parameter
+        url, params = next_url, None
+
+
+def fetch_datacite_dois(credentials, index, concurrency=DEFAULT_CONCURRENCY, retry_policy=None, log=None,
+                        progress=None, cancel=None, metrics=None):
+    """
+    List every DOI under the credentials' prefix into `index`, one listing per creation
+    year, `concurrency` at a time. Returns how many DOIs DataCite reported.
+    """
+    from super_duper.mint import RetryPolicy, make_datacite_session
+
+    log = log or (lambda message: None)
+    retry_policy = retry_policy or RetryPolicy()
+    url = credentials["url"].rstrip("/")
+    auth = (credentials["username"], credentials["password"])
+    base = {"prefix": credentials["doiPrefix"]}
+    session = make_datacite_session(concurrency)
+
+    with session:
+        # A one-DOI page for the total and the years to split the listing by
+        meta = get_json(session, url, {**base, "page[size]": "1"}, auth, retry_policy, cancel, metrics).get("meta") or {}
+        total = meta.get("total")
+        facets = [facet for facet in meta.get("created") or [] if facet.get("id")]
+        years = [facet["id"] for facet in facets]
+        if total is not None and sum(facet.get("count", 0) for facet in facets) != total:
+            # The year facets don't cover everything (DataCite may cap them); list it in one go
+            years = []
+        if years:
+            partitions = [{**base, "created": year} for year in years]
+            log(f"{total} DOIs at DataCite under {base['prefix']}, listed by creation year ({len(years)} years).")
+        else:
+            partitions = [base]
+            log(f"{total} DOIs at DataCite under {base['prefix']}.")
+
+        fetched = 0
+        lock = threading.Lock()
+
+        def on_page(count):
+            nonlocal fetched
+            with lock:
+                fetched += count
+                done = fetched
+            if metrics is not None:
+                metrics.count("reconcile_pages_total")
+            if progress:
+                progress(done, total)
+
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+            futures = [
+                pool.submit(list_partition, session, url, params, auth, retry_policy, index, on_page, cancel, metrics)
+                for params in partitions
+            ]
+            for future in as_completed(futures):
+                future.result()
+
+    if total is not None and fetched != total:
+        log(f"Listed {fetched} DOIs but DataCite reported {total}; DOIs may have been created meanwhile.")
+    return total
+
+
+def index_dspace_export(dspace_csv, index, progress=None, cancel=None):
+    """Add each item's handle URLs and listed DOIs to `index`. Returns the number of items."""
+    from super_duper.convert import DSPACE_URI_PATTERNS
+
+    read_progress = ReadProgress(dspace_csv)
+    items = 0
+    with open_text(dspace_csv, "r", newline="") as file:
+        reader = csv.reader(read_progress.lines(file))
+        header = next(reader, [])
+        id_position = header.index("id") if "id" in header else None
+        uri_positions = [header.index(field) for field in URI_FIELDS if field in header]
+        for row_number, row in enumerate(reader, start=1):
+            if not row:
+                continue
+            if cancel is not None and cancel.is_set():
+                raise Cancelled()
+            item = row[id_position] if id_position is not None and id_position < len(row) else f"row {row_number}"
+            handles, dois = [], []
+            for position in uri_positions:
+                if position >= len(row):
+                    continue
+                for uri in row[position].split(VALUE_SEPARATOR):
+                    uri = uri.strip()
+                    doi = normalize_doi(uri) if "doi" in uri.lower() or uri.startswith("10.") else None
+                    if doi:
+                        dois.append((doi, uri))
+                    elif any(pattern in uri for pattern in DSPACE_URI_PATTERNS):
+                        handles.append(normalize_url(uri))
+            index.add_item(item, handles, dois)
+            items += 1
+            if progress and items % 1000 == 0:
+                progress(items, read_progress.estimated_total(items))
+    return items
+
+
+def reconcile(credentials, dspace_csv, report_csv, concurrency=DEFAULT_CONCURRENCY, retry_policy=None, log=None,
+              progress=None, cancel=None, metrics=None):
+    """
+    List the prefix's DOIs from DataCite, compare them with a DSpace export and write the
+    differences to `report_csv` (REPORT_FIELDS, grouped by kind).
+
+    `progress(dois_listed, total)` is called as listing pages arrive; once `cancel` is
+    set the listing stops and Cancelled is raised without a report.
+    `metrics` gets the listing's request latencies and page count, and the time spent
+    listing, indexing the export and comparing.
+    Returns a dict with the counts per kind, the DOIs listed and items read, and the report path.
+    """
+    log = log or (lambda message: None)
+    with RemoteIndex() as index:
+        started = time.perf_counter()
+        fetch_datacite_dois(credentials, index, concurrency, retry_policy, log, progress, cancel, metrics)
+        listed = time.perf_counter()
+        remote_count = len(index)
+        log(f"{remote_count} DOIs listed from DataCite in {listed - started:.1f}s.")
+
+        items = index_dspace_export(dspace_csv, index, cancel=cancel)
+        indexed = time.perf_counter()
+        log(f"{items} items read from {os.path.basename(dspace_csv)}.")
+
+        counts = dict.fromkeys(DIFF_KINDS, 0)
+        partial = f"{report_csv}.part"
+        with open_text(partial, "w", newline="", compression=compression_for(report_csv)) as file:
+            writer = csv.DictWriter(file, fieldnames=REPORT_FIELDS)
+            writer.writeheader()
+            for row in index.diff(credentials["doiPrefix"]):
+                counts[row["kind"]] += 1
+                writer.writerow(row)
+        os.replace(partial, report_csv)
+
+    if metrics is not None:
+        metrics.add_time("reconcile_stage_seconds_total", listed - started, stage="list")
+        metrics.add_time("reconcile_stage_seconds_total", indexed - listed, stage="index_export")
+        metrics.add_time("reconcile_stage_seconds_total", time.perf_counter() - indexed, stage="compare")
+        metrics.set("reconcile_datacite_dois", remote_count)
+        metrics.set("reconcile_dspace_items", items)
+        for kind, count in counts.items():
+            metrics.count("reconcile_differences_total", count, kind=kind)
+    for kind in DIFF_KINDS:
+        log(f"{kind}: {counts[kind]}")
+
+    return {**counts, "datacite_dois": remote_count, "dspace_items": items, "report_csv": report_csv}
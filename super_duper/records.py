@@ -0,0 +1,215 @@
+"""
+The rows passed between the converter, the DOI creator and the merger, and the one
+definition of the Datacite import and export CSV columns they are read from and
+written to.
+
+Rows are small `__slots__` objects rather than dicts, so a few hundred thousand of
+them in flight don't each carry a hash table of repeated string keys, and a
+misspelt field fails at once instead of reading as missing.
+"""
+import csv
+
+# Columns of one creator group, after its `creatorN` prefix
+CREATOR_SUFFIXES = ["", "_type", "_given", "_family"]
+
+# Creator column groups every import CSV has, filled or not; more are added when a row needs them
+IMPORT_CREATOR_GROUPS = 2
+
+
+def import_fields(creator_groups=IMPORT_CREATOR_GROUPS):
+    """The Datacite import CSV header with `creator_groups` creator column groups."""
+    creators = [f"creator{n}{suffix}" for n in range(1, creator_groups + 1) for suffix in CREATOR_SUFFIXES]
+    return ["title", "year", "type", "description", *creators, "publisher", "source"]
+
+
+# Written by page 2 (the converter), read by page 3 (the DOI creator)
+DATACITE_IMPORT_FIELDS = import_fields()
+
+# Written by page 3 and the mint logs, read by page 4 (the merger) and the statistics
+DATACITE_EXPORT_FIELDS = ["title", "source", "doi", "status", "error_message", "error_type"]
+
+
+class Creator:
+    """One `creatorN` column group."""
+
+    __slots__ = ("name", "name_type", "given_name", "family_name")
+
+    def __init__(self, name, name_type="", given_name="", family_name=""):
+        self.name = name
+        self.name_type = name_type
+        self.given_name = given_name
+        self.family_name = family_name
+
+    def cells(self):
+        return [self.name, self.name_type, self.given_name, self.family_name]
+
+    def datacite(self):
+        """As an entry of DataCite's `creators` attribute."""
+        return {
+            "name": self.name,
+            "nameType": self.name_type,
+            "givenName": self.given_name,
+            "familyName": self.family_name
+        }
+
+
+class DataciteRecord:
+    """One row of a Datacite import CSV."""
+
+    __slots__ = ("title", "year", "type", "description", "creators", "publisher", "source")
+
+    def __init__(self, title="", year="", type="", description="", creators=(), publisher="", source=""):
+        self.title = title
+        self.year = year
+        self.type = type
+        self.description = description
+        self.creators = creators
+        self.publisher = publisher
+        self.source = source
+
+    def csv_row(self, creator_groups=IMPORT_CREATOR_GROUPS):
+        """
+        The cells in import_fields() order, with every creator and blank groups up to
+        `creator_groups`.
+        """
+        cells = [self.title, self.year, self.type, self.description]
+        for creator in self.creators:
+            cells += creator.cells()
+        cells += [""] * (len(CREATOR_SUFFIXES) * (creator_groups - len(self.creators)))
+        cells += [self.publisher, self.source]
+        return cells
+
+
+def creator_groups(header):
+    """How many creator column groups an import_fields() header or row has."""
+    return (len(header) - 6) // len(CREATOR_SUFFIXES)
+
+
+def widen_import_row(cells, groups):
+    """An import_fields() row padded with blank creator groups up to `groups`."""
+    missing = len(CREATOR_SUFFIXES) * (groups - creator_groups(cells))
+    if missing <= 0:
+        return cells
+    return cells[:-2] + [""] * missing + cells[-2:]
+
+
+class DoiRecord(DataciteRecord):
+    """
+    A record on its way to DataCite: an import CSV row, or a payload batch line
+    carrying only its title, source and ready-made request `body`. `row` is its line
+    in the input; an update also says where (`endpoint`) and how (`method`) to send
+    it, and the hash of the metadata sent.
+    """
+
+    __slots__ = ("row", "body", "method", "endpoint", "content_hash")
+
+    def __init__(self, row, body=None, **fields):
+        super().__init__(**fields)
+        self.row = row
+        self.body = body
+        self.method = "POST"
+        self.endpoint = None
+        self.content_hash = None
+
+
+class MintResult:
+    """One row of a Datacite export CSV: the outcome of sending one record."""
+
+    __slots__ = tuple(DATACITE_EXPORT_FIELDS)
+
+    def __init__(self, title="", source="", doi=None, status=None, error_message="", error_type=""):
+        self.title = title
+        self.source = source
+        self.doi = doi
+        self.status = status
+        self.error_message = error_message
+        self.error_type = error_type
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(*(data.get(field) for field in DATACITE_EXPORT_FIELDS))
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in DATACITE_EXPORT_FIELDS}
+
+    def csv_row(self):
+        """The cells in DATACITE_EXPORT_FIELDS order (None is written as an empty cell)."""
+        return [self.title, self.source, self.doi, self.status, self.error_message, self.error_type]
+
+
+def _header_positions(reader):
+    # Later duplicates win, as they would in a DictReader row
+    return {name.strip().lower(): i for i, name in enumerate(next(reader, []))}
+
+
+def read_import_records(file):
+    """
+    Yield a DoiRecord per row of an open Datacite import CSV, numbered from 1. Column
+    names are matched case-insensitively, and every `creatorN` group present is read.
+    """
+    reader = csv.reader(file)
+    positions = _header_positions(reader)
+    missing = [name for name in ["title", "year", "type", "description", "publisher", "source"] if name not in positions]
+    if missing:
+        raise ValueError(f"Not a Datacite import CSV; missing columns: {', '.join(missing)}")
+    width = max(positions.values()) + 2
+    blank = width - 1  # Where an absent optional column reads from
+
+    creator_columns = []
+    while f"creator{len(creator_columns) + 1}" in positions:
+        n = len(creator_columns) + 1
+        creator_columns.append(tuple(
+            positions.get(f"creator{n}{suffix}", blank) for suffix in CREATOR_SUFFIXES
+        ))
+
+    title, year, type_, description, publisher, source = (
+        positions[name] for name in ["title", "year", "type", "description", "publisher", "source"]
+    )
+    row_number = 0
+    for row in reader:
+        if not row:
+            continue
+        row_number += 1
+        if len(row) < width:
+            row += [""] * (width - len(row))
+        creators = tuple(
+            Creator(row[name].strip(), row[name_type].strip() or "Personal", row[given].strip(), row[family].strip())
+            for name, name_type, given, family in creator_columns if row[name]
+        )
+        yield DoiRecord(
+            row_number,
+            title=row[title].strip(),
+            year=row[year].strip(),
+            type=row[type_].strip(),
+            description=row[description].strip(),
+            creators=creators,
+            publisher=row[publisher].strip(),
+            source=row[source].strip(),
+        )
+
+
+def read_export_rows(file):
+    """
+    Yield a MintResult per row of an open Datacite export CSV (cells as read, so
+    `status` is a string). Columns other than `source` and `doi` may be absent.
+    """
+    reader = csv.reader(file)
+    positions = _header_positions(reader)
+    missing = [name for name in ["source", "doi"] if name not in positions]
+    if missing:
+        raise ValueError(f"Not a Datacite export CSV; missing columns: {', '.join(missing)}")
+    width = max(positions.values()) + 2
+    columns = [positions.get(field, width - 1) for field in DATACITE_EXPORT_FIELDS]
+    for row in reader:
+        if not row:
+            continue
+        if len(row) < width:
+            row += [""] * (width - len(row))
+        yield MintResult(*(row[column] for column in columns))
+
+
+def write_export_rows(file, results):
+    """Write a Datacite export CSV of MintResults to an open file."""
+    writer = csv.writer(file)
+    writer.writerow(DATACITE_EXPORT_FIELDS)
+    writer.writerows(result.csv_row() for result in results)
@@ -0,0 +1,237 @@
+"""
+A local record of every DOI minted for a DSpace item, keyed by its `source` handle URL.
+
+`log/doi_registry.sqlite` holds the latest known outcome per source: the DOI,
+the response status, the failure kind and when it was recorded. Mint runs write
+to it as responses arrive and check it before sending, so an item that already
+has a DOI is never submitted again; the merge can take DOIs straight from it.
+`backfill` fills it from the `log/datacite_export_*.csv` copies of earlier runs,
+reading each log file only once. For each DOI it also keeps a hash of the metadata
+last sent, so an update run only sends records that have changed since.
+
+A 201 is never replaced by a later failure (e.g. a 422 for a DOI that was
+already taken), and older outcomes never replace newer ones.
+"""
+import csv
+import os
+import re
+import sqlite3
+from datetime import datetime, timezone
+
+from super_duper.compression import has_extension, open_text
+from super_duper.logs import EXPORT_LOG_PREFIX, log_dir
+from super_duper.records import MintResult, read_export_rows
+
+REGISTRY_FILE = "doi_registry.sqlite"
+
+# Sources per query when checking many at once; under SQLite's variable limit
+LOOKUP_CHUNK = 500
+
+# datacite_export_YYYYMMDD_HHMMSS[_n].csv
+_RUN_TIME = re.compile(re.escape(EXPORT_LOG_PREFIX) + r"(\d{8}_\d{6})")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dois (
+    source TEXT PRIMARY KEY,
+    doi TEXT,
+    status INTEGER,
+    error_type TEXT,
+    updated TEXT NOT NULL,
+    content_hash TEXT
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS backfilled_logs (
+    name TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+UPSERT = """
+INSERT INTO dois (source, doi, status, error_type, updated, content_hash) VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (source) DO UPDATE SET
+    doi = excluded.doi, status = excluded.status, error_type = excluded.error_type, updated = excluded.updated,
+    content_hash = CASE WHEN excluded.doi IS dois.doi
+                        THEN COALESCE(excluded.content_hash, dois.content_hash) ELSE excluded.content_hash END
+WHERE excluded.updated >= dois.updated AND (dois.status IS NOT 201 OR excluded.status = 201)
+"""
+
+
+def registry_path(directory=None):
+    return os.path.join(directory or log_dir(), REGISTRY_FILE)
+
+
+def now_iso():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def log_run_time(filename, mtime):
+    """When the run behind a log file happened: from its name, else its modification time."""
+    m = _RUN_TIME.match(filename)
+    if m:
+        when = datetime.strptime(m.group(1), "%Y%m%d_%H%M%S")
+    else:
+        when = datetime.fromtimestamp(mtime)
+    # Log file names are in local time
+    return when.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _status(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class DoiRegistry:
+    """
+    The registry database. Writes through `record` are committed every
+    `commit_every` rows and on close; use as a context manager.
+    """
+
+    def __init__(self, path=None, commit_every=100):
+        self.path = path or registry_path()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.db = sqlite3.connect(self.path, timeout=30)
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.executescript(SCHEMA)
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(dois)")}
+        if "content_hash" not in columns:
+            # Registries created before update runs
+            self.db.execute("ALTER TABLE dois ADD COLUMN content_hash TEXT")
+        self.commit_every = commit_every
+        self.uncommitted = 0
+
+    def close(self):
+        if self.db is not None:
+            self.db.commit()
+            self.db.close()
+            self.db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def record(self, result, updated=None, content_hash=None):
+        """
+        Store one MintResult (from a mint run or an export CSV), with the hash of the
+        metadata sent when known.
+        """
+        self.record_many([result], updated, content_hash)
+
+    def record_many(self, results, updated=None, content_hash=None):
+        updated = updated or now_iso()
+        rows = [
+            (result.source, result.doi or None, _status(result.status), result.error_type or None, updated, content_hash)
+            for result in results if result.source
+        ]
+        self.db.executemany(UPSERT, rows)
+        self.uncommitted += len(rows)
+        if self.uncommitted >= self.commit_every:
+            self.commit()
+        return len(rows)
+
+    def commit(self):
+        self.db.commit()
+        self.uncommitted = 0
+
+    def minted(self, sources):
+        """{source: DOI} for those of `sources` that already have a DOI, looked up in bulk."""
+        sources = list(dict.fromkeys(source for source in sources if source))
+        found = {}
+        for start in range(0, len(sources), LOOKUP_CHUNK):
+            chunk = sources[start:start + LOOKUP_CHUNK]
+            found.update(self.db.execute(
+                f"SELECT source, doi FROM dois WHERE status = 201 AND source IN ({','.join('?' * len(chunk))})",
+                chunk,
+            ))
+        return found
+
+    def ambiguous(self, sources):
+        """
+        Those of `sources` whose last request may or may not have minted a DOI (it timed
+        out or dropped after being sent), looked up in bulk.
+        """
+        sources = list(dict.fromkeys(source for source in sources if source))
+        found = set()
+        for start in range(0, len(sources), LOOKUP_CHUNK):
+            chunk = sources[start:start + LOOKUP_CHUNK]
+            found.update(source for source, in self.db.execute(
+                f"SELECT source FROM dois WHERE error_type = 'ambiguous' AND source IN ({','.join('?' * len(chunk))})",
+                chunk,
+            ))
+        return found
+
+    def minted_hashes(self, sources):
+        """{source: (DOI, content hash or None)} for those of `sources` that have a DOI."""
+        sources = list(dict.fromkeys(source for source in sources if source))
+        found = {}
+        for start in range(0, len(sources), LOOKUP_CHUNK):
+            chunk = sources[start:start + LOOKUP_CHUNK]
+            for source, doi, content_hash in self.db.execute(
+                    "SELECT source, doi, content_hash FROM dois "
+                    f"WHERE status = 201 AND source IN ({','.join('?' * len(chunk))})", chunk):
+                found[source] = (doi, content_hash)
+        return found
+
+    def set_content_hash(self, source, content_hash):
+        """Remember the metadata just sent for the DOI of `source`."""
+        self.db.execute("UPDATE dois SET content_hash = ? WHERE source = ?", (content_hash, source))
+        self.uncommitted += 1
+        if self.uncommitted >= self.commit_every:
+            self.commit()
+
+    def get(self, source):
+        """The DOI minted for `source`, or None."""
+        found = self.db.execute("SELECT doi FROM dois WHERE source = ? AND status = 201", (source,)).fetchone()
+        return found[0] if found else None
+
+    def __len__(self):
+        """Sources with a DOI."""
+        return self.db.execute("SELECT COUNT(*) FROM dois WHERE status = 201").fetchone()[0]
+
+    def counts(self):
+        """Sources by their latest status ('' for no response)."""
+        return {
+            "" if status is None else str(status): count
+            for status, count in self.db.execute("SELECT status, COUNT(*) FROM dois GROUP BY status")
+        }
+
+    def backfill(self, directory=None, log=None):
+        """
+        Record every row of the mint logs in `directory` not seen by an earlier backfill.
+        A log compressed since is read once more, which changes nothing.
+        Returns (files read, rows recorded).
+        """
+        directory = directory or log_dir()
+        if not os.path.isdir(directory):
+            return 0, 0
+        seen = {name: (size, mtime_ns) for name, size, mtime_ns in self.db.execute("SELECT * FROM backfilled_logs")}
+        files = rows = 0
+        # Oldest first, so a source's latest outcome is the one that sticks
+        for entry in sorted(os.scandir(directory), key=lambda entry: entry.name):
+            if not (entry.name.startswith(EXPORT_LOG_PREFIX) and has_extension(entry.name, ".csv")):
+                continue
+            stat = entry.stat()
+            if seen.get(entry.name) == (stat.st_size, stat.st_mtime_ns):
+                continue
+            try:
+                with open_text(entry.path, "r", newline="") as file:
+                    rows += self.record_many(read_export_rows(file), log_run_time(entry.name, stat.st_mtime))
+            except (OSError, EOFError, ValueError, KeyError, csv.Error) as e:
+                if log:
+                    log(f"Error reading file {entry.name}: {e}")
+                continue
+            self.db.execute("INSERT OR REPLACE INTO backfilled_logs VALUES (?, ?, ?)",
+                            (entry.name, stat.st_size, stat.st_mtime_ns))
+            files += 1
+        self.commit()
+        return files, rows
+
+    def export_rows(self):
+        """Every registered source as a MintResult, in source order."""
+        for source, doi, status, error_type in self.db.execute(
+                "SELECT source, doi, status, error_type FROM dois ORDER BY source"):
+            yield MintResult("", source, doi, status, "", error_type or "")
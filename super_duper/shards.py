@@ -0,0 +1,378 @@
+"""
+Split one big mint across several machines that share a directory.
+
+    python -m super_duper shards split DataciteImport.csv /shared/run1 --shards 16
+    python -m super_duper shards work /shared/run1 --credentials creds.json   # on every host
+    python -m super_duper shards merge /shared/run1 DataciteExport.csv
+
+`split` cuts an import CSV (or payload batch) into contiguous shards and writes a
+`manifest.json`. Each worker claims a shard by creating its `.lease` file
+exclusively and keeps it alive by touching it every few seconds; a lease not
+touched for `lease_seconds` has expired and can be claimed by anyone. A worker
+whose lease is taken over stops its shard at once. Shard journals and results
+live in the shared directory, so a reclaimed shard resumes where the last owner
+stopped. When every shard is done, `merge` joins the results in shard order into
+one export CSV and one `log/datacite_export_*.csv` entry.
+
+Leases compare file times with the local clock, so the hosts' clocks must agree
+to well within `lease_seconds`.
+"""
+import csv
+import itertools
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+
+from super_duper.compression import compression_for, open_binary, open_text
+from super_duper.jobs import Cancelled
+from super_duper.logs import auto_compress_logs, export_log_path, run_timestamp
+
+MANIFEST_FILE = "manifest.json"
+MERGED_FILE = "merged.json"
+DEFAULT_LEASE_SECONDS = 120
+
+
+def shard_stem(shard_dir, index):
+    return os.path.join(shard_dir, f"shard-{index:04d}")
+
+
+def worker_id():
+    """Who holds a lease: host, process and a random tag, unique across hosts and restarts."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def read_manifest(shard_dir):
+    with open(os.path.join(shard_dir, MANIFEST_FILE), "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def write_json(path, data):
+    """Write aside and rename, so readers on other hosts never see half a file."""
+    with open(f"{path}.part", "w", encoding="utf-8") as file:
+        json.dump(data, file, indent=2)
+    os.replace(f"{path}.part", path)
+
+
+def import_rows(source, batch):
+    """(header, rows) of an import CSV, or (None, payload lines) of a batch, streamed from disk."""
+    if batch:
+        file = open_binary(source, "rb")
+        return None, (line for line in closing_after(file) if line.strip())
+    file = open_text(source, "r", newline="")
+    reader = csv.reader(closing_after(file))
+    return next(reader, []), reader
+
+
+def closing_after(file):
+    with file:
+        yield from file
+
+
+def split_import(source, shard_dir, shards):
+    """
+    Cut an import CSV or payload batch (compressed or not) into `shards` contiguous shards
+    of near-equal size under `shard_dir`. Returns the manifest.
+    """
+    from super_duper.mint import is_payload_batch
+
+    os.makedirs(shard_dir, exist_ok=True)
+    if os.path.exists(os.path.join(shard_dir, MANIFEST_FILE)):
+        raise ValueError(f"{shard_dir} already holds a sharded run")
+    batch = is_payload_batch(source)
+    extension = ".jsonl" if batch else ".csv"
+
+    total = sum(1 for _ in import_rows(source, batch)[1])
+    shards = max(1, min(shards, total or 1))
+    sizes = [total // shards + (1 if i < total % shards else 0) for i in range(shards)]
+
+    entries = []
+    first_row = 1
+    header, rows = import_rows(source, batch)
+    for index, size in enumerate(sizes):
+        path = shard_stem(shard_dir, index) + extension
+        chunk = itertools.islice(rows, size)
+        if batch:
+            with open(path, "wb") as out:
+                out.writelines(chunk)
+        else:
+            with open(path, "w", encoding="utf-8", newline="") as out:
+                writer = csv.writer(out)
+                writer.writerow(header)
+                writer.writerows(chunk)
+        entries.append({"index": index, "file": os.path.basename(path), "first_row": first_row, "rows": size})
+        first_row += size
+
+    manifest = {"source": os.path.abspath(source), "rows": total, "shards": entries,
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    write_json(os.path.join(shard_dir, MANIFEST_FILE), manifest)
+    return manifest
+
+
+class ShardLease:
+    """
+    An exclusive claim on one shard, kept alive by a heartbeat thread.
+
+    `lost` is set if another worker takes the lease over (it expired, e.g. after a long
+    pause here) and `cancel` once either that happens or the outer `cancel` is set, so
+    it can be handed to run_mint as its cancel event.
+    """
+
+    def __init__(self, path, owner, lease_seconds=DEFAULT_LEASE_SECONDS, cancel=None):
+        self.path = path
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self.outer_cancel = cancel
+        self.cancel = threading.Event()
+        self.lost = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def claim(self):
+        """Take the lease if it is free or has expired. True if it is now ours."""
+        for _ in range(2):
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if not self.reclaim_expired():
+                    return False
+                continue
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                json.dump({"owner": self.owner, "claimed": time.time()}, file)
+            return True
+        return False
+
+    def reclaim_expired(self):
+        """Move an expired lease out of the way; only one of several racing workers succeeds."""
+        try:
+            if time.time() - os.stat(self.path).st_mtime < self.lease_seconds:
+                return False
+            aside = f"{self.path}.expired.{uuid.uuid4().hex[:8]}"
+            os.rename(self.path, aside)
+        except FileNotFoundError:
+            return False
+        if time.time() - os.stat(aside).st_mtime < self.lease_seconds:
+            # Someone else reclaimed it between our stat and rename: put their live lease back
+            try:
+                os.link(aside, self.path)
+            except FileExistsError:
+                pass
+            os.unlink(aside)
+            return False
+        os.unlink(aside)
+        return True
+
+    def holder(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                return json.load(file).get("owner")
+        except (OSError, ValueError):
+            return None
+
+    def held(self):
+        """Still ours and not yet expired, so nobody else can have taken it over."""
+        if self.lost.is_set() or self.holder() != self.owner:
+            return False
+        try:
+            return time.time() - os.stat(self.path).st_mtime < self.lease_seconds
+        except FileNotFoundError:
+            return False
+
+    def start(self):
+        self.thread = threading.Thread(target=self.heartbeat, name=f"lease-{os.path.basename(self.path)}", daemon=True)
+        self.thread.start()
+        return self
+
+    def heartbeat(self):
+        interval = max(1.0, self.lease_seconds / 4)
+        last_touch = time.monotonic()
+        while not self.stopped.wait(1.0):
+            if self.outer_cancel is not None and self.outer_cancel.is_set():
+                self.cancel.set()
+            if time.monotonic() - last_touch < interval:
+                continue
+            if self.holder() != self.owner:
+                self.lost.set()
+                self.cancel.set()
+                return
+            try:
+                os.utime(self.path)
+            except FileNotFoundError:
+                self.lost.set()
+                self.cancel.set()
+                return
+            last_touch = time.monotonic()
+
+    def release(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        if not self.lost.is_set() and self.holder() == self.owner:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+
+def shard_status(shard_dir, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """[(index, state, detail)] with state done, leased, expired or pending."""
+    statuses = []
+    for entry in read_manifest(shard_dir)["shards"]:
+        stem = shard_stem(shard_dir, entry["index"])
+        if os.path.exists(f"{stem}.done"):
+            with open(f"{stem}.done", "r", encoding="utf-8") as file:
+                done = json.load(file)
+            statuses.append((entry["index"], "done", f"{done['successful']}/{done['total']} by {done['owner']}"))
+            continue
+        try:
+            age = time.time() - os.stat(f"{stem}.lease").st_mtime
+        except FileNotFoundError:
+            statuses.append((entry["index"], "pending", f"{entry['rows']} rows"))
+            continue
+        holder = ShardLease(f"{stem}.lease", None).holder()
+        state = "leased" if age < lease_seconds else "expired"
+        statuses.append((entry["index"], state, f"{holder}, heartbeat {age:.0f}s ago"))
+    return statuses
+
+
+def work_shards(shard_dir, credentials, concurrency=4, rate_limit=10, lease_seconds=DEFAULT_LEASE_SECONDS,
+                owner=None, log=None, cancel=None, retry_policy=None, registry=None, metrics=None):
+    """
+    Claim and mint shards until none is left unclaimed, then return the shards this
+    worker finished. A shard whose lease is lost mid-run is left to its new owner:
+    results are written to a file of this worker's own and only renamed into place,
+    and the shard marked done, while the lease is still held.
+    `registry`, `retry_policy` and `metrics` are passed on to run_mint; once `cancel`
+    is set the current shard stops (its journal keeps what was sent) and Cancelled is raised.
+    """
+    from super_duper.mint import run_mint
+
+    log = log or (lambda message: None)
+    owner = owner or worker_id()
+    manifest = read_manifest(shard_dir)
+    finished = []
+
+    while True:
+        claimed = None
+        for entry in manifest["shards"]:
+            stem = shard_stem(shard_dir, entry["index"])
+            if os.path.exists(f"{stem}.done"):
+                continue
+            lease = ShardLease(f"{stem}.lease", owner, lease_seconds, cancel)
+            if lease.claim():
+                claimed = (entry, stem, lease)
+                break
+        if claimed is None:
+            return finished
+
+        entry, stem, lease = claimed
+        log(f"Shard {entry['index']} (rows {entry['first_row']}-{entry['first_row'] + entry['rows'] - 1}) claimed by {owner}.")
+        own_export = f"{stem}.export.{uuid.uuid4().hex[:8]}.csv"
+        lease.start()
+        try:
+            summary = run_mint(
+                os.path.join(shard_dir, entry["file"]),
+                own_export,
+                credentials,
+                concurrency=concurrency,
+                rate_limit=rate_limit,
+                # A shard picked up from an expired lease carries on from its journal
+                resume=True,
+                log_copy=False,
+                log=log,
+                cancel=lease.cancel,
+                retry_policy=retry_policy,
+                registry=registry,
+                journal_path=f"{stem}.journal.jsonl",
+                metrics=metrics,
+            )
+        except Cancelled:
+            lease.release()
+            remove_file(own_export)
+            if lease.lost.is_set():
+                log(f"Lost the lease on shard {entry['index']}; another worker has taken it over.")
+                continue
+            raise
+        except BaseException:
+            lease.release()
+            remove_file(own_export)
+            raise
+        if not lease.held():
+            # Lost just as the run finished: the new owner writes the results
+            lease.release()
+            remove_file(own_export)
+            log(f"Lost the lease on shard {entry['index']}; another worker has taken it over.")
+            continue
+        os.replace(own_export, f"{stem}.export.csv")
+        write_json(f"{stem}.done", {
+            "owner": owner,
+            "total": summary["total"],
+            "successful": summary["successful"],
+            "retryable": summary["retryable"],
+            "finished": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        })
+        lease.release()
+        finished.append(entry["index"])
+        if metrics is not None:
+            metrics.count("shards_finished_total")
+        log(f"Shard {entry['index']} done: {summary['successful']}/{summary['total']} DOIs.")
+
+
+def remove_file(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def merge_shard_results(shard_dir, output_csv, log_copy=True, log=None):
+    """
+    Join every shard's export, in shard order, into `output_csv`, and (once per sharded
+    run) copy it to a `log/datacite_export_*.csv` entry for the statistics.
+    Returns a dict with total and successful counts and the paths written.
+    """
+    from super_duper.records import read_export_rows, write_export_rows
+
+    log = log or (lambda message: None)
+    manifest = read_manifest(shard_dir)
+    unfinished = [entry["index"] for entry in manifest["shards"]
+                  if not os.path.exists(f"{shard_stem(shard_dir, entry['index'])}.done")]
+    if unfinished:
+        raise ValueError(f"{len(unfinished)} shards are not done yet: {', '.join(map(str, unfinished[:20]))}")
+
+    partial = f"{output_csv}.part"
+    compression = compression_for(output_csv)
+    counts = {"total": 0, "successful": 0}
+
+    def shard_results():
+        for entry in manifest["shards"]:
+            with open(f"{shard_stem(shard_dir, entry['index'])}.export.csv", "r", encoding="utf-8", newline="") as file:
+                for result in read_export_rows(file):
+                    counts["total"] += 1
+                    counts["successful"] += result.status == "201"
+                    yield result
+
+    with open_text(partial, "w", newline="", compression=compression) as output_file:
+        write_export_rows(output_file, shard_results())
+    os.replace(partial, output_csv)
+
+    log_file_path = None
+    merged_marker = os.path.join(shard_dir, MERGED_FILE)
+    if log_copy:
+        if os.path.exists(merged_marker):
+            with open(merged_marker, "r", encoding="utf-8") as file:
+                log_file_path = json.load(file)["log_file"]
+            log(f"This run was already logged as {log_file_path}; not logging it again.")
+        else:
+            log_file_path = export_log_path(run_timestamp())
+            os.makedirs(os.path.dirname(log_file_path), exist_ok=True)
+            # Logs start out uncompressed, whatever the output is
+            with open_binary(output_csv, "rb") as source, open(log_file_path, "wb") as copy:
+                shutil.copyfileobj(source, copy, 1024 * 1024)
+            write_json(merged_marker, {"log_file": log_file_path, "output": os.path.abspath(output_csv)})
+            auto_compress_logs(os.path.dirname(log_file_path), log=log)
+
+    return {**counts, "output_path": output_csv, "log_file_path": log_file_path}
@@ -0,0 +1,149 @@
+"""
+DOI statistics from the `log/datacite_export_*.csv` copies of every mint run,
+compressed (`.csv.gz`, `.csv.zst`) or not.
+
+Each log file is summarised once into `log/.stats_index.json`, keyed by file name
+and checked against its size and mtime, so refreshing the statistics only reads
+files that are new or have changed since the last time.
+"""
+import csv
+import json
+import os
+import re
+from datetime import datetime
+
+from super_duper.compression import has_extension, open_text
+from super_duper.logs import EXPORT_LOG_PREFIX, log_dir
+
+STATS_INDEX_FILE = ".stats_index.json"
+STATS_INDEX_VERSION = 1
+
+DOI_URL_PREFIX = "https://doi.org/"
+
+# datacite_export_YYYYMMDD_HHMMSS[_n].csv
+_RUN_DATE = re.compile(re.escape(EXPORT_LOG_PREFIX) + r"(\d{4})(\d{2})(\d{2})_")
+
+
+def doi_prefix(doi_url):
+    """'https://doi.org/10.83129/car2-qq43' -> '10.83129'."""
+    registrant = doi_url[len(DOI_URL_PREFIX):].split("/", 1)[0]
+    return ".".join(registrant.split(".")[:2])
+
+
+def run_day(filename, mtime):
+    """The day a mint run happened: from the log file name, else its modification time."""
+    m = _RUN_DATE.match(filename)
+    if m:
+        return f"{m.group(1)}-{m.group(2)}-{m.group(3)}"
+    return datetime.fromtimestamp(mtime).strftime("%Y-%m-%d")
+
+
+def summarize_log_file(path, filename, mtime):
+    """Per-prefix 201 counts and per-status row counts for one log file."""
+    prefixes = {}
+    statuses = {}
+    with open_text(path, 'r') as csvfile:
+        reader = csv.DictReader(csvfile)
+        for row in reader:
+            status = row.get('status') or ""
+            statuses[status] = statuses.get(status, 0) + 1
+            # Only count successfully created DOIs (status 201)
+            doi = row.get('doi')
+            if status == '201' and doi and doi.startswith(DOI_URL_PREFIX):
+                prefix = doi_prefix(doi)
+                prefixes[prefix] = prefixes.get(prefix, 0) + 1
+    return {"day": run_day(filename, mtime), "prefixes": prefixes, "statuses": statuses}
+
+
+def load_stats_index(path):
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            index = json.load(file)
+        if index.get("version") == STATS_INDEX_VERSION:
+            return index["files"]
+    except (OSError, ValueError, KeyError, AttributeError):
+        pass
+    return {}
+
+
+def save_stats_index(path, files):
+    partial = f"{path}.part"
+    with open(partial, "w", encoding="utf-8") as file:
+        json.dump({"version": STATS_INDEX_VERSION, "files": files}, file)
+    os.replace(partial, path)
+
+
+def update_stats_index(directory=None, log=None, metrics=None):
+    """
+    Bring the index up to date with the log directory and return its per-file entries.
+
+    Only new or changed log files are read; files that have gone are dropped. A file
+    that can't be read is reported through `log(message)` and left out. `metrics`
+    (a Metrics) gets how many files were reused from the index and how many were read.
+    """
+    directory = directory or log_dir()
+    if not os.path.exists(directory):
+        return {}
+
+    index_path = os.path.join(directory, STATS_INDEX_FILE)
+    indexed = load_stats_index(index_path)
+    files = {}
+    changed = False
+
+    for entry in os.scandir(directory):
+        filename = entry.name
+        if not (filename.startswith(EXPORT_LOG_PREFIX) and has_extension(filename, ".csv")):
+            continue
+        stat = entry.stat()
+        cached = indexed.get(filename)
+        if cached and cached["size"] == stat.st_size and cached["mtime_ns"] == stat.st_mtime_ns:
+            files[filename] = cached
+            if metrics is not None:
+                metrics.count("stats_files_total", result="cached")
+            continue
+        try:
+            summary = summarize_log_file(entry.path, filename, stat.st_mtime)
+        except Exception as e:
+            if log:
+                log(f"Error reading file {filename}: {str(e)}")
+            if metrics is not None:
+                metrics.count("stats_files_total", result="error")
+            continue
+        files[filename] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, **summary}
+        if metrics is not None:
+            metrics.count("stats_files_total", result="read")
+            metrics.count("stats_rows_read_total", sum(summary["statuses"].values()))
+        changed = True
+
+    if changed or files.keys() != indexed.keys():
+        try:
+            save_stats_index(index_path, files)
+        except OSError as e:
+            # Statistics still work, they just can't be cached for next time
+            if log:
+                log(f"Could not save statistics index: {str(e)}")
+    return files
+
+
+def collect_doi_stats(directory=None, log=None, metrics=None):
+    """
+    Totals across every mint log: created DOIs by prefix, by day and by month, and
+    rows by response status (all statuses, not just 201).
+    """
+    stats = {"by_prefix": {}, "by_day": {}, "by_month": {}, "by_status": {}}
+    for entry in update_stats_index(directory, log, metrics).values():
+        created = sum(entry["prefixes"].values())
+        for prefix, count in entry["prefixes"].items():
+            stats["by_prefix"][prefix] = stats["by_prefix"].get(prefix, 0) + count
+        for status, count in entry["statuses"].items():
+            stats["by_status"][status] = stats["by_status"].get(status, 0) + count
+        if created:
+            day = entry["day"]
+            stats["by_day"][day] = stats["by_day"].get(day, 0) + created
+            stats["by_month"][day[:7]] = stats["by_month"].get(day[:7], 0) + created
+    return stats
+
+
+def count_dois_by_prefix(directory=None, log=None):
+    """Cumulative count of successfully created DOIs (status 201) per DOI prefix."""
+    return collect_doi_stats(directory, log)["by_prefix"]
@@ -0,0 +1,44 @@
+import os
+
+import pytest
+
+from super_duper.mint import read_datacite_import
+from super_duper.mockapi import MockDataCite
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+
+def sample_path(name):
+    """One of the `*.sample` files at the top of the repository."""
+    return os.path.join(REPO_DIR, name)
+
+
+def import_records():
+    """The DoiRecords of `datacite_import.csv.sample` that DataCite accepts (row 3 has no handle URL)."""
+    return [doi for doi in read_datacite_import(sample_path("datacite_import.csv.sample")) if doi.source]
+
+
+@pytest.fixture(autouse=True)
+def working_dir(tmp_path, monkeypatch):
+    """Runs keep their `log/` under the current directory; keep it out of the checkout."""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def datacite():
+    """
+    datacite(**options) starts a MockDataCite on a free port and returns it with a
+    credentials dict pointing at it; every one started is stopped after the test.
+    """
+    started = []
+
+    def start(**options):
+        mock = MockDataCite(port=0, username="user", password="secret", **options).start()
+        started.append(mock)
+        return mock, {"url": mock.url, "doiPrefix": "10.5555", "username": "user", "password": "secret"}
+
+    yield start
+    for mock in started:
+        mock.stop()
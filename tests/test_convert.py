@@ -0,0 +1,156 @@
+import csv
+import gzip
+import io
+import os
+import shutil
+import threading
+
+import pytest
+
+from conftest import DATA_DIR, sample_path
+from super_duper.compression import open_binary
+from super_duper.convert import (
+    convert_dspace_rows, load_type_mapping, process_csv, process_csv_batch, read_dspace_rows,
+)
+from super_duper.jobs import Cancelled
+from super_duper.records import creator_groups, import_fields
+
+DSPACE_CSV = sample_path("dspace_export.csv.sample")
+# What the converter wrote for dspace_export.csv.sample before it moved into super_duper
+EXPECTED_CSV = os.path.join(DATA_DIR, "datacite_import.expected.csv")
+
+
+@pytest.fixture(scope="module")
+def type_mapping():
+    return load_type_mapping(sample_path("type_mapping.json"))
+
+
+def expected_bytes():
+    with open(EXPECTED_CSV, "rb") as file:
+        return file.read()
+
+
+def read_bytes(path):
+    with open_binary(path) as file:
+        return file.read()
+
+
+# Contributors per row: the widest row comes late, after narrower and wider ones
+CONTRIBUTORS = [1, 0, 2, 3, 1, 2, 5, 1, 0, 4, 2, 7, 1, 1, 2, 3, 6, 1]
+
+
+def write_contributors_export(path):
+    """A DSpace export whose rows have CONTRIBUTORS[i] authors each, one with a multi-line abstract."""
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["id", "dc.title[en]", "dc.contributor.author[en]", "dc.description.abstract[en]",
+                         "dc.date.issued[]", "dc.identifier.uri[]"])
+        for i, count in enumerate(CONTRIBUTORS):
+            authors = "||".join(f"Family{i}_{n}, Given {n}" for n in range(count))
+            abstract = "First line, with a comma\nsecond line" if i == 2 else f"Item {i}"
+            writer.writerow([str(i), f"Item {i}", authors, abstract, "2001", f"http://hdl.handle.net/10613/{i}"])
+
+
+def full_width_csv(dspace_csv, type_mapping):
+    """The expected conversion, every row written at the widest row's width from the start."""
+    with open(dspace_csv, "r", encoding="utf-8", newline="") as file:
+        plan, rows = read_dspace_rows(file)
+        records = list(convert_dspace_rows(rows, plan, type_mapping))
+    groups = max(len(record.creators) for record in records)
+    buffer = io.StringIO(newline="")
+    writer = csv.writer(buffer)
+    writer.writerow(import_fields(groups))
+    writer.writerows(record.csv_row(groups) for record in records)
+    return buffer.getvalue().encode("utf-8")
+
+
+def test_serial_output_matches_the_original_converter(type_mapping, working_dir):
+    output = str(working_dir / "DataciteImport.csv")
+    assert process_csv(DSPACE_CSV, output, type_mapping) == (5, 5)
+    assert read_bytes(output) == expected_bytes()
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 1000])
+def test_parallel_output_matches_the_serial_one(type_mapping, working_dir, chunk_size):
+    output = str(working_dir / "DataciteImport.csv")
+    assert process_csv(DSPACE_CSV, output, type_mapping, workers=2, chunk_size=chunk_size) == (5, 5)
+    assert read_bytes(output) == expected_bytes()
+
+
+@pytest.mark.parametrize("suffix", [".gz", ".zst"])
+def test_compressed_input_and_output(type_mapping, working_dir, suffix):
+    if suffix == ".zst":
+        pytest.importorskip("zstandard")
+    compressed_input = str(working_dir / f"export.csv{suffix}")
+    with open(DSPACE_CSV, "rb") as source, open_binary(compressed_input, "wb") as target:
+        shutil.copyfileobj(source, target)
+    output = str(working_dir / f"DataciteImport.csv{suffix}")
+    process_csv(compressed_input, output, type_mapping)
+    assert read_bytes(output) == expected_bytes()
+    if suffix == ".gz":
+        with gzip.open(output, "rb") as file:
+            assert file.read() == expected_bytes()
+
+
+def test_batch_combines_files_in_input_order(type_mapping, working_dir):
+    second = str(working_dir / "second.csv")
+    shutil.copyfile(DSPACE_CSV, second)
+    output = str(working_dir / "DataciteImport.csv")
+    results = process_csv_batch([DSPACE_CSV, second], output, type_mapping)
+    assert [result["status"] for result in results] == ["converted", "converted"]
+    header, rows = expected_bytes().split(b"\r\n", 1)
+    assert read_bytes(output) == header + b"\r\n" + rows + rows
+
+
+@pytest.mark.parametrize("options", [{}, {"workers": 2, "chunk_size": 1}, {"workers": 2, "chunk_size": 3}])
+@pytest.mark.parametrize("suffix", ["", ".gz"])
+def test_creator_groups_widen_to_the_most_contributed_row(type_mapping, working_dir, options, suffix):
+    dspace_csv = str(working_dir / "export.csv")
+    write_contributors_export(dspace_csv)
+    output = str(working_dir / f"DataciteImport.csv{suffix}")
+    assert process_csv(dspace_csv, output, type_mapping, **options) == (len(CONTRIBUTORS), len(CONTRIBUTORS))
+    assert read_bytes(output) == full_width_csv(dspace_csv, type_mapping)
+    assert not os.path.exists(f"{output}.part.wide")
+
+
+def test_progress_and_cancel_work_from_the_first_row(type_mapping, working_dir):
+    dspace_csv = str(working_dir / "export.csv")
+    write_contributors_export(dspace_csv)
+    output = str(working_dir / "DataciteImport.csv")
+    cancel = threading.Event()
+    seen = []
+
+    def progress(done, total):
+        seen.append(done)
+        if done == 8:
+            cancel.set()
+
+    with pytest.raises(Cancelled):
+        process_csv(dspace_csv, output, type_mapping, progress=progress, cancel=cancel)
+    assert seen[:2] == [1, 2]
+    with open(output, "r", encoding="utf-8", newline="") as file:
+        rows = list(csv.reader(file))
+    # The rows before the cancel, all as wide as the widest of them (5 authors)
+    assert len(rows) == 1 + 8
+    assert {creator_groups(row) for row in rows} == {5}
+
+
+@pytest.mark.parametrize("combine", [True, False])
+def test_batch_with_workers_matches_one_file_at_a_time(type_mapping, working_dir, combine):
+    wide = str(working_dir / "wide.csv")
+    write_contributors_export(wide)
+    copy = str(working_dir / "copy.csv")
+    shutil.copyfile(DSPACE_CSV, copy)
+    inputs = [DSPACE_CSV, wide, copy]
+    outputs = {}
+    for workers in (1, 2):
+        out_dir = working_dir / f"workers{workers}"
+        out_dir.mkdir()
+        results = process_csv_batch(inputs, str(out_dir / "DataciteImport.csv"), type_mapping,
+                                    combine=combine, workers=workers)
+        counts = [(result["status"], result["input_rows"], result["output_rows"]) for result in results]
+        files = sorted(os.listdir(out_dir))
+        outputs[workers] = (counts, files, [read_bytes(str(out_dir / name)) for name in files])
+    assert outputs[2] == outputs[1]
+    assert outputs[1][0] == [("converted", 5, 5), ("converted", len(CONTRIBUTORS), len(CONTRIBUTORS)),
+                             ("converted", 5, 5)]
@@ -0,0 +1,90 @@
+import os
+import time
+
+import pytest
+import requests
+
+import super_duper.downloads as downloads
+from super_duper.downloads import DownloadServer, unreachable_warning
+
+
+@pytest.fixture
+def server():
+    server = DownloadServer(ttl=60).start()
+    yield server
+    server.stop()
+
+
+def output_file(directory, name="out.csv", content=b"title,source\r\nA,http://hdl.handle.net/10613/1\r\n"):
+    path = directory / name
+    path.write_bytes(content)
+    return str(path)
+
+
+def fetch(server, token, filename=None):
+    path = server.url_path(token) if filename is None else f"/download/{token}/{filename}"
+    return requests.get(f"http://127.0.0.1:{server.port}{path}", timeout=5)
+
+
+def test_a_download_is_served_at_its_exact_link_only(server, tmp_path):
+    path = output_file(tmp_path)
+    token = server.register(path, "DataciteExport.csv", job="mint")
+    response = fetch(server, token)
+    assert response.status_code == 200
+    assert response.content == b"title,source\r\nA,http://hdl.handle.net/10613/1\r\n"
+    assert response.headers["Content-Type"] == "text/csv; charset=utf-8"
+    assert fetch(server, token, "other.csv").status_code == 404
+    assert fetch(server, token[:-1], "DataciteExport.csv").status_code == 404
+    # Still there for a retry
+    assert fetch(server, token).status_code == 200
+
+
+def test_compressed_downloads_keep_their_encoding(server, tmp_path):
+    token = server.register(output_file(tmp_path, "out.csv.gz", b"\x1f\x8b"), "DataciteExport.csv.gz")
+    response = fetch(server, token)
+    assert response.headers["Content-Type"] == "application/gzip"
+    assert "Content-Encoding" not in response.headers
+    assert response.content == b"\x1f\x8b"
+
+
+def test_an_expired_token_is_refused_and_its_file_deleted(tmp_path):
+    server = DownloadServer(ttl=0.2).start()
+    try:
+        path = output_file(tmp_path)
+        token = server.register(path, "DataciteExport.csv")
+        time.sleep(0.3)
+        assert fetch(server, token).status_code == 410
+        assert os.path.exists(path)
+        server.sweep()
+        assert not os.path.exists(path)
+        assert fetch(server, token).status_code == 404
+    finally:
+        server.stop()
+
+
+def test_a_newer_output_of_the_same_job_replaces_the_old_one(server, tmp_path):
+    first = output_file(tmp_path, "first.csv")
+    second = output_file(tmp_path, "second.csv")
+    old = server.register(first, "DataciteExport.csv", job="mint")
+    server.register(second, "DataciteExport.csv", job="mint")
+    assert not os.path.exists(first)
+    assert fetch(server, old).status_code == 404
+    assert os.path.exists(second)
+
+
+def test_stopping_deletes_files_still_registered(tmp_path):
+    server = DownloadServer().start()
+    path = output_file(tmp_path)
+    server.register(path, "DataciteExport.csv")
+    server.stop()
+    assert not os.path.exists(path)
+
+
+def test_loopback_server_warns_about_pages_from_other_hosts(server, monkeypatch):
+    monkeypatch.setattr(downloads, "_server", server)
+    monkeypatch.delenv("SUPER_DUPER_DOWNLOAD_URL", raising=False)
+    assert unreachable_warning("http://127.0.0.1:8550/") is None
+    assert unreachable_warning("http://localhost:8550/") is None
+    assert "SUPER_DUPER_DOWNLOAD_HOST" in unreachable_warning("http://dois.example.org:8550/")
+    monkeypatch.setenv("SUPER_DUPER_DOWNLOAD_URL", "https://dois.example.org/files")
+    assert unreachable_warning("http://dois.example.org:8550/") is None
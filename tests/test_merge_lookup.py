@@ -0,0 +1,99 @@
+import csv
+import os
+
+import pytest
+
+from conftest import sample_path
+from super_duper.merge import DoiLookup, load_doi_lookup, merge_dois
+from super_duper.metrics import Metrics
+
+PAIRS = [(f"http://hdl.handle.net/10613/{n}", f"https://doi.org/10.5555/{n}") for n in range(10)]
+
+
+def test_lookup_stays_in_memory_while_small():
+    with DoiLookup(max_in_memory=10) as lookup:
+        lookup.add_many(PAIRS)
+        assert not lookup.spilled
+        assert lookup.get(PAIRS[3][0]) == PAIRS[3][1]
+
+
+def test_lookup_spills_to_disk_and_answers_the_same():
+    with DoiLookup(max_in_memory=4) as lookup:
+        lookup.add_many(PAIRS[:3])
+        assert not lookup.spilled
+        lookup.add_many(PAIRS[3:])
+        assert lookup.spilled
+        db_path = lookup.db_path
+        assert len(lookup) == len(PAIRS)
+        assert all(lookup.get(source) == doi for source, doi in PAIRS)
+        assert lookup.get("http://hdl.handle.net/10613/missing") is None
+        # As with a dict, a source listed again keeps its last DOI
+        lookup.add_many([(PAIRS[0][0], "https://doi.org/10.5555/again")])
+        assert lookup.get(PAIRS[0][0]) == "https://doi.org/10.5555/again"
+    assert not os.path.exists(db_path)
+
+
+def test_load_doi_lookup_spills_a_big_export():
+    with load_doi_lookup(sample_path("datacite_export.csv.sample"), max_in_memory=1, batch_size=2) as lookup:
+        assert lookup.spilled
+        assert lookup.get("http://hdl.handle.net/10613/1955") == "https://doi.org/10.83129/car2-qq43"
+
+
+def test_spilled_merge_writes_the_same_output(working_dir):
+    in_memory = str(working_dir / "in_memory.csv")
+    spilled = str(working_dir / "spilled.csv")
+    metrics = Metrics("merge")
+    merge_dois(sample_path("datacite_export.csv.sample"), sample_path("dspace_export.csv.sample"), in_memory)
+    summary = merge_dois(sample_path("datacite_export.csv.sample"), sample_path("dspace_export.csv.sample"), spilled,
+                         max_in_memory=1, metrics=metrics)
+    assert summary["dois_added"] == 4
+    assert metrics.gauges["merge_export_spilled_to_disk"] == 1
+    assert metrics.gauges["merge_from_registry"] == 0
+    with open(in_memory, "rb") as expected, open(spilled, "rb") as actual:
+        assert actual.read() == expected.read()
+
+
+HANDLE = "http://hdl.handle.net/10613/{}"
+DOI = "https://doi.org/10.5555/{}"
+
+
+def write_csv(path, rows):
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        csv.writer(file).writerows(rows)
+
+
+@pytest.mark.parametrize("max_in_memory", [1000, 1])
+def test_each_uri_of_a_multi_valued_cell_is_looked_up(working_dir, max_in_memory):
+    export = str(working_dir / "export.csv")
+    write_csv(export, [
+        ["title", "source", "doi", "status", "error_message", "error_type"],
+        ["Second only", HANDLE.format(2), DOI.format("b"), "201", "", ""],
+        ["Both", HANDLE.format(3), DOI.format("c"), "201", "", ""],
+        ["Both", HANDLE.format(4), DOI.format("d"), "201", "", ""],
+        ["Same DOI", HANDLE.format(5), DOI.format("e"), "201", "", ""],
+        ["Same DOI", HANDLE.format(6), DOI.format("e"), "201", "", ""],
+    ])
+    dspace = str(working_dir / "dspace.csv")
+    write_csv(dspace, [
+        ["id", "dc.identifier.uri[]", "dc.title[en]"],
+        ["a", f"{HANDLE.format(1)}||{HANDLE.format(2)}", "Second only"],
+        ["b", f"{HANDLE.format(3)}||{HANDLE.format(4)}", "Both"],
+        ["c", f"{HANDLE.format(5)}||{HANDLE.format(6)}", "Same DOI"],
+        ["d", f"{HANDLE.format(7)}||{HANDLE.format(8)}", "Neither"],
+    ])
+    output = str(working_dir / "updated.csv")
+    metrics = Metrics("merge")
+    summary = merge_dois(export, dspace, output, max_in_memory=max_in_memory, metrics=metrics)
+    assert metrics.gauges["merge_export_spilled_to_disk"] == int(max_in_memory == 1)
+
+    with open(output, "r", encoding="utf-8", newline="") as file:
+        rows = list(csv.reader(file))
+    # One output row per input row, each with its DOIs appended once
+    assert [row[0] for row in rows] == ["id", "a", "b", "c", "d"]
+    assert [row[1] for row in rows[1:]] == [
+        f"{HANDLE.format(1)}||{HANDLE.format(2)}||{DOI.format('b')}",
+        f"{HANDLE.format(3)}||{HANDLE.format(4)}||{DOI.format('c')}||{DOI.format('d')}",
+        f"{HANDLE.format(5)}||{HANDLE.format(6)}||{DOI.format('e')}",
+        f"{HANDLE.format(7)}||{HANDLE.format(8)}",
+    ]
+    assert (summary["dois_added"], summary["rows_unmatched"]) == (4, 1)
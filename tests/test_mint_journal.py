@@ -0,0 +1,79 @@
+import csv
+
+from conftest import sample_path
+from super_duper.mint import MintJournal, RetryPolicy, read_journal, run_mint
+from super_duper.records import MintResult
+
+IMPORT_CSV = sample_path("datacite_import.csv.sample")
+
+
+def export_rows(path):
+    with open(path, "r", encoding="utf-8", newline="") as file:
+        return list(csv.DictReader(file))
+
+
+def import_sources():
+    with open(IMPORT_CSV, "r", encoding="utf-8", newline="") as file:
+        return [row["source"] for row in csv.DictReader(file)]
+
+
+def test_resume_skips_rows_that_have_dois(datacite, working_dir):
+    mock, credentials = datacite()
+    output = str(working_dir / "export.csv")
+    run_mint(IMPORT_CSV, output, credentials, only_rows={2, 4}, log_copy=False)
+    first = {row["source"]: row["doi"] for row in export_rows(output)}
+
+    summary = run_mint(IMPORT_CSV, output, credentials, resume=True, log_copy=False)
+    assert summary["submitted"] == 3
+    assert summary["total"] == 5
+    # Rows 2 and 4 kept the DOIs of the first run; row 3 has no handle URL and is rejected
+    assert mock.counts == {201: 4, 422: 1}
+    rows = export_rows(output)
+    assert {row["source"]: row["doi"] for row in rows if row["source"] in first} == first
+
+
+def test_output_is_in_input_order(datacite, working_dir):
+    _, credentials = datacite(latency="uniform:0-80", seed=3)
+    output = str(working_dir / "export.csv")
+    run_mint(IMPORT_CSV, output, credentials, concurrency=4, log_copy=False)
+    assert [row["source"] for row in export_rows(output)] == import_sources()
+
+
+def test_resume_sends_rows_that_failed_again(datacite, working_dir):
+    _, failing = datacite(error_rate=1.0)
+    output = str(working_dir / "export.csv")
+    summary = run_mint(IMPORT_CSV, output, failing, retry_policy=RetryPolicy(max_attempts=1), log_copy=False)
+    assert summary["retryable"] == 5
+
+    mock, credentials = datacite()
+    summary = run_mint(IMPORT_CSV, output, credentials, resume=True, log_copy=False)
+    assert summary["submitted"] == 5
+    assert summary["successful"] == 4
+    assert [row["source"] for row in export_rows(output)] == import_sources()
+
+
+def test_log_copy_only_gets_rows_no_earlier_log_has(datacite, working_dir):
+    _, credentials = datacite()
+    output = str(working_dir / "export.csv")
+    first = run_mint(IMPORT_CSV, output, credentials, only_rows={1, 2})
+    second = run_mint(IMPORT_CSV, output, credentials, resume=True)
+    assert len(export_rows(first["log_file_path"])) == 2
+    assert len(export_rows(second["log_file_path"])) == 3
+    assert len(export_rows(output)) == 5
+
+
+def test_a_torn_last_line_is_ignored_and_not_continued(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = MintJournal(path)
+    journal.record(1, MintResult("One", "http://hdl.handle.net/10613/1", "https://doi.org/10.5555/a", 201))
+    journal.close()
+    with open(path, "ab") as file:
+        file.write(b'{"row": 2, "title": "Tw')
+
+    journal = MintJournal(path)
+    journal.record(3, MintResult("Three", "http://hdl.handle.net/10613/3", None, 503, "Unavailable", "retryable"))
+    journal.close()
+    entries = read_journal(path)
+    assert sorted(entries) == [1, 3]
+    assert entries[1].doi == "https://doi.org/10.5555/a"
+    assert entries[3].error_type == "retryable"
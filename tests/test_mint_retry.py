@@ -0,0 +1,103 @@
+import socket
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+from conftest import import_records, sample_path
+from super_duper.mint import RetryPolicy, mint_dois, parse_retry_after, run_mint
+
+
+def mint(credentials, dois, **options):
+    """Every (body, response, result) mint_dois yields, as a list."""
+    auth = (credentials["username"], credentials["password"])
+    return list(mint_dois(dois, credentials["url"], credentials["doiPrefix"], auth, **options))
+
+
+def closed_port_url():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    return f"http://127.0.0.1:{port}/dois"
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("7") == 7.0
+    assert parse_retry_after("-3") == 0.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    later = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=120), usegmt=True)
+    assert 110 < parse_retry_after(later) <= 120
+
+
+def test_delay_follows_retry_after_up_to_its_cap():
+    policy = RetryPolicy(backoff=1.0, max_backoff=8, max_retry_after=30)
+    assert policy.delay(1, retry_after=12) == 12
+    assert policy.delay(1, retry_after=3600) == 30
+    for attempt in range(1, 8):
+        assert 0 <= policy.delay(attempt) <= min(8, 2 ** (attempt - 1))
+
+
+def test_throttled_rows_wait_as_long_as_retry_after_asks(datacite):
+    mock, credentials = datacite(rate_limit=2, burst=1)
+    retries = []
+    finished = mint(credentials, import_records()[:3], concurrency=1,
+                    retry_policy=RetryPolicy(max_attempts=10),
+                    on_retry=lambda doi, result, attempt, delay: retries.append((result.status, delay)))
+    assert [result.status for _, _, result in finished] == [201, 201, 201]
+    assert mock.counts.get(429)
+    assert retries and all(retry == (429, 1.0) for retry in retries)
+
+
+def test_server_errors_are_retried_until_attempts_run_out(datacite):
+    mock, credentials = datacite(error_rate=1.0, seed=1)
+    retries = []
+    finished = mint(credentials, import_records()[:2], retry_policy=RetryPolicy(max_attempts=3, backoff=0),
+                    on_retry=lambda *args: retries.append(args))
+    assert [result.error_type for _, _, result in finished] == ["retryable", "retryable"]
+    assert len(retries) == 4
+    assert sum(mock.counts.values()) == 6
+
+
+def test_rejections_are_not_retried(datacite):
+    mock, credentials = datacite(reject_rate=1.0)
+    finished = mint(credentials, import_records()[:2], retry_policy=RetryPolicy(backoff=0))
+    assert [(result.status, result.error_type) for _, _, result in finished] == [(422, "permanent")] * 2
+    assert mock.counts == {422: 2}
+
+
+def test_refused_connections_are_retried():
+    retries = []
+    finished = mint({"url": closed_port_url(), "doiPrefix": "10.5555", "username": "user", "password": "secret"},
+                    import_records()[:1], retry_policy=RetryPolicy(max_attempts=3, backoff=0),
+                    on_retry=lambda *args: retries.append(args))
+    assert [result.error_type for _, _, result in finished] == ["retryable"]
+    assert len(retries) == 2
+
+
+def test_a_post_that_timed_out_is_not_sent_again(datacite):
+    mock, credentials = datacite(latency="fixed:500")
+    retries = []
+    finished = mint(credentials, import_records()[:1], retry_policy=RetryPolicy(read_timeout=0.1, backoff=0),
+                    on_retry=lambda *args: retries.append(args))
+    assert [result.error_type for _, _, result in finished] == ["ambiguous"]
+    assert not retries
+    time.sleep(0.6)
+    # The one request that was sent still minted its DOI
+    assert len(mock.dois) == 1
+
+
+def test_ambiguous_rows_are_held_back_on_resume(datacite, working_dir):
+    mock, credentials = datacite(latency="fixed:300")
+    output = str(working_dir / "export.csv")
+    summary = run_mint(sample_path("datacite_import.csv.sample"), output, credentials, only_rows={1},
+                       retry_policy=RetryPolicy(read_timeout=0.1), log_copy=False)
+    assert summary["ambiguous"] == 1
+    time.sleep(0.4)
+
+    summary = run_mint(sample_path("datacite_import.csv.sample"), output, credentials, resume=True,
+                       retry_policy=RetryPolicy(read_timeout=5), log_copy=False)
+    assert summary["submitted"] == 4
+    assert summary["ambiguous"] == 1
+    # Row 1's DOI from the first run, and rows 2, 4 and 5 (row 3 is rejected)
+    assert len(mock.dois) == 4
@@ -0,0 +1,68 @@
+from conftest import sample_path
+from super_duper.mint import run_mint
+from super_duper.records import MintResult, write_export_rows
+from super_duper.registry import LOOKUP_CHUNK, DoiRegistry
+
+SOURCE = "http://hdl.handle.net/10613/1955"
+MINTED = MintResult("Title", SOURCE, "https://doi.org/10.5555/abcd-1234", 201)
+TAKEN = MintResult("Title", SOURCE, None, 422, "This DOI has already been taken", "permanent")
+
+
+def test_a_201_is_never_replaced_by_a_failure(tmp_path):
+    with DoiRegistry(str(tmp_path / "registry.sqlite")) as registry:
+        registry.record(MINTED, "2024-01-01T00:00:00Z")
+        registry.record(TAKEN, "2024-06-01T00:00:00Z")
+        assert registry.get(SOURCE) == MINTED.doi
+        assert registry.counts() == {"201": 1}
+
+
+def test_older_outcomes_never_replace_newer_ones(tmp_path):
+    with DoiRegistry(str(tmp_path / "registry.sqlite")) as registry:
+        registry.record(TAKEN, "2024-06-01T00:00:00Z")
+        registry.record(MINTED, "2024-01-01T00:00:00Z")
+        assert registry.get(SOURCE) is None
+        registry.record(MINTED, "2024-07-01T00:00:00Z")
+        assert registry.get(SOURCE) == MINTED.doi
+
+
+def test_the_content_hash_is_kept_for_the_same_doi(tmp_path):
+    with DoiRegistry(str(tmp_path / "registry.sqlite")) as registry:
+        registry.record(MINTED, "2024-01-01T00:00:00Z", content_hash="abc")
+        registry.record(MINTED, "2024-02-01T00:00:00Z")
+        assert registry.minted_hashes([SOURCE]) == {SOURCE: (MINTED.doi, "abc")}
+
+
+def test_bulk_lookups_span_chunks(tmp_path):
+    results = [MintResult("", f"http://hdl.handle.net/10613/{n}", f"https://doi.org/10.5555/{n}", 201)
+               for n in range(LOOKUP_CHUNK * 2 + 10)]
+    with DoiRegistry(str(tmp_path / "registry.sqlite")) as registry:
+        registry.record_many(results)
+        found = registry.minted(result.source for result in results)
+        assert len(found) == len(results)
+        assert found[results[-1].source] == results[-1].doi
+
+
+def test_backfill_reads_each_log_once(tmp_path):
+    log = tmp_path / "log"
+    log.mkdir()
+    with open(log / "datacite_export_20240101_120000.csv", "w", encoding="utf-8", newline="") as file:
+        write_export_rows(file, [MINTED])
+    with DoiRegistry(str(tmp_path / "registry.sqlite")) as registry:
+        assert registry.backfill(str(log)) == (1, 1)
+        assert registry.backfill(str(log)) == (0, 0)
+        assert registry.get(SOURCE) == MINTED.doi
+
+
+def test_mint_skips_sources_the_registry_has(datacite, working_dir):
+    mock, credentials = datacite()
+    output = str(working_dir / "export.csv")
+    with DoiRegistry() as registry:
+        run_mint(sample_path("datacite_import.csv.sample"), output, credentials, registry=registry)
+        assert len(registry) == 4
+
+    # A fresh run of the same file, without its journal: only the rejected row goes again
+    with DoiRegistry() as registry:
+        summary = run_mint(sample_path("datacite_import.csv.sample"), output, credentials, registry=registry)
+    assert summary["already_registered"] == 4
+    assert summary["submitted"] == 1
+    assert mock.counts == {201: 4, 422: 2}
@@ -0,0 +1,97 @@
+import csv
+import json
+import os
+import time
+
+import super_duper.mint
+from conftest import sample_path
+from super_duper.shards import ShardLease, merge_shard_results, shard_stem, split_import, work_shards
+
+
+def take_over(path, owner, age=0):
+    """Write `path` as `owner`'s lease, last touched `age` seconds ago."""
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump({"owner": owner, "claimed": time.time()}, file)
+    when = time.time() - age
+    os.utime(path, (when, when))
+
+
+def test_a_live_lease_is_exclusive(tmp_path):
+    path = str(tmp_path / "shard-0000.lease")
+    first = ShardLease(path, "a", lease_seconds=60)
+    assert first.claim()
+    assert first.held()
+    assert not ShardLease(path, "b", lease_seconds=60).claim()
+
+
+def test_an_expired_lease_is_taken_over(tmp_path):
+    path = str(tmp_path / "shard-0000.lease")
+    first = ShardLease(path, "a", lease_seconds=60)
+    assert first.claim()
+    old = time.time() - 120
+    os.utime(path, (old, old))
+    assert not first.held()
+
+    second = ShardLease(path, "b", lease_seconds=60)
+    assert second.claim()
+    assert second.holder() == "b"
+    # The old owner letting go leaves the new owner's lease alone
+    first.release()
+    assert os.path.exists(path)
+    second.release()
+    assert not os.path.exists(path)
+
+
+def test_heartbeat_notices_a_takeover(tmp_path):
+    path = str(tmp_path / "shard-0000.lease")
+    lease = ShardLease(path, "a", lease_seconds=4)
+    assert lease.claim()
+    lease.start()
+    take_over(path, "b")
+    try:
+        assert lease.cancel.wait(5)
+        assert lease.lost.is_set()
+    finally:
+        lease.release()
+    assert ShardLease(path, None).holder() == "b"
+
+
+def test_workers_pick_up_expired_shards_and_skip_live_ones(datacite, working_dir):
+    _, credentials = datacite()
+    shard_dir = str(working_dir / "run")
+    split_import(sample_path("datacite_import.csv.sample"), shard_dir, 2)
+    take_over(f"{shard_stem(shard_dir, 0)}.lease", "crashed", age=600)
+    take_over(f"{shard_stem(shard_dir, 1)}.lease", "busy")
+
+    assert work_shards(shard_dir, credentials, lease_seconds=60, owner="b") == [0]
+    assert os.path.exists(f"{shard_stem(shard_dir, 0)}.done")
+    assert not os.path.exists(f"{shard_stem(shard_dir, 1)}.done")
+
+    os.unlink(f"{shard_stem(shard_dir, 1)}.lease")
+    assert work_shards(shard_dir, credentials, lease_seconds=60, owner="c") == [1]
+    output = str(working_dir / "export.csv")
+    summary = merge_shard_results(shard_dir, output)
+    assert (summary["total"], summary["successful"]) == (5, 4)
+    with open(output, "r", encoding="utf-8", newline="") as exported, \
+            open(sample_path("datacite_import.csv.sample"), "r", encoding="utf-8", newline="") as imported:
+        assert [row["source"] for row in csv.DictReader(exported)] == [row["source"] for row in csv.DictReader(imported)]
+
+
+def test_a_lease_lost_as_the_run_finishes_publishes_nothing(datacite, working_dir, monkeypatch):
+    _, credentials = datacite()
+    shard_dir = str(working_dir / "run")
+    split_import(sample_path("datacite_import.csv.sample"), shard_dir, 1)
+    lease_path = f"{shard_stem(shard_dir, 0)}.lease"
+    run_mint = super_duper.mint.run_mint
+
+    def run_mint_then_lose_lease(*args, **kwargs):
+        summary = run_mint(*args, **kwargs)
+        take_over(lease_path, "other")
+        return summary
+
+    monkeypatch.setattr(super_duper.mint, "run_mint", run_mint_then_lose_lease)
+    assert work_shards(shard_dir, credentials, lease_seconds=60, owner="a") == []
+    assert ShardLease(lease_path, None).holder() == "other"
+    assert not os.path.exists(f"{shard_stem(shard_dir, 0)}.done")
+    assert not os.path.exists(f"{shard_stem(shard_dir, 0)}.export.csv")
+    assert not [name for name in os.listdir(shard_dir) if ".export." in name]